@@ -0,0 +1,106 @@
+"""
+ログのTSV変換の処理速度を測るベンチマークスクリプト
+
+合成したSikiのログ(または--log-dirで指定したログフォルダ)を変換して、
+各段階の処理時間・投稿数/秒・MB/秒・最大メモリ使用量を表示し、JSONに保存する。
+--compareに前回のJSONを指定すると、前回の結果との比も表示する。
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+
+from mylib.benchmark.convert_benchmark import (
+    format_result,
+    load_result,
+    run_convert_benchmark,
+    save_result,
+)
+from mylib.benchmark.synthetic_log import generate_synthetic_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログのTSV変換のベンチマーク")
+    parser.add_argument(
+        "--log-dir",
+        help="合成ログの代わりに使うログフォルダ（フォルダ内のoutputに書き込まれます）",
+    )
+    parser.add_argument("--sites", type=int, default=2, help="合成ログのサイト数")
+    parser.add_argument(
+        "--boards", type=int, default=3, help="合成ログのサイトごとの掲示板数"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=50, help="合成ログの掲示板ごとのスレッド数"
+    )
+    parser.add_argument(
+        "--posts", type=int, default=200, help="合成ログのスレッドごとの平均投稿数"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="合成ログの乱数のシード")
+    parser.add_argument("--jobs", type=int, default=1, help="変換に使うプロセス数")
+    parser.add_argument("--all-data", action="store_true", help="alldata.tsvも出力する")
+    parser.add_argument(
+        "--format", default="tsv", choices=["tsv", "parquet"], help="出力形式"
+    )
+    parser.add_argument("--timezone", default="Asia/Tokyo", help="タイムゾーン")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="変換全体を繰り返して測る回数"
+    )
+    parser.add_argument(
+        "--output",
+        help="結果のJSONの保存先（デフォルト: ./output_benchmark/convert_日時.json）",
+    )
+    parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    args = parser.parse_args()
+
+    work_root = tempfile.mkdtemp(prefix="siki_benchmark_")
+    try:
+        log_dir = args.log_dir
+        if log_dir is None:
+            log_dir = os.path.join(work_root, "log")
+            print("合成ログを作成しています...")
+            stats = generate_synthetic_log(
+                log_dir, args.sites, args.boards, args.threads, args.posts, args.seed
+            )
+            print(
+                f"{stats['threads']}スレッド / {stats['posts']}投稿 / "
+                f"{stats['bytes'] / 2**20:.1f}MB"
+            )
+
+        print("変換の速度を測っています...")
+        result = run_convert_benchmark(
+            log_dir,
+            os.path.join(work_root, "work"),
+            jobs=args.jobs,
+            output_all_data=args.all_data,
+            output_format=args.format,
+            timezone=args.timezone,
+            repeat=args.repeat,
+        )
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    if args.log_dir is None:
+        result["synthetic_log"] = {
+            "sites": args.sites,
+            "boards_per_site": args.boards,
+            "threads_per_board": args.threads,
+            "posts_per_thread": args.posts,
+            "seed": args.seed,
+        }
+
+    previous = load_result(args.compare) if args.compare else None
+    for line in format_result(result, previous):
+        print(line)
+
+    output_path = args.output or os.path.join(
+        "./output_benchmark",
+        f"convert_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+    )
+    save_result(result, output_path)
+    print(f"結果を {output_path} に保存しました")
+
+
+if __name__ == "__main__":
+    main()
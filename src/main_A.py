@@ -6,49 +6,118 @@ import os
 
 import pytomlpp
 
+from mylib.siki_log.log_scan import SCAN_CACHE_FILE_NAME
+from mylib.text_wakatigaki.text_normalize import TextNormalizer
+from mylib.text_wakatigaki.token_corpus_cache import TokenizedCorpusCache
+from mylib.text_wakatigaki.token_filter import TokenFilter
 from mylib.text_wakatigaki.use_vibrato import VibratoTokenizer
+from mylib.text_wakatigaki.vibrato_pool import create_tokenizer
 from mylib.word_analysis.log_word_analysis import BBSLogAnalyzer
 
-# 設定ファイルのtomlを読み込む
-with open("./config/config.toml", mode="r", encoding="utf-8") as f:
-    text = f.read()
-print("Tomlの読込")
-config_doc = pytomlpp.loads(text)
+# Windowsでプロセスプールを使う場合、子プロセスでこのスクリプトが再実行されないようにする
+if __name__ == "__main__":
+    # 設定ファイルのtomlを読み込む
+    with open("./config/config.toml", mode="r", encoding="utf-8") as f:
+        text = f.read()
+    print("Tomlの読込")
+    config_doc = pytomlpp.loads(text)
 
-# output先のフォルダが存在しない場合は作成する
-if os.path.isdir(config_doc["output_dir_direct_analysis"]):
-    pass
-else:
-    os.makedirs(config_doc["output_dir_direct_analysis"])
+    # output先のフォルダが存在しない場合は作成する
+    if os.path.isdir(config_doc["output_dir_direct_analysis"]):
+        pass
+    else:
+        os.makedirs(config_doc["output_dir_direct_analysis"])
 
+    # Vibratoで形態素解析＆分かち書きするやつをインスタンス化
+    # （tokenize_processesが2以上なら、複数のプロセスで形態素解析する）
+    tokenizer = create_tokenizer(
+        config_doc["vibrato_dict_pass"],
+        config_doc.get("tokenize_processes", 1),
+        config_doc.get("vibrato_dict_cache", False),
+        # 形態素解析の前のテキストの正規化の設定
+        TextNormalizer.from_config(config_doc),
+        # 同じテキストの解析結果を覚えておく件数（0ならキャッシュしない）
+        config_doc.get("tokenize_cache_size", 0),
+        # 形態素解析した単語を品詞やストップワードで絞り込む設定
+        TokenFilter.from_config(config_doc),
+    )
+    # 形態素解析の結果をディスクに保存して、次回からはそれを使う場合
+    if config_doc.get("tokenized_cache", False):
+        tokenizer = TokenizedCorpusCache(
+            tokenizer, config_doc.get("tokenized_cache_dir", "./tokenized_cache")
+        )
+    # 掲示板ログの解析するやつをインスタンス化
+    analyzer = BBSLogAnalyzer(
+        config_doc["siki_logfile_pass"],
+        tokenizer,
+        timezone=config_doc.get("timezone", "Asia/Tokyo"),
+        # ログフォルダ内のファイルの一覧を保存して次回使う場合は、保存先を指定する
+        scan_cache_path=(
+            os.path.join(config_doc["output_dir_direct_analysis"], SCAN_CACHE_FILE_NAME)
+            if config_doc.get("log_scan_cache", False)
+            else None
+        ),
+        # 出現回数を数えるN-gramのN
+        ngram_sizes=config_doc.get("analyze_ngram_sizes", []),
+        # 読み込み・JSONの解析・形態素解析・集計を並行して行うかどうか
+        pipeline=config_doc.get("analyze_pipeline", False),
+        # 掲示板ごとに解析するプロセスの数と、掲示板ごとの解析結果の保存先
+        processes=config_doc.get("analyze_processes", 1),
+        partial_dir=config_doc.get("analyze_partial_dir") or None,
+        # 解析の途中経過の保存先と保存する間隔(秒)、途中経過から再開するかどうか
+        checkpoint_path=config_doc.get("analyze_checkpoint_path") or None,
+        checkpoint_interval=config_doc.get("analyze_checkpoint_interval", 600),
+        resume=config_doc.get("analyze_resume", False),
+        # 対象の単語だけを数える場合は、対象の単語のリスト
+        target_words=(
+            config_doc["analyze_target_words"]
+            if config_doc.get("analyze_target_only", False)
+            else None
+        ),
+        # 転置インデックスを作る場合は、その保存先
+        index_path=config_doc.get("analyze_index_path") or None,
+    )
+
+    # ログを解析
+    analyzer.analyze_all_logs()
+    # トークンキャッシュを使った場合は、ヒット数とミス数を表示
+    if isinstance(tokenizer, VibratoTokenizer) and tokenizer.cache_size > 0:
+        print(f"トークンキャッシュ: {tokenizer.cache_info()}")
+    if isinstance(tokenizer, TokenizedCorpusCache):
+        print(f"形態素解析の結果のキャッシュ: {tokenizer.cache_info()}")
+    tokenizer.close()
 
-# Vibratoで形態素解析＆分かち書きするやつをインスタンス化
-tokenizer = VibratoTokenizer(config_doc["vibrato_dict_pass"])
-# 掲示板ログの解析するやつをインスタンス化
-analyzer = BBSLogAnalyzer(config_doc["siki_logfile_pass"], tokenizer)
+    # 結果を取得
+    top_words = analyzer.get_word_frequency(10)  # 上位10件の単語を表示
+    print(top_words)
 
-# ログを解析
-analyzer.analyze_all_logs()
+    # 特定の単語の月別カウントを取得
+    monthly_counts = analyzer.get_monthly_word_count("日本")
 
-# 結果を取得
-top_words = analyzer.get_word_frequency(10)  # 上位10件の単語を表示
-print(top_words)
+    # 結果をエクスポート
+    analyzer.export_word_frequency(
+        f"{config_doc['output_dir_direct_analysis']}/word_freq.csv"
+    )
 
-# 特定の単語の月別カウントを取得
-monthly_counts = analyzer.get_monthly_word_count("日本")
+    # N-gramの出現回数をエクスポート
+    for num in config_doc.get("analyze_ngram_sizes", []):
+        analyzer.export_ngram_frequency(
+            num, f"{config_doc['output_dir_direct_analysis']}/ngram_{num}_freq.csv"
+        )
 
-# 結果をエクスポート
-analyzer.export_word_frequency(
-    f"{config_doc['output_dir_direct_analysis']}/word_freq.csv"
-)
+    # 全単語の月別出現回数をエクスポート
+    if config_doc.get("analyze_export_all_monthly", False):
+        analyzer.export_all_monthly_word_counts(
+            f"{config_doc['output_dir_direct_analysis']}/monthly_word_count_all.csv"
+        )
 
-target_words = config_doc["analyze_target_words"]
+    target_words = config_doc["analyze_target_words"]
 
-for word in target_words:
-    analyzer.export_monthly_word_count(
-        word, f"{config_doc['output_dir_direct_analysis']}/{word}_monthly.csv"
-    )
-    # グラフを作成
-    analyzer.plot_monthly_word_count(
-        word, f"{config_doc['output_dir_direct_analysis']}/{word}_trend.png"
-    )
+    for word in target_words:
+        analyzer.export_monthly_word_count(
+            word, f"{config_doc['output_dir_direct_analysis']}/{word}_monthly.csv"
+        )
+        # グラフを作成
+        analyzer.plot_monthly_word_count(
+            word, f"{config_doc['output_dir_direct_analysis']}/{word}_trend.png"
+        )
@@ -0,0 +1,74 @@
+"""
+main_A.pyで作った転置インデックスから、単語の月別出現回数・多く出てきたスレッド・
+掲示板ごとの出現回数を表示するスクリプト
+
+形態素解析し直さないので、どの単語でもすぐに調べられる。
+例: python src/main_A_2.py 日本 りんご --top-threads 5 --boards
+"""
+
+import argparse
+import time
+
+import pytomlpp
+
+from mylib.word_analysis.inverted_index import InvertedIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="転置インデックスで単語を調べる")
+    parser.add_argument("words", nargs="+", help="調べる単語")
+    parser.add_argument(
+        "--index",
+        help="転置インデックスのファイル（デフォルト: 設定ファイルのanalyze_index_path）",
+    )
+    parser.add_argument(
+        "--config", default="./config/config.toml", help="設定ファイルのパス"
+    )
+    parser.add_argument(
+        "--top-threads",
+        type=int,
+        default=10,
+        help="表示する、単語が多く出てきたスレッドの数（0なら表示しない）",
+    )
+    parser.add_argument(
+        "--boards", action="store_true", help="掲示板ごとの出現回数も表示する"
+    )
+    args = parser.parse_args()
+
+    index_path = args.index
+    if not index_path:
+        with open(args.config, mode="r", encoding="utf-8") as f:
+            config_doc = pytomlpp.loads(f.read())
+        index_path = config_doc.get("analyze_index_path")
+    if not index_path:
+        parser.error("--indexか、設定ファイルのanalyze_index_pathを指定してください")
+
+    with InvertedIndex(index_path) as index:
+        for word in args.words:
+            start = time.perf_counter()
+            monthly_counts = index.monthly_counts(word)
+            top_threads = (
+                index.top_threads(word, args.top_threads) if args.top_threads else []
+            )
+            board_counts = index.board_counts(word) if args.boards else []
+            elapsed = time.perf_counter() - start
+
+            print(f"=== {word} ({elapsed * 1000:.1f}ms) ===")
+            if not monthly_counts and not top_threads and not board_counts:
+                print("見つかりませんでした")
+                continue
+            print("月別出現回数:")
+            for year_month, count in monthly_counts:
+                print(f"  {year_month}: {count}")
+            if top_threads:
+                print("多く出てきたスレッド:")
+                for site, board, threadkey, title, count in top_threads:
+                    print(f"  {count}回 {site}/{board}/{threadkey} {title or ''}")
+            if board_counts:
+                print("掲示板ごとの出現回数:")
+                for site, board, count in board_counts:
+                    print(f"  {site}/{board}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,37 +8,63 @@ import pytomlpp
 
 import mylib.logdata_convert.log_convert_tsv as log_convert
 
-# 設定ファイルのtomlを読み込む
-with open("./config/config.toml", mode="r", encoding="utf-8") as f:
-    text = f.read()
-config_doc = pytomlpp.loads(text)
+# Windowsでプロセスプールを使う場合、子プロセスでこのスクリプトが再実行されないようにする
+if __name__ == "__main__":
+    # 設定ファイルのtomlを読み込む
+    with open("./config/config.toml", mode="r", encoding="utf-8") as f:
+        text = f.read()
+    config_doc = pytomlpp.loads(text)
 
-# 処理対象のルートディレクトリ（ログフォルダ）
-log_folder_path = config_doc["siki_logfile_pass"]
+    # 処理対象のルートディレクトリ（ログフォルダ）
+    log_folder_path = config_doc["siki_logfile_pass"]
 
-# csvを出力するフォルダ
-output_dir: str = config_doc["output_dir_convert_tsv"]
-# output先のフォルダが存在しない場合は作成する
-if os.path.isdir(config_doc["output_dir_convert_tsv"]):
-    pass
-else:
-    os.makedirs(config_doc["output_dir_convert_tsv"])
+    # csvを出力するフォルダ
+    output_dir: str = config_doc["output_dir_convert_tsv"]
+    # output先のフォルダが存在しない場合は作成する
+    if os.path.isdir(config_doc["output_dir_convert_tsv"]):
+        pass
+    else:
+        os.makedirs(config_doc["output_dir_convert_tsv"])
 
+    # 変換に使うプロセス数（1なら並列化しない）
+    convert_jobs: int = config_doc.get("convert_jobs", 1)
+    # 前回から変更の無いスレッドを読み込まずに変換するかどうか
+    convert_incremental: bool = config_doc.get("convert_incremental", False)
+    convert_use_hash: bool = config_doc.get("convert_use_hash", False)
+    # 出力形式（"tsv" または "parquet"）
+    output_format: str = config_doc.get("output_format", "tsv")
+    # TSVの圧縮形式（"none" または "zstd"）
+    tsv_compression: str = config_doc.get("tsv_compression", "none")
+    # 投稿日時などを変換するタイムゾーン
+    timezone: str = config_doc.get("timezone", "Asia/Tokyo")
+    # ログフォルダ内のファイルの一覧を保存して次回使うかどうか
+    log_scan_cache: bool = config_doc.get("log_scan_cache", False)
 
-# 全データを出力するかどうかの選択
-output_all_data: bool = (
-    input("全データを含むファイル(alldata.tsv)も出力しますか？ (y/n): ").lower() == "y"
-)
+    # 全データを出力するかどうかの選択
+    output_all_data: bool = (
+        input("全データを含むファイル(alldata.tsv)も出力しますか？ (y/n): ").lower()
+        == "y"
+    )
 
-# 以前の出力をクリアするかどうか：設定ミス対策でやっぱ無しで
-# clear_previous: bool = input("以前の出力結果をクリアしますか？ (y/n): ").lower() == "y"
+    # 以前の出力をクリアするかどうか：設定ミス対策でやっぱ無しで
+    # clear_previous: bool = input("以前の出力結果をクリアしますか？ (y/n): ").lower() == "y"
 
+    # if clear_previous:
+    #     if os.path.exists(output_dir):
+    #         shutil.rmtree(output_dir)
+    #         print("以前の出力をクリアしました。")
 
-# if clear_previous:
-#     if os.path.exists(output_dir):
-#         shutil.rmtree(output_dir)
-#         print("以前の出力をクリアしました。")
-
-# 処理開始
-print("\n処理を開始します...")
-log_convert.process_log_folder(log_folder_path, output_dir, output_all_data)
+    # 処理開始
+    print("\n処理を開始します...")
+    log_convert.process_log_folder(
+        log_folder_path,
+        output_dir,
+        output_all_data,
+        jobs=convert_jobs,
+        incremental=convert_incremental,
+        use_hash=convert_use_hash,
+        output_format=output_format,
+        timezone=timezone,
+        scan_cache=log_scan_cache,
+        compression=tsv_compression,
+    )
@@ -9,16 +9,35 @@ import pytomlpp
 import mylib.word_analysis.csv_word_analysis as cwa
 
 # 自作モジュールのインポート
+from mylib.logdata_convert.tsv_compression import tsv_file_name
+from mylib.text_wakatigaki.text_normalize import TextNormalizer
+from mylib.text_wakatigaki.token_corpus_cache import TokenizedCorpusCache
+from mylib.text_wakatigaki.token_filter import TokenFilter
 from mylib.text_wakatigaki.use_vibrato import VibratoTokenizer
+from mylib.text_wakatigaki.vibrato_pool import create_tokenizer
 
 
 def analyze_board_data(
-    csv_dir: str, target_words: list[str], vibrato_instance: VibratoTokenizer
+    csv_dir: str,
+    target_words: list[str],
+    vibrato_instance: VibratoTokenizer,
+    output_format: str = "tsv",
+    tsv_compression: str = "none",
+    target_only: bool = False,
+    sites: list[str] = None,
+    boards: list[str] = None,
+    month_from: str = "",
+    month_to: str = "",
 ):
-    # ファイルパスの設定
+    # ファイルパスの設定（Parquetの場合、投稿はpostsフォルダに分割されている）
     base_dir = Path(csv_dir)
-    threads_path: Path = base_dir / "threads.tsv"
-    posts_path: Path = base_dir / "posts.tsv"
+    if output_format == "parquet":
+        threads_path: Path = base_dir / "threads.parquet"
+        posts_path: Path = base_dir / "posts"
+    else:
+        # zstdで圧縮した場合は.tsv.zst
+        threads_path: Path = base_dir / tsv_file_name("threads.tsv", tsv_compression)
+        posts_path: Path = base_dir / tsv_file_name("posts.tsv", tsv_compression)
     output_dir: Path = base_dir / "board_analysis"
 
     # 出力ディレクトリを作成
@@ -38,6 +57,12 @@ def analyze_board_data(
         target_words=target_words,
         output_dir=str(output_dir),
         generate_graphs=True,
+        target_only=target_only,
+        # Parquetの場合に、分析するサイト・掲示板・年月
+        sites=sites,
+        boards=boards,
+        month_from=month_from,
+        month_to=month_to,
     )
 
     # 分析結果の表示
@@ -107,14 +132,40 @@ if __name__ == "__main__":
     config_doc = pytomlpp.loads(text)
 
     # Vibratoで形態素解析＆分かち書きするやつをインスタンス化
-    tokenizer = VibratoTokenizer(config_doc["vibrato_dict_pass"])
+    # （tokenize_processesが2以上なら、複数のプロセスで形態素解析する）
+    tokenizer = create_tokenizer(
+        config_doc["vibrato_dict_pass"],
+        config_doc.get("tokenize_processes", 1),
+        config_doc.get("vibrato_dict_cache", False),
+        # 形態素解析の前のテキストの正規化の設定
+        TextNormalizer.from_config(config_doc),
+        # 同じテキストの解析結果を覚えておく件数（0ならキャッシュしない）
+        config_doc.get("tokenize_cache_size", 0),
+        # 形態素解析した単語を品詞やストップワードで絞り込む設定
+        TokenFilter.from_config(config_doc),
+    )
+    # 形態素解析の結果をディスクに保存して、次回からはそれを使う場合
+    if config_doc.get("tokenized_cache", False):
+        tokenizer = TokenizedCorpusCache(
+            tokenizer, config_doc.get("tokenized_cache_dir", "./tokenized_cache")
+        )
 
     # デフォルトの分析を実行
     analyze_board_data(
         config_doc["output_dir_convert_tsv"],
         config_doc["analyze_target_words"],
         tokenizer,
+        config_doc.get("output_format", "tsv"),
+        config_doc.get("tsv_compression", "none"),
+        # 対象の単語だけを数える(対象の単語を含むテキストだけを形態素解析する)かどうか
+        config_doc.get("analyze_target_only", False),
+        # Parquetの場合に、分析するサイト・掲示板・年月で絞り込む（空なら全て）
+        config_doc.get("analyze_sites", []),
+        config_doc.get("analyze_boards", []),
+        config_doc.get("analyze_month_from", ""),
+        config_doc.get("analyze_month_to", ""),
     )
+    tokenizer.close()
 
     # 例: カスタム分析の実行
     # analyze_custom_files(
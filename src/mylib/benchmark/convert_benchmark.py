@@ -0,0 +1,272 @@
+"""
+ログのTSV変換(process_log_folder)の処理速度を測るモジュール
+
+変換の各段階(走査・読み込み・JSONの解析・行データの作成・TSVの書き込み)の時間を、
+process_log_folderと同じ関数を逐次呼び出して測り、process_log_folder全体の
+時間・投稿数/秒・MB/秒・最大メモリ使用量と一緒に辞書にまとめる。
+結果はJSONに保存して、前回の結果と比べられる。
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import polars as pl
+
+from ..logdata_convert.log_convert_tsv import (
+    TIMESTAMP_BATCH_POSTS,
+    TsvOutputSet,
+    build_thread_rows,
+    process_log_folder,
+)
+from ..siki_log.log_scan import scan_log_folder
+from ..siki_log.siki_json import decode_thread, get_backend
+from ..siki_log.siki_time import DEFAULT_TIMEZONE
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # Windowsには無い
+    resource = None
+
+# 時間を測る変換の段階
+STAGES = ["scan", "read", "parse", "row_build", "write"]
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """このプロセスと(終了した)子プロセスの最大メモリ使用量(MB)を返す"""
+    if resource is not None:
+        # Linuxではキロバイト、macOSではバイト単位
+        unit = 1 if sys.platform == "darwin" else 1024
+        return {
+            "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            * unit
+            / 2**20,
+        }
+    if psutil is not None:
+        # Windowsではpeak_wsetが最大メモリ使用量（子プロセスの分は取得できない）
+        peak = getattr(psutil.Process().memory_info(), "peak_wset", None)
+        if peak is not None:
+            return {"self": peak / 2**20, "children": None}
+    return {"self": None, "children": None}
+
+
+def measure_stages(
+    log_dir: str,
+    output_dir: str,
+    output_all_data: bool = False,
+    timezone: str = DEFAULT_TIMEZONE,
+) -> Tuple[Dict[str, float], int]:
+    """
+    変換の各段階にかかった時間(秒)を測り、(段階ごとの時間, 投稿数)を返す
+
+    process_log_folderを逐次処理(jobs=1)で実行した場合と同じ関数を、段階ごとに
+    分けて呼び出す。投稿行はTIMESTAMP_BATCH_POSTS件程度ずつまとめて作り、
+    全サイト集計用のTSVだけをoutput_dirに書き込む。
+    """
+    times = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    log_index = scan_log_folder(log_dir)
+    times["scan"] = time.perf_counter() - start
+
+    output = TsvOutputSet(output_dir, output_all_data)
+
+    def write_rows(board_info: dict, pending: list) -> None:
+        start = time.perf_counter()
+        thread_results = list(build_thread_rows(pending, timezone))
+        times["row_build"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for thread_row, post_rows, _ in thread_results:
+            output.write_thread(board_info, thread_row, post_rows)
+        times["write"] += time.perf_counter() - start
+
+    for board in log_index.iter_boards():
+        start = time.perf_counter()
+        subject_data = board.load_subject()
+        times["parse"] += time.perf_counter() - start
+
+        board_info = {"title": subject_data.title, "location": subject_data.location}
+        output.write_board(board_info, board.path)
+
+        pending = []
+        pending_posts = 0
+        for thread in subject_data.items:
+            file_name = f"{thread.threadkey}.json"
+            if file_name not in board.thread_files:
+                continue
+
+            start = time.perf_counter()
+            with open(os.path.join(board.path, file_name), "rb") as f:
+                data = f.read()
+            times["read"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            thread_data = decode_thread(data)
+            times["parse"] += time.perf_counter() - start
+
+            thread_info = (
+                subject_data.location,
+                thread.threadkey,
+                thread.title,
+                thread.resnum,
+                thread.location,
+            )
+            pending.append((thread_info, thread_data, {}))
+            pending_posts += len(thread_data.thread_array)
+            if pending_posts >= TIMESTAMP_BATCH_POSTS:
+                write_rows(board_info, pending)
+                pending = []
+                pending_posts = 0
+        write_rows(board_info, pending)
+
+    start = time.perf_counter()
+    output.close()
+    times["write"] += time.perf_counter() - start
+    return times, output.posts.count
+
+
+def run_convert_benchmark(
+    log_dir: str,
+    work_dir: str,
+    jobs: int = 1,
+    output_all_data: bool = False,
+    output_format: str = "tsv",
+    timezone: str = DEFAULT_TIMEZONE,
+    repeat: int = 1,
+) -> dict:
+    """
+    ログフォルダの変換速度を測り、結果を辞書で返す
+
+    work_dirには変換結果を書き込む（測定後に削除する）。process_log_folderは
+    repeat回実行して、最も速かった回の時間で投稿数/秒・MB/秒を計算する。
+    各段階の時間を先に測るので、ログファイルはOSのキャッシュに載った状態で測る。
+    """
+    log_index = scan_log_folder(log_dir)
+    input_bytes = sum(
+        board.subject_stat[0] + sum(f.size for f in board.thread_files.values())
+        for board in log_index.iter_boards()
+    )
+
+    # サイトごとの出力はログフォルダ内のoutputフォルダに書き込まれる
+    site_output_dir = os.path.join(log_dir, "output")
+    keep_site_output = os.path.exists(site_output_dir)
+
+    os.makedirs(work_dir, exist_ok=True)
+    stage_dir = os.path.join(work_dir, "stages")
+    convert_dir = os.path.join(work_dir, "convert")
+    try:
+        stages, post_count = measure_stages(
+            log_dir, stage_dir, output_all_data, timezone
+        )
+
+        totals = []
+        for _ in range(repeat):
+            shutil.rmtree(convert_dir, ignore_errors=True)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                process_log_folder(
+                    log_dir,
+                    convert_dir,
+                    output_all_data,
+                    jobs=jobs,
+                    output_format=output_format,
+                    timezone=timezone,
+                )
+            totals.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not keep_site_output:
+            shutil.rmtree(site_output_dir, ignore_errors=True)
+
+    # platformモジュールは子プロセスを起動することがあるので、先に測る
+    peak_rss = peak_rss_mb()
+    best = min(totals)
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "polars": pl.__version__,
+            "json_backend": get_backend(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {
+            "jobs": jobs,
+            "output_all_data": output_all_data,
+            "output_format": output_format,
+            "timezone": timezone,
+            "repeat": repeat,
+        },
+        "input": {
+            "sites": len(log_index.sites),
+            "boards": sum(len(site.boards) for site in log_index.sites),
+            "threads": sum(
+                len(board.thread_files) for board in log_index.iter_boards()
+            ),
+            "posts": post_count,
+            "bytes": input_bytes,
+        },
+        "stage_seconds": stages,
+        "total_seconds": totals,
+        "posts_per_sec": post_count / best if best else None,
+        "mb_per_sec": input_bytes / 2**20 / best if best else None,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def save_result(result: dict, output_path: str) -> None:
+    """結果をJSONファイルに保存する"""
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def load_result(path: str) -> dict:
+    """保存した結果を読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_result(result: dict, previous: Optional[dict] = None) -> List[str]:
+    """結果を表示用の行にする（previousを渡すと前回の結果との比も表示する）"""
+
+    def ratio(current: Optional[float], before: Optional[float]) -> str:
+        if previous is None or not current or not before:
+            return ""
+        return f" (前回比 x{current / before:.2f})"
+
+    lines = [
+        "入力: {sites}サイト / {boards}掲示板 / {threads}スレッド / {posts}投稿 / "
+        "{mb:.1f}MB".format(mb=result["input"]["bytes"] / 2**20, **result["input"])
+    ]
+    for stage, seconds in result["stage_seconds"].items():
+        before = previous["stage_seconds"].get(stage) if previous else None
+        lines.append(f"- {stage}: {seconds:.3f}秒{ratio(seconds, before)}")
+    best = min(result["total_seconds"])
+    before = min(previous["total_seconds"]) if previous else None
+    lines.append(f"全体: {best:.3f}秒{ratio(best, before)}")
+    for key, label in (("posts_per_sec", "投稿/秒"), ("mb_per_sec", "MB/秒")):
+        before = previous.get(key) if previous else None
+        lines.append(f"{label}: {result[key]:,.1f}{ratio(result[key], before)}")
+    peak = result["peak_rss_mb"]
+    if peak["self"] is not None:
+        children = f" (子プロセス {peak['children']:.1f}MB)" if peak["children"] else ""
+        lines.append(f"最大メモリ使用量: {peak['self']:.1f}MB{children}")
+    return lines
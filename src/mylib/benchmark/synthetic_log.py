@@ -0,0 +1,176 @@
+"""
+ベンチマーク用に、Sikiのログフォルダと同じ構成の合成ログを作るモジュール
+
+ログフォルダ/サイト/掲示板/subject.json と {threadkey}.json を作る。
+書き込みの本文の長さは、短い書き込みが多く、まれに長い書き込みがある
+実際の掲示板に近い分布(対数正規分布)にする。
+"""
+
+import json
+import math
+import os
+import random
+from typing import Dict, List, Tuple
+
+# 本文を作るための文の断片
+BODY_FRAGMENTS = [
+    "それな",
+    "わかる",
+    "草",
+    "マジかよ",
+    "今日は雨が降っている",
+    "昨日のニュース見た？",
+    "この値段なら買いだと思う",
+    "正直よくわからん",
+    "ソースはどこ？",
+    "日本の経済はこれからどうなるんだろう",
+    "りんごを食べながら書き込んでる",
+    "ゴリラの握力はすごいらしい",
+    "社長が急に会議を始めた",
+    "電車が遅れてて遅刻しそう",
+    "スレタイ読めよ",
+    "もう少し詳しく教えてほしい",
+    "それは違うと思うけどな",
+    "ワロタ",
+    "このスレ伸びるな",
+    "初心者なんだけど質問していい？",
+]
+PUNCTUATION = ["。", "、", "！", "？", "", "w", "…"]
+NAMES = [
+    "名無しさん",
+    "名無しさん@お腹いっぱい。",
+    "風吹けば名無し",
+    "以下、名無しにかわりまして",
+]
+
+# 本文の文字数の分布（中央値と、対数正規分布のばらつき）
+BODY_MEDIAN_CHARS = 35
+BODY_SIGMA = 0.9
+BODY_MAX_CHARS = 2000
+
+
+def make_body(rng: random.Random, post_num: int) -> Tuple[str, List[int]]:
+    """
+    書き込みの本文と返信先のレス番号のリストを作る
+    （本文は改行・アンカー・URLを含むことがある）
+    """
+    target_chars = min(
+        BODY_MAX_CHARS,
+        max(1, int(rng.lognormvariate(math.log(BODY_MEDIAN_CHARS), BODY_SIGMA))),
+    )
+    # 3割程度の書き込みは、先頭で前の書き込みに返信する
+    anchors = []
+    anchor_text = ""
+    if post_num > 1 and rng.random() < 0.3:
+        anchors.append(rng.randint(1, post_num - 1))
+        anchor_text = f">>{anchors[0]}\n"
+
+    parts = []
+    length = 0
+    while length < target_chars:
+        part = rng.choice(BODY_FRAGMENTS) + rng.choice(PUNCTUATION)
+        if rng.random() < 0.15:
+            part += "\n"
+        if rng.random() < 0.02:
+            part += f"https://example.com/{rng.randint(0, 99999)}"
+        parts.append(part)
+        length += len(part)
+    return anchor_text + "".join(parts)[:target_chars], anchors
+
+
+def make_thread(
+    rng: random.Random, thread_title: str, established: int, post_count: int
+) -> dict:
+    """スレッドのログファイル({threadkey}.json)の内容を作る"""
+    posts = []
+    timestamp = established
+    for num in range(1, post_count + 1):
+        body, anchors = make_body(rng, num)
+        posts.append(
+            {
+                "num": num,
+                "an": num + 1,
+                "mname": rng.choice(NAMES),
+                "mail": "sage" if rng.random() < 0.4 else "",
+                "timestamp": timestamp,
+                "chars": len(body),
+                "body": body,
+                "anchor_an": anchors,
+                "ancfrom": [],
+            }
+        )
+        # 次の書き込みまでの間隔（数秒〜数時間）
+        timestamp += int(rng.expovariate(1 / 600_000)) + 1000
+
+    # 返信元(ancfrom)を返信先(anchor_an)から作る
+    for post in posts:
+        for anchor in post["anchor_an"]:
+            posts[anchor - 1]["ancfrom"].append(post["num"])
+
+    return {"title": thread_title, "established": established, "thread_array": posts}
+
+
+def generate_synthetic_log(
+    log_dir: str,
+    sites: int = 2,
+    boards_per_site: int = 3,
+    threads_per_board: int = 50,
+    posts_per_thread: int = 200,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    合成ログをlog_dirに作り、作ったファイルの数などを返す
+
+    スレッドごとの書き込み数は、posts_per_threadの半分から1.5倍までの範囲で
+    ばらつかせる。seedが同じなら同じ内容のログを作る。
+    """
+    rng = random.Random(seed)
+    stats = {"sites": 0, "boards": 0, "threads": 0, "posts": 0, "bytes": 0}
+    base_time = 1_600_000_000_000
+
+    def write_json(path: str, data: dict) -> None:
+        encoded = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(encoded)
+        stats["bytes"] += len(encoded)
+
+    for site_num in range(sites):
+        site_dir = os.path.join(log_dir, f"site{site_num}")
+        stats["sites"] += 1
+        for board_num in range(boards_per_site):
+            board_dir = os.path.join(site_dir, f"board{board_num}")
+            os.makedirs(board_dir, exist_ok=True)
+            board_location = f"https://site{site_num}.example.com/board{board_num}/"
+            items = []
+            for thread_num in range(threads_per_board):
+                threadkey = str(base_time // 1000 + thread_num * 3600)
+                thread_title = f"{rng.choice(BODY_FRAGMENTS)}スレ{thread_num}"
+                post_count = max(
+                    1,
+                    rng.randint(posts_per_thread // 2, posts_per_thread * 3 // 2),
+                )
+                established = base_time + thread_num * 3_600_000
+                write_json(
+                    os.path.join(board_dir, f"{threadkey}.json"),
+                    make_thread(rng, thread_title, established, post_count),
+                )
+                items.append(
+                    {
+                        "threadkey": threadkey,
+                        "title": thread_title,
+                        "location": f"{board_location}{threadkey}",
+                        "resnum": post_count,
+                    }
+                )
+                stats["threads"] += 1
+                stats["posts"] += post_count
+            write_json(
+                os.path.join(board_dir, "subject.json"),
+                {
+                    "title": f"合成掲示板{site_num}-{board_num}",
+                    "location": board_location,
+                    "items": items,
+                },
+            )
+            stats["boards"] += 1
+    return stats
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+MANIFEST_FILE_NAME = "convert_manifest.json"
+MANIFEST_VERSION = 2
+
+
+def hash_file_content(data: bytes) -> str:
+    """ファイルの内容のハッシュ値を返す"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ConvertManifest:
+    """
+    前回のTSV変換で読み込んだスレッドファイルの一覧（マニフェスト）
+
+    スレッドファイルごとに、サイズ・更新日時(・内容のハッシュ値)と、
+    全サイト集計用のposts.tsvの中でそのスレッドの投稿行が
+    書かれているバイト範囲を記録する。次回の変換では、変更の無いスレッドは
+    JSONを読み込まずに、前回の出力からそのバイト範囲をコピーして使う。
+
+    boardsの中身は {掲示板フォルダのパス: {スレッドファイル名: エントリ}}。
+    output_sizesには、前回の出力ファイルが書き換えられていないか確認するために
+    出力したファイルのサイズを記録する。
+    """
+
+    def __init__(self, settings: Optional[dict] = None):
+        self.settings = settings or {}
+        self.boards: Dict[str, Dict[str, dict]] = {}
+        self.output_sizes: Dict[str, int] = {}
+
+    @classmethod
+    def load(cls, output_dir: str) -> Optional["ConvertManifest"]:
+        """出力フォルダからマニフェストを読み込む（無い場合や形式が違う場合はNone）"""
+        manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+
+        manifest = cls(data.get("settings", {}))
+        manifest.boards = data.get("boards", {})
+        manifest.output_sizes = data.get("output_sizes", {})
+        return manifest
+
+    def save(self, output_dir: str) -> None:
+        """マニフェストを出力フォルダに保存する（一時ファイルに書いてから置き換える）"""
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "settings": self.settings,
+                    "output_sizes": self.output_sizes,
+                    "boards": self.boards,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, manifest_path)
+
+    def board_entries(self, board_folder_path: str) -> Dict[str, dict]:
+        """掲示板フォルダ内のスレッドファイルのエントリを返す"""
+        return self.boards.get(board_folder_path, {})
+
+    def record(self, board_folder_path: str, entry: dict) -> None:
+        """スレッドファイルのエントリを記録する"""
+        self.boards.setdefault(board_folder_path, {})[entry["file_name"]] = entry
+
+
+def is_unchanged(previous: Optional[dict], size: int, mtime_ns: int) -> bool:
+    """前回のエントリとサイズ・更新日時が一致するか"""
+    return (
+        previous is not None
+        and previous.get("size") == size
+        and previous.get("mtime_ns") == mtime_ns
+    )
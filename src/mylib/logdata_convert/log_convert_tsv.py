@@ -1,16 +1,257 @@
 import csv
-import datetime
-import json
+import io
+import itertools
 import os
 import shutil
-from typing import Dict, List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import polars as pl
 
-def convert_unix_timestamp(timestamp: int) -> str:
-    """UNIXタイムスタンプを読みやすい日時形式に変換する"""
-    return datetime.datetime.fromtimestamp(timestamp / 1000).strftime(
-        "%Y-%m-%d %H:%M:%S"
+from ..siki_log.log_scan import (
+    SCAN_CACHE_FILE_NAME,
+    BoardIndex,
+    ThreadFileInfo,
+    scan_log_folder,
+    scan_site_folder,
+)
+from ..siki_log.siki_json import SikiSubject, SikiThread, decode_thread, load_subject
+from ..siki_log.siki_time import (
+    DEFAULT_TIMEZONE,
+    check_timezone,
+    datetime_expr,
+    format_timestamps,
+)
+from .convert_manifest import ConvertManifest, hash_file_content, is_unchanged
+from .tsv_compression import (
+    TSV_COMPRESSIONS,
+    check_compression,
+    iter_tsv_batches,
+    open_tsv_read,
+    open_tsv_write,
+    read_exact,
+    tsv_file_name,
+)
+
+
+def convert_unix_timestamp(timestamp: int, timezone: str = DEFAULT_TIMEZONE) -> str:
+    """UNIXタイムスタンプを読みやすい日時形式に変換する（1件だけ変換する場合用）"""
+    return format_timestamps([timestamp], timezone=timezone)[0]
+
+
+# 投稿の日時をまとめて変換する投稿数の目安
+TIMESTAMP_BATCH_POSTS = 10000
+
+
+# 出力するTSVファイルの列名
+BOARD_FIELDNAMES = ["title", "location"]
+THREAD_FIELDNAMES = [
+    "board_location",
+    "threadkey",
+    "title",
+    "resnum",
+    "location",
+    "thread_established",
+]
+POST_FIELDNAMES = [
+    "thread_location",
+    "post_num",
+    "post_an",
+    "post_mname",
+    "post_mail",
+    "post_timestamp",
+    "post_chars",
+    "post_body",
+    "post_anchor_an",
+    "post_ancfrom",
+]
+ALL_DATA_FIELDNAMES = [
+    "board_title",
+    "board_location",
+    "threadkey",
+    "thread_title",
+    "thread_location",
+    "thread_established",
+    "thread_resnum",
+] + POST_FIELDNAMES[1:]
+
+
+def read_board_subject(folder_path: str) -> Optional[SikiSubject]:
+    """掲示板フォルダのsubject.jsonを読み込む（存在しない場合はNone）"""
+    subject_path = os.path.join(folder_path, "subject.json")
+    if not os.path.exists(subject_path):
+        return None
+    return load_subject(subject_path)
+
+
+def iter_thread_rows(
+    folder_path: str,
+    subject_data: SikiSubject,
+    previous_entries: Optional[Dict[str, dict]] = None,
+    use_hash: bool = False,
+    timezone: str = DEFAULT_TIMEZONE,
+    thread_files: Optional[Dict[str, ThreadFileInfo]] = None,
+    raw_timestamps: bool = False,
+) -> Iterator[Tuple[tuple, Optional[List[tuple]], dict]]:
+    """
+    掲示板フォルダ内のスレッドを順番に読み込み、
+    (スレッド行, 投稿行のリスト, エントリ)を返す
+
+    スレッドのJSONファイルは1つずつ読み込み、投稿の日時(UNIXタイムスタンプ)は
+    合計TIMESTAMP_BATCH_POSTS件程度のスレッドの分をまとめて、timezoneの
+    日時に変換してから行データにする。メモリ使用量はその分のスレッドで収まる。
+    行データはTHREAD_FIELDNAMES / POST_FIELDNAMESの順に並んだタプル。
+    エントリはマニフェストに記録するスレッドファイルの情報(サイズ・更新日時など)。
+
+    previous_entriesに前回のマニフェストのエントリを渡すと、サイズと更新日時
+    (use_hashがTrueの場合は内容のハッシュ値)が変わっていないスレッドは
+    JSONを読み込まずに、投稿行のリストをNoneにして前回のエントリと一緒に返す。
+
+    thread_filesに走査済みのスレッドファイルの一覧(BoardIndex.thread_files)を
+    渡すと、スレッドファイルごとのos.statを省く。
+
+    raw_timestampsをTrueにすると、日時を文字列に変換せずにUNIXタイムスタンプ
+    (ミリ秒)のまま行データにする（Parquetで出力する場合。変換はrows_to_dataframeで
+    列ごとにまとめて行う）。
+    """
+    board_location = subject_data.location
+
+    # 日時の変換待ちのスレッド [(スレッドの情報, スレッドのデータ, エントリ), ...]
+    pending = []
+    pending_posts = 0
+
+    for thread in subject_data.items:
+        thread_key = thread.threadkey
+        thread_info = (
+            board_location,
+            thread_key,
+            thread.title,
+            thread.resnum,
+            thread.location,
+        )
+
+        # スレッドのJSONファイルを処理
+        file_name = f"{thread_key}.json"
+        thread_file = os.path.join(folder_path, file_name)
+        if thread_files is not None:
+            file_info = thread_files.get(file_name)
+            if file_info is None:
+                continue
+        else:
+            try:
+                file_stat = os.stat(thread_file)
+            except FileNotFoundError:
+                continue
+            file_info = ThreadFileInfo(file_stat.st_size, file_stat.st_mtime_ns)
+
+        entry = {
+            "file_name": file_name,
+            "size": file_info.size,
+            "mtime_ns": file_info.mtime_ns,
+        }
+        previous = previous_entries.get(file_name) if previous_entries else None
+
+        data = None
+        if not is_unchanged(previous, entry["size"], entry["mtime_ns"]):
+            try:
+                with open(thread_file, "rb") as tf:
+                    data = tf.read()
+            except FileNotFoundError:
+                # 一覧を作った後に削除されたスレッド
+                continue
+            if use_hash:
+                entry["hash"] = hash_file_content(data)
+                if previous is not None and previous.get("hash") == entry["hash"]:
+                    data = None
+
+        # 変更の無いスレッドは前回の出力をそのまま使う
+        if data is None:
+            thread_row = thread_info + (previous["established"],)
+            pending.append((thread_row, None, {**previous, **entry}))
+            continue
+
+        thread_data = decode_thread(data)
+        pending.append((thread_info, thread_data, entry))
+        pending_posts += len(thread_data.thread_array)
+        if pending_posts >= TIMESTAMP_BATCH_POSTS:
+            yield from build_thread_rows(pending, timezone, raw_timestamps)
+            pending = []
+            pending_posts = 0
+
+    yield from build_thread_rows(pending, timezone, raw_timestamps)
+
+
+def build_thread_rows(
+    pending: List[Tuple[tuple, Optional[SikiThread], dict]],
+    timezone: str,
+    raw_timestamps: bool = False,
+) -> Iterator[Tuple[tuple, Optional[List[tuple]], dict]]:
+    """
+    変換待ちのスレッドの日時をまとめて変換し、
+    (スレッド行, 投稿行のリスト, エントリ)を返す
+    （raw_timestampsがTrueなら変換せずにUNIXタイムスタンプ(ミリ秒)のまま返す）
+    """
+    timestamps = []
+    for _, thread_data, _ in pending:
+        if thread_data is not None:
+            timestamps.append(thread_data.established)
+            timestamps.extend(post.timestamp for post in thread_data.thread_array)
+    if not raw_timestamps:
+        timestamps = format_timestamps(timestamps, timezone=timezone)
+    formatted_times = iter(timestamps)
+
+    for thread_info, thread_data, entry in pending:
+        if thread_data is None:
+            yield thread_info, None, entry
+            continue
+
+        established_date = next(formatted_times)
+        thread_row = thread_info + (established_date,)
+        thread_location = thread_info[4]
+
+        # 投稿情報を抽出
+        post_rows = []
+        for post in thread_data.thread_array:
+            # 返信先と返信元をカンマ区切りの文字列に変換
+            anchor_an = ",".join(map(str, post.anchor_an)) if post.anchor_an else ""
+            ancfrom = ",".join(map(str, post.ancfrom)) if post.ancfrom else ""
+
+            # 投稿データ（一部フィールドを除外）
+            post_rows.append(
+                (
+                    thread_location,
+                    post.num,
+                    post.an,
+                    post.mname,
+                    post.mail,
+                    next(formatted_times),
+                    post.chars,
+                    (post.body or "").replace("\n", " "),
+                    anchor_an,
+                    ancfrom,
+                )
+            )
+
+        entry["established"] = established_date
+        entry["post_count"] = len(post_rows)
+        yield thread_row, post_rows, entry
+
+
+def make_all_data_rows(
+    board_info: dict, thread_row: tuple, post_rows: List[tuple]
+) -> List[tuple]:
+    """掲示板・スレッド・投稿の行を結合して全データ用の行を作る"""
+    prefix = (
+        board_info["title"],
+        board_info["location"],
+        thread_row[1],  # threadkey
+        thread_row[2],  # title
+        thread_row[4],  # location
+        thread_row[5],  # thread_established
+        thread_row[3],  # resnum
     )
+    return [prefix + post_row[1:] for post_row in post_rows]
 
 
 def process_board_folder(folder_path: str) -> tuple:
@@ -20,104 +261,21 @@ def process_board_folder(folder_path: str) -> tuple:
     posts_info = []
     all_data = []
 
-    # subject.jsonを処理
-    subject_path = os.path.join(folder_path, "subject.json")
-    if os.path.exists(subject_path):
-        with open(subject_path, "r", encoding="utf-8") as f:
-            subject_data = json.load(f)
-
-            # 掲示板情報を抽出
-            board_info = {
-                "title": subject_data.get("title", ""),
-                "location": subject_data.get("location", ""),
-            }
+    subject_data = read_board_subject(folder_path)
+    if subject_data is not None:
+        # 掲示板情報を抽出
+        board_info = {
+            "title": subject_data.title,
+            "location": subject_data.location,
+        }
 
-            # スレッド情報を抽出
-            for thread in subject_data.get("items", []):
-                thread_key = thread.get("threadkey", "")
-                thread_title = thread.get("title", "")
-                thread_location = thread.get("location", "")
-                thread_resnum = thread.get("resnum", 0)
-
-                # スレッドのJSONファイルを処理
-                thread_file = os.path.join(folder_path, f"{thread_key}.json")
-                thread_established = None
-
-                if os.path.exists(thread_file):
-                    with open(thread_file, "r", encoding="utf-8") as tf:
-                        thread_data = json.load(tf)
-                        thread_established = thread_data.get("established", 0)
-                        established_date = (
-                            convert_unix_timestamp(thread_established)
-                            if thread_established
-                            else ""
-                        )
-
-                        threads_info.append(
-                            {
-                                "board_location": board_info["location"],
-                                "threadkey": thread_key,
-                                "title": thread_title,
-                                "resnum": thread_resnum,
-                                "location": thread_location,
-                                "thread_established": established_date,
-                            }
-                        )
-
-                        # 投稿情報を抽出
-                        for post in thread_data.get("thread_array", []):
-                            timestamp = post.get("timestamp", 0)
-                            formatted_time = (
-                                convert_unix_timestamp(timestamp) if timestamp else ""
-                            )
-
-                            # 返信先と返信元をカンマ区切りの文字列に変換
-                            anchor_an = (
-                                ",".join(map(str, post.get("anchor_an", [])))
-                                if "anchor_an" in post
-                                else ""
-                            )
-                            ancfrom = (
-                                ",".join(map(str, post.get("ancfrom", [])))
-                                if "ancfrom" in post
-                                else ""
-                            )
-
-                            # 投稿データ（一部フィールドを除外）
-                            post_data = {
-                                "thread_location": thread_location,
-                                "post_num": post.get("num", 0),
-                                "post_an": post.get("an", 0),
-                                "post_mname": post.get("mname", ""),
-                                "post_mail": post.get("mail", ""),
-                                "post_timestamp": formatted_time,
-                                "post_chars": post.get("chars", 0),
-                                "post_body": post.get("body", "").replace("\n", " "),
-                                "post_anchor_an": anchor_an,
-                                "post_ancfrom": ancfrom,
-                            }
-                            posts_info.append(post_data)
-
-                            # 全データ用（全フィールドを含む）
-                            full_data = {
-                                "board_title": board_info["title"],
-                                "board_location": board_info["location"],
-                                "threadkey": thread_key,
-                                "thread_title": thread_title,
-                                "thread_location": thread_location,
-                                "thread_established": established_date,
-                                "thread_resnum": thread_resnum,
-                                "post_num": post.get("num", 0),
-                                "post_an": post.get("an", 0),
-                                "post_mname": post.get("mname", ""),
-                                "post_mail": post.get("mail", ""),
-                                "post_timestamp": formatted_time,
-                                "post_chars": post.get("chars", 0),
-                                "post_body": post.get("body", "").replace("\n", " "),
-                                "post_anchor_an": anchor_an,
-                                "post_ancfrom": ancfrom,
-                            }
-                            all_data.append(full_data)
+        for thread_row, post_rows, _ in iter_thread_rows(folder_path, subject_data):
+            threads_info.append(dict(zip(THREAD_FIELDNAMES, thread_row)))
+            posts_info.extend(dict(zip(POST_FIELDNAMES, row)) for row in post_rows)
+            all_data.extend(
+                dict(zip(ALL_DATA_FIELDNAMES, row))
+                for row in make_all_data_rows(board_info, thread_row, post_rows)
+            )
 
     return board_info, threads_info, posts_info, all_data
 
@@ -181,88 +339,828 @@ def write_tsv_files(
         print(f"- 全データのエントリ数: {len(all_data)}")
 
 
-def process_site_folder(site_folder_path: str, output_all_data: bool = False) -> tuple:
-    """掲示板サイトフォルダを処理し、そのサイト内の全掲示板の情報を抽出する"""
-    site_boards = []
-    site_threads = []
-    site_posts = []
-    site_all_data = []
+class TsvTableWriter:
+    """
+    1つのTSVファイルに行を逐次書き込むクラス（最初の行を書く時にファイルを開く）
 
-    # サイトフォルダ内の各掲示板フォルダを処理
-    for item_name in os.listdir(site_folder_path):
-        board_folder_path = os.path.join(site_folder_path, item_name)
-        if os.path.isdir(board_folder_path) and is_board_folder(board_folder_path):
-            board_info, threads_info, posts_info, all_data = process_board_folder(
-                board_folder_path
+    パスが「.zst」で終わる場合はzstdで圧縮しながら書き込む。その場合も、
+    書き込んだ範囲などの位置は圧縮前のバイト数で数える。
+    """
+
+    def __init__(self, path: str, fieldnames: List[str]):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.count = 0
+        # これまでに書き込んだバイト数（ヘッダーを含む）
+        self.position = 0
+        self._file = None
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, delimiter="\t")
+
+    def _encode(self, rows: List[tuple]) -> bytes:
+        """行データをTSV形式のバイト列に変換する"""
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.writerows(rows)
+        return self._buffer.getvalue().encode("utf-8")
+
+    def writerows(self, rows: List[tuple]) -> Tuple[int, int]:
+        """行データを書き込み、書き込んだ範囲(開始位置, 終了位置)を返す"""
+        if not rows:
+            return self.position, self.position
+        return self.write_raw(self._encode(rows), len(rows))
+
+    def write_raw(self, data: bytes, count: int) -> Tuple[int, int]:
+        """TSV形式に変換済みのバイト列(count行分)を書き込み、書き込んだ範囲を返す"""
+        if not data:
+            return self.position, self.position
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open_tsv_write(self.path)
+            header = self._encode([self.fieldnames])
+            self._file.write(header)
+            self.position = len(header)
+        start = self.position
+        self._file.write(data)
+        self.position += len(data)
+        self.count += count
+        return start, self.position
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def select_all_data_threads(threads: pl.LazyFrame) -> pl.LazyFrame:
+    """threads.tsvを全データに結合する列にする（同じスレッドは最初の行だけ使う）"""
+    return threads.select(
+        pl.col("location").alias("thread_location"),
+        "board_location",
+        "threadkey",
+        pl.col("title").alias("thread_title"),
+        "thread_established",
+        pl.col("resnum").alias("thread_resnum"),
+    ).unique(subset="thread_location", keep="first", maintain_order=True)
+
+
+def select_all_data_boards(boards: pl.LazyFrame) -> pl.LazyFrame:
+    """boards.tsvを全データに結合する列にする（同じ掲示板は最初の行だけ使う）"""
+    return boards.select(
+        pl.col("title").alias("board_title"),
+        pl.col("location").alias("board_location"),
+    ).unique(subset="board_location", keep="first", maintain_order=True)
+
+
+def join_all_data(
+    posts: pl.LazyFrame, threads: pl.LazyFrame, boards: pl.LazyFrame
+) -> pl.LazyFrame:
+    """
+    投稿に、select_all_data_threads/boardsで選んだスレッドと掲示板の情報を
+    結合して、全データの列にする
+    """
+
+    def join_key(column: str) -> pl.Expr:
+        # 空欄(Null)同士も結合するため、結合キーだけ空文字列にする
+        return pl.col(column).fill_null("")
+
+    return (
+        posts.join(
+            threads,
+            left_on=join_key("thread_location"),
+            right_on=join_key("thread_location"),
+            how="left",
+            maintain_order="left",
+        )
+        .join(
+            boards,
+            left_on=join_key("board_location"),
+            right_on=join_key("board_location"),
+            how="left",
+            maintain_order="left",
+        )
+        .select(ALL_DATA_FIELDNAMES)
+    )
+
+
+def write_all_data_tsv(output_dir: str, compression: str = "none") -> None:
+    """
+    posts.tsvにthreads.tsvとboards.tsvを結合して、alldata.tsvを書き込む
+
+    PolarsのLazyFrameで読み込み・結合・書き込みを逐次行うので、全データの行を
+    Pythonのオブジェクトとして作ることは無い。空欄はNullとして読み込んで
+    そのまま空欄で書き込むので、出力はcsvモジュールで書き込んだ場合と同じになる。
+
+    zstdで圧縮している場合は、posts.tsv.zstを解凍しながらチャンクごとに結合して、
+    alldata.tsv.zstに圧縮しながら書き込む（出力の内容は圧縮しない場合と同じ）。
+    """
+    csv_options = {
+        "separator": "\t",
+        "line_terminator": "\r\n",
+        "quote_style": "necessary",
+    }
+
+    def tsv_path(file_name: str) -> str:
+        return os.path.join(output_dir, tsv_file_name(file_name, compression))
+
+    if compression == "none":
+
+        def scan_tsv(file_name: str) -> pl.LazyFrame:
+            return pl.scan_csv(tsv_path(file_name), separator="\t", infer_schema=False)
+
+        join_all_data(
+            scan_tsv("posts.tsv"),
+            select_all_data_threads(scan_tsv("threads.tsv")),
+            select_all_data_boards(scan_tsv("boards.tsv")),
+        ).sink_csv(tsv_path("alldata.tsv"), **csv_options)
+        return
+
+    def read_tsv(file_name: str) -> pl.LazyFrame:
+        batches = iter_tsv_batches(tsv_path(file_name), infer_schema=False)
+        return pl.concat(batches).lazy()
+
+    # スレッドと掲示板は投稿に比べて小さいので、先に全て読み込んでおく
+    threads = select_all_data_threads(read_tsv("threads.tsv")).collect().lazy()
+    boards = select_all_data_boards(read_tsv("boards.tsv")).collect().lazy()
+    with open_tsv_write(tsv_path("alldata.tsv")) as f:
+        batches = iter_tsv_batches(tsv_path("posts.tsv"), infer_schema=False)
+        for i, posts in enumerate(batches):
+            join_all_data(posts.lazy(), threads, boards).collect().write_csv(
+                f, include_header=i == 0, **csv_options
             )
-            if board_info:
-                site_boards.append(board_info)
-                site_threads.extend(threads_info)
-                site_posts.extend(posts_info)
-                site_all_data.extend(all_data)
-
-    # サイトフォルダごとの出力
-    if site_boards:
-        site_name = os.path.basename(site_folder_path)
-        output_dir = os.path.join(
-            os.path.dirname(site_folder_path), "output", site_name
+
+
+class TsvOutputSet:
+    """
+    boards/threads/postsの各TSVファイルへの逐次書き込みをまとめたクラス
+
+    alldata.tsvは書き込み中には作らず、closeする時に出力したTSVファイルを
+    結合して作る。compressionに"zstd"を指定すると、全てのファイルを
+    zstdで圧縮して「.tsv.zst」で出力する。
+    """
+
+    def __init__(
+        self, output_dir: str, output_all_data: bool, compression: str = "none"
+    ):
+        self.output_dir = output_dir
+        self.output_all_data = output_all_data
+        self.compression = compression
+
+        def tsv_path(file_name: str) -> str:
+            return os.path.join(output_dir, tsv_file_name(file_name, compression))
+
+        self.boards = TsvTableWriter(tsv_path("boards.tsv"), BOARD_FIELDNAMES)
+        self.threads = TsvTableWriter(tsv_path("threads.tsv"), THREAD_FIELDNAMES)
+        self.posts = TsvTableWriter(tsv_path("posts.tsv"), POST_FIELDNAMES)
+
+    @property
+    def board_count(self) -> int:
+        return self.boards.count
+
+    def write_board(self, board_info: dict, folder_path: Optional[str] = None) -> None:
+        self.boards.writerows([(board_info["title"], board_info["location"])])
+
+    def write_thread(
+        self, board_info: dict, thread_row: tuple, post_rows: List[tuple]
+    ) -> Tuple[int, int]:
+        """スレッド1つ分の行を書き込み、posts.tsvに書いた範囲を返す"""
+        self.threads.writerows([thread_row])
+        return self.posts.writerows(post_rows)
+
+    def write_thread_chunk(
+        self, thread_row: tuple, posts_chunk: bytes, post_count: int
+    ) -> Tuple[int, int]:
+        """前回の出力から取り出したスレッド1つ分の投稿行をそのまま書き込む"""
+        self.threads.writerows([thread_row])
+        return self.posts.write_raw(posts_chunk, post_count)
+
+    def close(self) -> None:
+        for table in (self.boards, self.threads, self.posts):
+            table.close()
+        # 全データは投稿が1件以上ある場合だけ作る
+        if self.output_all_data and self.posts.count:
+            write_all_data_tsv(self.output_dir, self.compression)
+
+    def print_summary(self) -> None:
+        print(f"- 掲示板数: {self.boards.count}")
+        print(f"- スレッド数: {self.threads.count}")
+        print(f"- 投稿数: {self.posts.count}")
+        if self.output_all_data:
+            # 全データは投稿にスレッドと掲示板の情報を結合したもの
+            print(f"- 全データのエントリ数: {self.posts.count}")
+
+
+# Parquetで出力する場合の列の型（post_timestamp等の日時はUNIXタイムスタンプ(ミリ秒)で
+# 受け取り、rows_to_dataframeでタイムゾーン付きの日時に変換する）
+BOARD_SCHEMA = {"title": pl.String, "location": pl.String}
+THREAD_SCHEMA = {
+    "board_location": pl.String,
+    "threadkey": pl.String,
+    "title": pl.String,
+    "resnum": pl.Int64,
+    "location": pl.String,
+    "thread_established": pl.Int64,
+}
+POST_SCHEMA = {
+    "thread_location": pl.String,
+    "post_num": pl.Int64,
+    "post_an": pl.Int64,
+    "post_mname": pl.String,
+    "post_mail": pl.String,
+    "post_timestamp": pl.Int64,
+    "post_chars": pl.Int64,
+    "post_body": pl.String,
+    "post_anchor_an": pl.String,
+    "post_ancfrom": pl.String,
+}
+# 年月が不明な投稿のパーティション名（Hive形式でNullを表す値）
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def rows_to_dataframe(
+    rows: List[tuple], schema: dict, timezone: str = DEFAULT_TIMEZONE
+) -> pl.DataFrame:
+    """
+    行データのタプルのリストを、型を付けたDataFrameに変換する
+    （日時の列はUNIXタイムスタンプ(ミリ秒)から、timezoneの日時に変換する）
+    """
+    df = pl.DataFrame(rows, schema=schema, orient="row", strict=False)
+    datetime_columns = [
+        col for col in ("thread_established", "post_timestamp") if col in schema
+    ]
+    return df.with_columns(
+        datetime_expr(col, timezone).alias(col) for col in datetime_columns
+    )
+
+
+def write_month_partitions(df: pl.DataFrame, dataset_dir: str) -> None:
+    """post_timestampの年月ごとに分割して、month=YYYY-MMのフォルダにParquetを書き込む"""
+    month_df = df.with_columns(month=pl.col("post_timestamp").dt.strftime("%Y-%m"))
+    partitions = month_df.partition_by(
+        "month", as_dict=True, include_key=False, maintain_order=True
+    )
+    for (month,), part_df in partitions.items():
+        partition_dir = os.path.join(dataset_dir, f"month={month or NULL_PARTITION}")
+        os.makedirs(partition_dir, exist_ok=True)
+        part_df.write_parquet(os.path.join(partition_dir, "part-0.parquet"))
+
+
+class ParquetOutputSet:
+    """
+    boards/threads/posts/alldataを型付きのParquetで出力するクラス
+
+    boards.parquetとthreads.parquetは1つのファイルに出力する。
+    posts/とalldata/は「(site=サイト名/)board=掲示板フォルダ名/month=YYYY-MM」の
+    Hive形式のフォルダに分割して出力するので、分析時に必要なサイト・掲示板・
+    年月のファイルと列だけを読み込める。投稿は掲示板1つ分ずつまとめて書き込む。
+    日時の列は、timezoneのタイムゾーン付きの日時型で出力する。
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        output_all_data: bool,
+        partition_by_site: bool = True,
+        timezone: str = DEFAULT_TIMEZONE,
+    ):
+        self.output_dir = output_dir
+        self.output_all_data = output_all_data
+        self.partition_by_site = partition_by_site
+        self.timezone = timezone
+        self.board_rows = []
+        self.thread_rows = []
+        self.post_count = 0
+        self.all_data_count = 0
+        # 書き込み待ちの掲示板1つ分のデータ
+        self._board_info = None
+        self._board_partition = None
+        self._board_thread_rows = []
+        self._board_post_rows = []
+
+        # 前回の出力が残っていると古いパーティションが混ざるので削除する
+        for dataset_name in ("posts", "alldata"):
+            dataset_dir = os.path.join(output_dir, dataset_name)
+            if os.path.isdir(dataset_dir):
+                shutil.rmtree(dataset_dir)
+
+    @property
+    def board_count(self) -> int:
+        return len(self.board_rows)
+
+    def write_board(self, board_info: dict, folder_path: Optional[str] = None) -> None:
+        self._flush_board()
+        self.board_rows.append((board_info["title"], board_info["location"]))
+
+        # 掲示板のパーティション（サイトフォルダ名と掲示板フォルダ名）
+        board_name = os.path.basename(folder_path) if folder_path else ""
+        site_name = (
+            os.path.basename(os.path.dirname(folder_path)) if folder_path else ""
+        )
+        partition = [f"board={board_name}"]
+        if self.partition_by_site:
+            partition.insert(0, f"site={site_name}")
+        self._board_info = board_info
+        self._board_partition = os.path.join(*partition)
+
+    def write_thread(
+        self, board_info: dict, thread_row: tuple, post_rows: List[tuple]
+    ) -> None:
+        self.thread_rows.append(thread_row)
+        self._board_thread_rows.append(thread_row)
+        self._board_post_rows.extend(post_rows)
+
+    def _flush_board(self) -> None:
+        """書き込み待ちの掲示板1つ分の投稿をParquetに書き込む"""
+        post_rows = self._board_post_rows
+        thread_rows = self._board_thread_rows
+        self._board_post_rows = []
+        self._board_thread_rows = []
+        if not post_rows:
+            return
+
+        posts_df = rows_to_dataframe(post_rows, POST_SCHEMA, self.timezone)
+        write_month_partitions(
+            posts_df, os.path.join(self.output_dir, "posts", self._board_partition)
+        )
+        self.post_count += posts_df.height
+
+        if self.output_all_data:
+            # 掲示板内のスレッド情報と結合して全データを作る
+            threads_df = (
+                rows_to_dataframe(thread_rows, THREAD_SCHEMA, self.timezone)
+                .unique(subset="location", keep="first", maintain_order=True)
+                .select(
+                    pl.col("location").alias("thread_location"),
+                    "threadkey",
+                    pl.col("title").alias("thread_title"),
+                    "thread_established",
+                    pl.col("resnum").alias("thread_resnum"),
+                )
+            )
+            all_data_df = (
+                posts_df.join(
+                    threads_df, on="thread_location", how="left", maintain_order="left"
+                )
+                .with_columns(
+                    board_title=pl.lit(self._board_info["title"], dtype=pl.String),
+                    board_location=pl.lit(
+                        self._board_info["location"], dtype=pl.String
+                    ),
+                )
+                .select(ALL_DATA_FIELDNAMES)
+            )
+            write_month_partitions(
+                all_data_df,
+                os.path.join(self.output_dir, "alldata", self._board_partition),
+            )
+            self.all_data_count += all_data_df.height
+
+    def close(self) -> None:
+        self._flush_board()
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.board_rows:
+            rows_to_dataframe(self.board_rows, BOARD_SCHEMA).write_parquet(
+                os.path.join(self.output_dir, "boards.parquet")
+            )
+        if self.thread_rows:
+            rows_to_dataframe(
+                self.thread_rows, THREAD_SCHEMA, self.timezone
+            ).write_parquet(os.path.join(self.output_dir, "threads.parquet"))
+
+    def print_summary(self) -> None:
+        print(f"- 掲示板数: {len(self.board_rows)}")
+        print(f"- スレッド数: {len(self.thread_rows)}")
+        print(f"- 投稿数: {self.post_count}")
+        if self.output_all_data:
+            print(f"- 全データのエントリ数: {self.all_data_count}")
+
+
+def create_output_set(
+    output_format: str,
+    output_dir: str,
+    output_all_data: bool,
+    partition_by_site: bool = True,
+    timezone: str = DEFAULT_TIMEZONE,
+    compression: str = "none",
+):
+    """
+    出力形式("tsv" または "parquet")に応じた出力先のクラスを作る
+    （compressionはTSVの場合だけ使う）
+    """
+    if output_format == "tsv":
+        return TsvOutputSet(output_dir, output_all_data, compression)
+    if output_format == "parquet":
+        return ParquetOutputSet(
+            output_dir, output_all_data, partition_by_site, timezone
         )
-        print(f"\n処理中: {site_name}")
-        write_tsv_files(
-            output_dir,
-            site_boards,
-            site_threads,
-            site_posts,
-            site_all_data,
-            output_all_data,
+    raise ValueError(f"未対応の出力形式です: {output_format}")
+
+
+class PreviousOutput:
+    """
+    前回の変換で出力した全サイト集計用のposts.tsv
+
+    出力先のファイルは今回の変換で上書きするので、先に「.prev」を付けた名前に
+    変更しておき、そこからマニフェストに記録されたバイト範囲を読み出す。
+    zstdで圧縮したposts.tsv.zstの場合は、解凍しながら読み進めて取り出す
+    （バイト範囲は圧縮前の位置）。
+    """
+
+    SUFFIX = ".prev"
+    FILE_NAMES = ("posts.tsv",)
+
+    def __init__(self, paths: Dict[str, str], compression: str = "none"):
+        self._paths = paths
+        self._compression = compression
+        self._files: Dict[str, Optional[BinaryIO]] = {
+            file_name: open_tsv_read(path, compression)
+            if os.path.exists(path)
+            else None
+            for file_name, path in paths.items()
+        }
+
+    @classmethod
+    def open(
+        cls, output_dir: str, manifest: ConvertManifest, compression: str = "none"
+    ) -> Optional["PreviousOutput"]:
+        """
+        前回の出力を開く。ファイルのサイズがマニフェストの記録と一致しない場合は
+        前回の出力を使えないのでNoneを返す
+        """
+        # 前回の変換が途中で止まっていた場合は「.prev」のファイルが元の出力
+        paths = {}
+        for base_name in cls.FILE_NAMES:
+            file_name = tsv_file_name(base_name, compression)
+            path = os.path.join(output_dir, file_name)
+            prev_path = path + cls.SUFFIX
+            if not os.path.exists(prev_path):
+                prev_path = path
+            size = os.path.getsize(prev_path) if os.path.exists(prev_path) else 0
+            if size != manifest.output_sizes.get(file_name):
+                return None
+            paths[base_name] = (path, prev_path)
+
+        for base_name, (path, prev_path) in paths.items():
+            if prev_path == path:
+                prev_path = path + cls.SUFFIX
+                if os.path.exists(path):
+                    os.replace(path, prev_path)
+            paths[base_name] = prev_path
+        return cls(paths, compression)
+
+    def read(self, file_name: str, byte_range: Optional[List[int]]) -> bytes:
+        """前回の出力(file_nameは圧縮前のファイル名)から指定したバイト範囲を読み出す"""
+        f = self._files.get(file_name)
+        if f is None or not byte_range:
+            return b""
+        start, end = byte_range
+        if start < f.tell():
+            # 解凍しながら読む場合は前に戻れないので、ファイルを開き直す
+            f.close()
+            f = self._files[file_name] = open_tsv_read(
+                self._paths[file_name], self._compression
+            )
+        f.seek(start)
+        return read_exact(f, end - start)
+
+    def close(self) -> None:
+        for f in self._files.values():
+            if f is not None:
+                f.close()
+
+    @classmethod
+    def remove(cls, output_dir: str) -> None:
+        """前回の出力（「.prev」のファイル）を圧縮の有無に関係なく削除する"""
+        for base_name in cls.FILE_NAMES:
+            for compression in TSV_COMPRESSIONS:
+                file_name = tsv_file_name(base_name, compression)
+                prev_path = os.path.join(output_dir, file_name + cls.SUFFIX)
+                if os.path.exists(prev_path):
+                    os.remove(prev_path)
+
+
+def convert_board_folder(
+    folder_path: str,
+    previous_entries: Optional[Dict[str, dict]] = None,
+    use_hash: bool = False,
+    timezone: str = DEFAULT_TIMEZONE,
+    thread_files: Optional[Dict[str, ThreadFileInfo]] = None,
+    raw_timestamps: bool = False,
+) -> Optional[Tuple[str, dict, list]]:
+    """
+    掲示板フォルダ1つ分を
+    (フォルダのパス, 掲示板情報, [(スレッド行, 投稿行のリスト, エントリ), ...])
+    に変換する
+
+    プロセスプールのワーカーで実行するための関数。戻り値はタプルだけで
+    構成しているので、メインプロセスへ小さいサイズで受け渡しできる。
+    """
+    subject_data = read_board_subject(folder_path)
+    if subject_data is None:
+        return None
+    board_info = {
+        "title": subject_data.title,
+        "location": subject_data.location,
+    }
+    thread_results = list(
+        iter_thread_rows(
+            folder_path,
+            subject_data,
+            previous_entries,
+            use_hash,
+            timezone,
+            thread_files,
+            raw_timestamps,
         )
+    )
+    return folder_path, board_info, thread_results
 
-    return site_boards, site_threads, site_posts, site_all_data
+
+def iter_converted_boards(
+    boards: List[BoardIndex],
+    jobs: int = 1,
+    manifest: Optional[ConvertManifest] = None,
+    use_hash: bool = False,
+    timezone: str = DEFAULT_TIMEZONE,
+    raw_timestamps: bool = False,
+) -> Iterator[Optional[Tuple[str, dict, Iterable]]]:
+    """
+    走査済みの掲示板フォルダを変換し、
+    (フォルダのパス, 掲示板情報, スレッドごとの行データ)を入力と同じ順番で返す
+
+    jobsが1の場合はスレッドファイルを1つずつ読み込んで逐次返す。
+    jobsが2以上の場合は掲示板単位でプロセスプールに振り分けるが、結果は
+    入力の順番どおりに返すので、出力されるTSVは逐次処理の場合と同じになる。
+    先読みする掲示板の数はjobsの2倍までに抑えて、メモリ使用量を制限する。
+    manifestに前回のマニフェストを渡すと、変更の無いスレッドは読み込まない。
+    raw_timestampsはiter_thread_rowsと同じ。
+    """
+
+    def board_entries(folder_path: str) -> Optional[Dict[str, dict]]:
+        return manifest.board_entries(folder_path) if manifest is not None else None
+
+    if jobs <= 1:
+        for board in boards:
+            subject_data = read_board_subject(board.path)
+            if subject_data is None:
+                yield None
+                continue
+            board_info = {
+                "title": subject_data.title,
+                "location": subject_data.location,
+            }
+            yield (
+                board.path,
+                board_info,
+                iter_thread_rows(
+                    board.path,
+                    subject_data,
+                    board_entries(board.path),
+                    use_hash,
+                    timezone,
+                    board.thread_files,
+                    raw_timestamps,
+                ),
+            )
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+
+        def submit(board: BoardIndex):
+            return executor.submit(
+                convert_board_folder,
+                board.path,
+                board_entries(board.path),
+                use_hash,
+                timezone,
+                board.thread_files,
+                raw_timestamps,
+            )
+
+        pending = deque()
+        board_iter = iter(boards)
+        for board in itertools.islice(board_iter, jobs * 2):
+            pending.append(submit(board))
+        while pending:
+            result = pending.popleft().result()
+            for board in itertools.islice(board_iter, 1):
+                pending.append(submit(board))
+            yield result
+
+
+def write_site_output(
+    site_folder_path: str,
+    board_results: Iterable,
+    global_output: Optional[TsvOutputSet] = None,
+    output_all_data: bool = False,
+    previous_output: Optional[PreviousOutput] = None,
+    new_manifest: Optional[ConvertManifest] = None,
+    output_format: str = "tsv",
+    timezone: str = DEFAULT_TIMEZONE,
+    compression: str = "none",
+) -> None:
+    """
+    1サイト分の変換結果を、サイトごとの出力と全サイト集計用の出力(global_output)の
+    両方へ書き込む
+
+    変更の無いスレッド(投稿行がNone)は、前回の出力(previous_output)から
+    投稿行をそのまま取り出して書き込む。new_manifestを渡すと、全サイト集計用の
+    posts.tsvに書き込んだ範囲を記録する。
+    """
+    site_name = os.path.basename(site_folder_path)
+    output_dir = os.path.join(os.path.dirname(site_folder_path), "output", site_name)
+    site_output = create_output_set(
+        output_format,
+        output_dir,
+        output_all_data,
+        partition_by_site=False,
+        timezone=timezone,
+        compression=compression,
+    )
+    outputs = [site_output] if global_output is None else [site_output, global_output]
+
+    print(f"\n処理中: {site_name}")
+    try:
+        for board_result in board_results:
+            if board_result is None:
+                continue
+            folder_path, board_info, thread_results = board_result
+            for output in outputs:
+                output.write_board(board_info, folder_path)
+            for thread_row, post_rows, entry in thread_results:
+                if post_rows is None:
+                    posts_chunk = previous_output.read("posts.tsv", entry["posts"])
+                    for output in outputs:
+                        posts_range = output.write_thread_chunk(
+                            thread_row, posts_chunk, entry["post_count"]
+                        )
+                else:
+                    for output in outputs:
+                        posts_range = output.write_thread(
+                            board_info, thread_row, post_rows
+                        )
+
+                # 最後に書き込んだ出力(全サイト集計用)での範囲を記録する
+                if new_manifest is not None and output_format == "tsv":
+                    entry["posts"] = posts_range
+                    new_manifest.record(folder_path, entry)
+    finally:
+        site_output.close()
+
+    site_output.print_summary()
+
+
+def process_site_folder(
+    site_folder_path: str,
+    global_output: Optional[TsvOutputSet] = None,
+    output_all_data: bool = False,
+    jobs: int = 1,
+    output_format: str = "tsv",
+    timezone: str = DEFAULT_TIMEZONE,
+    compression: str = "none",
+) -> None:
+    """
+    掲示板サイトフォルダを処理し、そのサイト内の全掲示板の情報をTSVに書き込む
+
+    行データはスレッドファイルを1つ読むごとに、サイトごとの出力と
+    全サイト集計用の出力(global_output)の両方へそのまま書き込む。
+    """
+    site = scan_site_folder(site_folder_path)
+    write_site_output(
+        site_folder_path,
+        iter_converted_boards(
+            site.boards,
+            jobs,
+            timezone=timezone,
+            raw_timestamps=output_format == "parquet",
+        ),
+        global_output,
+        output_all_data,
+        output_format=output_format,
+        timezone=timezone,
+        compression=compression,
+    )
 
 
 def process_log_folder(
-    log_folder_path: str, output_dir_path: str, output_all_data: bool = False
+    log_folder_path: str,
+    output_dir_path: str,
+    output_all_data: bool = False,
+    jobs: int = 1,
+    incremental: bool = False,
+    use_hash: bool = False,
+    output_format: str = "tsv",
+    timezone: str = DEFAULT_TIMEZONE,
+    scan_cache: bool = False,
+    compression: str = "none",
 ) -> None:
-    """ログフォルダ全体を処理する"""
-    # サイト全体の集計用
-    all_site_boards = []
-    all_site_threads = []
-    all_site_posts = []
-    all_site_data = []
-
-    # 各サイトフォルダを処理
-    for site_name in os.listdir(log_folder_path):
-        site_folder_path = os.path.join(log_folder_path, site_name)
-        if os.path.isdir(site_folder_path):
-            # サイトフォルダかどうかを判定（掲示板フォルダを含んでいるか）
-            contains_board_folder = False
-            for item_name in os.listdir(site_folder_path):
-                item_path = os.path.join(site_folder_path, item_name)
-                if os.path.isdir(item_path) and is_board_folder(item_path):
-                    contains_board_folder = True
-                    break
-
-            if contains_board_folder:
-                site_boards, site_threads, site_posts, site_all_data = (
-                    process_site_folder(site_folder_path, output_all_data)
-                )
+    """
+    ログフォルダ全体を処理する
+
+    投稿などの行データはリストに溜めずに、サイトごとの出力と全サイト集計の
+    出力へ逐次書き込むので、ログ全体の大きさに関係なくメモリ使用量は一定に収まる。
+    jobsに2以上を指定すると、全サイトの掲示板をプロセスプールで並列に変換する
+    （出力内容は逐次処理の場合と同じ）。
+
+    変換したスレッドファイルの情報は出力フォルダのマニフェストに記録する。
+    incrementalをTrueにすると、前回からサイズと更新日時が変わっていない
+    スレッドファイルは読み込まずに、前回の出力の投稿行をそのまま使う。
+    use_hashをTrueにすると、更新日時などが変わっていても内容のハッシュ値が
+    同じスレッドファイルは読み込まない。
+
+    output_formatに"parquet"を指定すると、TSVの代わりに型付きのParquetで出力する
+    （投稿はサイト・掲示板・年月ごとに分割する。差分変換には対応していない）。
+
+    投稿などの日時は、実行するマシンのタイムゾーンではなくtimezoneで指定した
+    タイムゾーン(例: "Asia/Tokyo")の日時で出力する。
+
+    ログフォルダはos.scandirで1回だけ走査して、サイト・掲示板・スレッドファイルの
+    一覧を作る。scan_cacheをTrueにすると一覧を出力フォルダに保存しておき、
+    次回は掲示板フォルダとsubject.jsonが変わっていない掲示板の走査を省く。
+
+    compressionに"zstd"を指定すると、TSVファイルをzstdのマルチスレッド圧縮で
+    圧縮しながら「.tsv.zst」に書き込む（差分変換やalldataの作成にも対応）。
+    """
+    check_timezone(timezone)
+    check_compression(compression)
+    if output_format == "parquet" and incremental:
+        print("Parquet形式の出力は差分変換に対応していないため、全て変換します")
+        incremental = False
 
-                all_site_boards.extend(site_boards)
-                all_site_threads.extend(site_threads)
-                all_site_posts.extend(site_posts)
-                all_site_data.extend(site_all_data)
-
-    # 全サイトの集計データを出力
-    if all_site_boards:
-        print("\n全サイト集計データを出力中...")
-        write_tsv_files(
-            output_dir_path,
-            all_site_boards,
-            all_site_threads,
-            all_site_posts,
-            all_site_data,
-            output_all_data,
+    # 各サイトフォルダと、その中の掲示板フォルダ・スレッドファイルを列挙
+    log_index = scan_log_folder(
+        log_folder_path,
+        os.path.join(output_dir_path, SCAN_CACHE_FILE_NAME) if scan_cache else None,
+    )
+
+    # 前回の変換結果を読み込む（設定が違う場合や出力が変わっている場合は使わない）
+    settings = {"timezone": timezone}
+    previous_manifest = None
+    previous_output = None
+    if incremental:
+        previous_manifest = ConvertManifest.load(output_dir_path)
+        if previous_manifest is not None and previous_manifest.settings == settings:
+            previous_output = PreviousOutput.open(
+                output_dir_path, previous_manifest, compression
+            )
+        if previous_output is None:
+            previous_manifest = None
+            print("前回の変換結果が使えないため、全てのスレッドを変換します")
+    new_manifest = ConvertManifest(settings)
+
+    # 全サイトの集計データの出力先
+    global_output = create_output_set(
+        output_format,
+        output_dir_path,
+        output_all_data,
+        timezone=timezone,
+        compression=compression,
+    )
+
+    try:
+        # 全サイトの掲示板をまとめて変換し、サイトごとに順番に書き込む
+        board_results = iter_converted_boards(
+            list(log_index.iter_boards()),
+            jobs,
+            previous_manifest,
+            use_hash,
+            timezone,
+            # Parquetの日時の列は、文字列を経由せずにタイムスタンプから作る
+            raw_timestamps=output_format == "parquet",
         )
+        for site in log_index.sites:
+            write_site_output(
+                site.path,
+                itertools.islice(board_results, len(site.boards)),
+                global_output,
+                output_all_data,
+                previous_output,
+                new_manifest,
+                output_format,
+                timezone,
+                compression,
+            )
+    finally:
+        global_output.close()
+        if previous_output is not None:
+            previous_output.close()
+
+    # 今回の変換結果をマニフェストに記録して、前回の出力を削除する
+    if output_format == "tsv":
+        # 前回の出力と照合するため、実際のファイル(圧縮後)のサイズを記録する
+        posts_path = global_output.posts.path
+        new_manifest.output_sizes = {
+            os.path.basename(posts_path): (
+                os.path.getsize(posts_path) if os.path.exists(posts_path) else 0
+            )
+        }
+        PreviousOutput.remove(output_dir_path)
+        new_manifest.save(output_dir_path)
+
+    # 全サイトの集計データ
+    if global_output.board_count:
+        print("\n全サイト集計データを出力しました")
+        global_output.print_summary()
 
     print(f"\n変換が完了しました。結果は {output_dir_path} に保存されています。")
 
@@ -0,0 +1,175 @@
+"""
+TSVファイルのzstd圧縮(.tsv.zst)の書き込みと読み込みをまとめたモジュール
+
+書き込みはzstdのマルチスレッド圧縮でストリームに書き込み、読み込みは
+解凍しながらレコード(行)の区切りでチャンクに分けて読み込むので、
+ファイル全体を解凍したものをメモリやディスクに置くことは無い。
+"""
+
+import io
+import os
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+import polars as pl
+import zstandard
+
+# 対応している圧縮形式（"none"は圧縮しない）
+TSV_COMPRESSIONS = ("none", "zstd")
+ZSTD_SUFFIX = ".zst"
+# 圧縮レベル（zstdのデフォルト）と、圧縮に使うスレッド数（-1はCPUのコア数）
+ZSTD_LEVEL = 3
+ZSTD_THREADS = -1
+# 読み込む時に1回に解凍するバイト数
+READ_CHUNK_SIZE = 16 * 2**20
+
+
+def check_compression(compression: str) -> None:
+    """圧縮形式が対応しているものか確認する"""
+    if compression not in TSV_COMPRESSIONS:
+        raise ValueError(f"未対応の圧縮形式です: {compression}")
+
+
+def tsv_file_name(file_name: str, compression: str = "none") -> str:
+    """圧縮形式に応じたファイル名（zstdなら「.zst」を付ける）を返す"""
+    return file_name + ZSTD_SUFFIX if compression == "zstd" else file_name
+
+
+def is_compressed(path: str) -> bool:
+    return path.endswith(ZSTD_SUFFIX)
+
+
+def open_tsv_write(path: str) -> BinaryIO:
+    """TSVファイルを書き込み用に開く（.zstならマルチスレッドで圧縮しながら書き込む）"""
+    if is_compressed(path):
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+        return zstandard.open(path, "wb", cctx=cctx)
+    return open(path, "wb")
+
+
+def open_tsv_read(path: str, compression: Optional[str] = None) -> BinaryIO:
+    """
+    TSVファイルを読み込み用に開く（.zstなら解凍しながら読み込む）
+
+    compressionを省略した場合は拡張子で判断する。解凍しながら読む場合、
+    seekは今の位置より後ろにしか移動できない。
+    """
+    if compression is None:
+        compression = "zstd" if is_compressed(path) else "none"
+    if compression == "zstd":
+        return zstandard.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_exact(stream: BinaryIO, size: int) -> bytes:
+    """
+    ストリームからsizeバイト(ファイルの終わりまでならそこまで)読み込む
+    （解凍しながら読む場合、readは指定したサイズより少なく返すことがある）
+    """
+    data = stream.read(size)
+    if len(data) == size or not data:
+        return data
+    parts = [data]
+    size -= len(data)
+    while size > 0:
+        data = stream.read(size)
+        if not data:
+            break
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+
+def iter_record_chunks(
+    stream: BinaryIO, chunk_size: int = READ_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    TSVのストリームを、レコードの途中で切れないようにchunk_size程度ずつ返す
+
+    本文の改行は「"」で囲まれているので、それより前にある「"」の数が偶数の
+    改行だけをレコードの区切りとする（「"」自体は「""」と2つ重ねて書かれる）。
+    """
+    rest = b""
+    while True:
+        block = read_exact(stream, chunk_size)
+        if not block:
+            if rest:
+                yield rest
+            return
+        data = rest + block
+        end = len(data)
+        while True:
+            end = data.rfind(b"\n", 0, end)
+            if end < 0 or data.count(b'"', 0, end) % 2 == 0:
+                break
+        if end < 0:
+            # チャンク内にレコードの区切りが無い場合は、次のブロックとつなげる
+            rest = data
+            continue
+        yield data[: end + 1]
+        rest = data[end + 1 :]
+
+
+def iter_tsv_batches(
+    path: str,
+    columns: Optional[List[str]] = None,
+    schema_overrides: Optional[Dict[str, pl.DataType]] = None,
+    infer_schema: bool = True,
+    chunk_size: int = READ_CHUNK_SIZE,
+) -> Iterator[pl.DataFrame]:
+    """
+    TSVファイル(.tsv.zstも可)をチャンクごとにDataFrameにして返す
+    （ヘッダー行しか無い場合は空のDataFrameを1つ返す）
+    """
+
+    def read_chunk(data: bytes) -> pl.DataFrame:
+        return pl.read_csv(
+            io.BytesIO(data),
+            separator="\t",
+            columns=columns,
+            schema_overrides=schema_overrides,
+            infer_schema=infer_schema,
+        )
+
+    with open_tsv_read(path) as f:
+        header = b""
+        has_rows = False
+        for chunk in iter_record_chunks(f, chunk_size):
+            if not header:
+                # 列名に改行や「"」は含まれないので、最初の改行までがヘッダー
+                header_end = chunk.index(b"\n") + 1
+                header, chunk = chunk[:header_end], chunk[header_end:]
+                if not chunk:
+                    continue
+            has_rows = True
+            # 各チャンクの先頭にヘッダー行を付けて、列名で読み込めるようにする
+            yield read_chunk(header + chunk)
+        if header and not has_rows:
+            yield read_chunk(header)
+
+
+def read_tsv(
+    path: str,
+    columns: Optional[List[str]] = None,
+    schema_overrides: Optional[Dict[str, pl.DataType]] = None,
+    infer_schema: bool = True,
+) -> pl.DataFrame:
+    """
+    TSVファイルを読み込む（.tsv.zstは解凍しながらチャンクごとに読み込んで結合する）
+    """
+    if not is_compressed(path):
+        return pl.read_csv(
+            path,
+            separator="\t",
+            columns=columns,
+            schema_overrides=schema_overrides,
+            infer_schema=infer_schema,
+        )
+    batches = iter_tsv_batches(path, columns, schema_overrides, infer_schema)
+    return pl.concat(batches, how="vertical_relaxed")
+
+
+def find_tsv_file(path: str) -> str:
+    """TSVファイルが無く、zstdで圧縮したファイルがある場合はそのパスを返す"""
+    if not os.path.exists(path) and os.path.exists(path + ZSTD_SUFFIX):
+        return path + ZSTD_SUFFIX
+    return path
@@ -0,0 +1,231 @@
+"""
+Sikiのログフォルダ(サイト → 掲示板 → スレッドファイル)の一覧を作るモジュール
+
+os.scandirで各フォルダを1回ずつ走査して、掲示板フォルダ(subject.jsonがあるフォルダ)と
+その中のスレッドファイルのサイズ・更新日時の一覧(インデックス)を作る。
+Windowsではサイズと更新日時がos.scandirの結果に含まれるので、ファイルごとに
+statを呼ばずに済む。
+
+インデックスはファイルに保存しておくこともできる。次回は、掲示板フォルダと
+subject.jsonの更新日時が前回と同じ掲示板は、フォルダを走査せずに前回のスレッド
+ファイルの一覧を使う。スレッドファイルをその場で書き換えた場合はフォルダも
+subject.jsonも変わらないことがあるので、サイズと更新日時はファイルごとにstatで
+取り直す（差分変換などがこの値で変更を判定するため）。
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .siki_json import SikiSubject, load_subject
+
+SUBJECT_FILE_NAME = "subject.json"
+SCAN_CACHE_FILE_NAME = "log_scan_cache.json"
+SCAN_CACHE_VERSION = 1
+
+
+@dataclass(slots=True)
+class ThreadFileInfo:
+    """スレッドファイル({threadkey}.json)のサイズと更新日時"""
+
+    size: int
+    mtime_ns: int
+
+
+@dataclass(slots=True)
+class BoardIndex:
+    """掲示板フォルダと、その中のスレッドファイルの一覧"""
+
+    path: str
+    mtime_ns: int = 0
+    # subject.jsonのサイズと更新日時
+    subject_stat: Tuple[int, int] = (0, 0)
+    # {スレッドファイル名: サイズと更新日時}（フォルダ内の順番）
+    thread_files: Dict[str, ThreadFileInfo] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def subject_path(self) -> str:
+        return os.path.join(self.path, SUBJECT_FILE_NAME)
+
+    def load_subject(self) -> SikiSubject:
+        """subject.jsonを読み込む"""
+        return load_subject(self.subject_path)
+
+    def orphan_thread_files(self, subject_data: SikiSubject) -> List[str]:
+        """subject.jsonに記載されていないスレッドファイルの名前を返す"""
+        listed = {f"{item.threadkey}.json" for item in subject_data.items}
+        return [name for name in self.thread_files if name not in listed]
+
+
+@dataclass(slots=True)
+class SiteIndex:
+    """掲示板サイトフォルダと、その中の掲示板フォルダの一覧"""
+
+    path: str
+    boards: List[BoardIndex] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+
+@dataclass(slots=True)
+class LogIndex:
+    """ログフォルダ全体の一覧（掲示板フォルダを含むサイトフォルダだけ）"""
+
+    path: str
+    sites: List[SiteIndex] = field(default_factory=list)
+
+    def iter_boards(self) -> Iterator[BoardIndex]:
+        """全サイトの掲示板フォルダを順番に返す"""
+        for site in self.sites:
+            yield from site.boards
+
+    def find_orphan_threads(self) -> Dict[str, List[str]]:
+        """
+        subject.jsonに記載されていないスレッドファイルを
+        {掲示板フォルダのパス: [ファイル名, ...]}で返す
+        """
+        orphans = {}
+        for board in self.iter_boards():
+            file_names = board.orphan_thread_files(board.load_subject())
+            if file_names:
+                orphans[board.path] = file_names
+        return orphans
+
+
+def _board_from_cache(
+    board_path: str, mtime_ns: int, cached: Optional[dict]
+) -> Optional[BoardIndex]:
+    """
+    前回の一覧が使える場合(フォルダとsubject.jsonが変わっていない場合)は返す
+    （スレッドファイルのサイズと更新日時は取り直す。消えたファイルがあればNone）
+    """
+    if cached is None or cached.get("mtime_ns") != mtime_ns:
+        return None
+    try:
+        subject_stat = os.stat(os.path.join(board_path, SUBJECT_FILE_NAME))
+    except FileNotFoundError:
+        return None
+    if cached.get("subject") != [subject_stat.st_size, subject_stat.st_mtime_ns]:
+        return None
+    thread_files = {}
+    for name in cached["files"]:
+        try:
+            stat = os.stat(os.path.join(board_path, name))
+        except FileNotFoundError:
+            return None
+        thread_files[name] = ThreadFileInfo(stat.st_size, stat.st_mtime_ns)
+    return BoardIndex(
+        board_path,
+        mtime_ns,
+        (subject_stat.st_size, subject_stat.st_mtime_ns),
+        thread_files,
+    )
+
+
+def scan_board_folder(
+    board_path: str, mtime_ns: int = 0, cached: Optional[dict] = None
+) -> Optional[BoardIndex]:
+    """掲示板フォルダを走査する（subject.jsonが無い場合はNone）"""
+    board = _board_from_cache(board_path, mtime_ns, cached)
+    if board is not None:
+        return board
+
+    subject_stat = None
+    thread_files = {}
+    with os.scandir(board_path) as entries:
+        for entry in entries:
+            name = entry.name
+            if not name.endswith(".json") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            if name == SUBJECT_FILE_NAME:
+                subject_stat = (stat.st_size, stat.st_mtime_ns)
+            else:
+                thread_files[name] = ThreadFileInfo(stat.st_size, stat.st_mtime_ns)
+
+    if subject_stat is None:
+        return None
+    return BoardIndex(board_path, mtime_ns, subject_stat, thread_files)
+
+
+def scan_site_folder(
+    site_path: str, cached_boards: Optional[Dict[str, dict]] = None
+) -> SiteIndex:
+    """サイトフォルダ内の掲示板フォルダを、os.scandirの順番で走査する"""
+    site = SiteIndex(site_path)
+    with os.scandir(site_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            board = scan_board_folder(
+                entry.path,
+                entry.stat().st_mtime_ns,
+                cached_boards.get(entry.path) if cached_boards else None,
+            )
+            if board is not None:
+                site.boards.append(board)
+    return site
+
+
+def load_scan_cache(cache_path: str) -> Dict[str, dict]:
+    """保存した一覧を {掲示板フォルダのパス: 一覧} で読み込む（使えない場合は空）"""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != SCAN_CACHE_VERSION:
+        return {}
+    return data.get("boards", {})
+
+
+def save_scan_cache(index: LogIndex, cache_path: str) -> None:
+    """一覧をファイルに保存する（一時ファイルに書いてから置き換える）"""
+    boards = {
+        board.path: {
+            "mtime_ns": board.mtime_ns,
+            "subject": list(board.subject_stat),
+            "files": {
+                name: [info.size, info.mtime_ns]
+                for name, info in board.thread_files.items()
+            },
+        }
+        for board in index.iter_boards()
+    }
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SCAN_CACHE_VERSION, "boards": boards}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def scan_log_folder(log_folder_path: str, cache_path: Optional[str] = None) -> LogIndex:
+    """
+    ログフォルダを走査して、サイト → 掲示板 → スレッドファイルの一覧を作る
+
+    cache_pathを指定すると、前回保存した一覧を使って変更の無い掲示板フォルダの
+    走査を省き、今回の一覧をそのファイルに保存する。
+    """
+    cached_boards = load_scan_cache(cache_path) if cache_path else None
+
+    index = LogIndex(log_folder_path)
+    with os.scandir(log_folder_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                site = scan_site_folder(entry.path, cached_boards)
+                # 掲示板フォルダを含むフォルダだけをサイトフォルダとする
+                if site.boards:
+                    index.sites.append(site)
+
+    if cache_path:
+        save_scan_cache(index, cache_path)
+    return index
@@ -0,0 +1,162 @@
+"""
+SikiのログファイルのJSON(subject.json / {threadkey}.json)を読み込むモジュール
+
+変換や分析で使うフィールドだけを、__slots__付きのデータクラスに読み込む。
+JSONの読み込みには、インストールされていればmsgspec(型を指定して必要な
+フィールドだけを直接デコードする)、次にorjson、どちらも無ければ標準のjsonを使う。
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass(slots=True)
+class SikiPost:
+    """スレッド内の1つの書き込み"""
+
+    num: Optional[int] = 0
+    an: Optional[int] = 0
+    mname: Optional[str] = ""
+    mail: Optional[str] = ""
+    timestamp: Optional[int] = 0
+    chars: Optional[int] = 0
+    body: Optional[str] = ""
+    anchor_an: list = field(default_factory=list)
+    ancfrom: list = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class SikiThread:
+    """スレッドのログファイル({threadkey}.json)"""
+
+    title: Optional[str] = ""
+    established: Optional[int] = 0
+    thread_array: List[SikiPost] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class SikiSubjectItem:
+    """subject.jsonに記載されたスレッド1つ分の情報"""
+
+    threadkey: Union[str, int, None] = ""
+    title: Optional[str] = ""
+    location: Optional[str] = ""
+    resnum: Optional[int] = 0
+
+
+@dataclass(slots=True)
+class SikiSubject:
+    """掲示板のスレッド一覧(subject.json)"""
+
+    title: Optional[str] = ""
+    location: Optional[str] = ""
+    items: List[SikiSubjectItem] = field(default_factory=list)
+
+
+BACKENDS = ("msgspec", "orjson", "json")
+_backend = "msgspec" if msgspec else "orjson" if orjson else "json"
+
+if msgspec is not None:
+    _thread_decoder = msgspec.json.Decoder(SikiThread, strict=False)
+    _subject_decoder = msgspec.json.Decoder(SikiSubject, strict=False)
+
+
+def get_backend() -> str:
+    """現在使用しているJSONの読み込み方法の名前を返す"""
+    return _backend
+
+
+def set_backend(name: str) -> None:
+    """JSONの読み込み方法("msgspec" / "orjson" / "json")を切り替える"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"未対応のJSONの読み込み方法です: {name}")
+    if (name == "msgspec" and msgspec is None) or (name == "orjson" and orjson is None):
+        raise ImportError(f"{name}がインストールされていません")
+    _backend = name
+
+
+def _loads(data: bytes) -> Any:
+    """JSONを汎用のdict/listとして読み込む"""
+    if _backend != "json" and orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _thread_from_dict(thread_data: dict) -> SikiThread:
+    posts = [
+        SikiPost(
+            post.get("num", 0),
+            post.get("an", 0),
+            post.get("mname", ""),
+            post.get("mail", ""),
+            post.get("timestamp", 0),
+            post.get("chars", 0),
+            post.get("body", ""),
+            post.get("anchor_an", []),
+            post.get("ancfrom", []),
+        )
+        for post in thread_data.get("thread_array", [])
+    ]
+    return SikiThread(
+        thread_data.get("title", ""), thread_data.get("established", 0), posts
+    )
+
+
+def _subject_from_dict(subject_data: dict) -> SikiSubject:
+    items = [
+        SikiSubjectItem(
+            item.get("threadkey", ""),
+            item.get("title", ""),
+            item.get("location", ""),
+            item.get("resnum", 0),
+        )
+        for item in subject_data.get("items", [])
+    ]
+    return SikiSubject(
+        subject_data.get("title", ""), subject_data.get("location", ""), items
+    )
+
+
+def decode_thread(data: bytes) -> SikiThread:
+    """スレッドのログファイルの内容(JSON)を読み込む"""
+    if _backend == "msgspec":
+        try:
+            return _thread_decoder.decode(data)
+        except msgspec.ValidationError:
+            # 想定外の型の値がある場合は汎用の読み込み方法で読み直す
+            pass
+    return _thread_from_dict(_loads(data))
+
+
+def decode_subject(data: bytes) -> SikiSubject:
+    """subject.jsonの内容(JSON)を読み込む"""
+    if _backend == "msgspec":
+        try:
+            return _subject_decoder.decode(data)
+        except msgspec.ValidationError:
+            pass
+    return _subject_from_dict(_loads(data))
+
+
+def load_thread(path: str) -> SikiThread:
+    """スレッドのログファイルを読み込む"""
+    with open(path, "rb") as f:
+        return decode_thread(f.read())
+
+
+def load_subject(path: str) -> SikiSubject:
+    """subject.jsonを読み込む"""
+    with open(path, "rb") as f:
+        return decode_subject(f.read())
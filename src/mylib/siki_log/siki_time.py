@@ -0,0 +1,75 @@
+"""
+SikiのログのUNIXタイムスタンプ(ミリ秒)を日時の文字列に変換するモジュール
+
+投稿ごとにdatetimeを作るのではなく、タイムスタンプを整数の列にまとめて
+Polarsで一括して変換する。実行するマシンのローカルタイムゾーンに依存しないように、
+タイムゾーンは常に明示して指定する。
+"""
+
+import zoneinfo
+from typing import Iterable, List, Optional
+
+import polars as pl
+
+# タイムゾーンを指定しない場合に使うタイムゾーン
+DEFAULT_TIMEZONE = "Asia/Tokyo"
+# 出力する日時の形式
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+YEARMONTH_FORMAT = "%Y-%m"
+
+
+def check_timezone(timezone: str) -> str:
+    """タイムゾーン名(例: "Asia/Tokyo", "UTC")が正しいか確認して返す"""
+    try:
+        zoneinfo.ZoneInfo(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"不明なタイムゾーンです: {timezone}") from e
+    return timezone
+
+
+def datetime_expr(column: str, timezone: str = DEFAULT_TIMEZONE) -> pl.Expr:
+    """
+    UNIXタイムスタンプ(ミリ秒)の整数の列を、timezoneのタイムゾーン付きの日時に
+    変換する式を返す（0やNullの場合はNull）
+    """
+    timestamp = pl.col(column).cast(pl.Int64, strict=False)
+    return (
+        pl.from_epoch(pl.when(timestamp != 0).then(timestamp), time_unit="ms")
+        .dt.replace_time_zone("UTC")
+        .dt.convert_time_zone(timezone)
+    )
+
+
+def timestamp_expr(
+    column: str, fmt: str = DATETIME_FORMAT, timezone: str = DEFAULT_TIMEZONE
+) -> pl.Expr:
+    """
+    UNIXタイムスタンプ(ミリ秒)の整数の列を、日時の文字列に変換する式を返す
+    （0やNullの場合はNull）
+    """
+    return datetime_expr(column, timezone).dt.strftime(fmt)
+
+
+def format_timestamps(
+    timestamps: Iterable[Optional[int]],
+    fmt: str = DATETIME_FORMAT,
+    timezone: str = DEFAULT_TIMEZONE,
+) -> List[str]:
+    """
+    UNIXタイムスタンプ(ミリ秒)のリストを、まとめて日時の文字列のリストに変換する
+    （0やNoneの場合は空文字列）
+
+    1回の呼び出しごとに一定の処理時間がかかるので、スレッド1つずつではなく
+    複数のスレッドのタイムスタンプをまとめて渡す。
+    """
+    timestamps = list(timestamps)
+    if not timestamps:
+        return []
+    df = pl.DataFrame(
+        {"timestamp": timestamps}, schema={"timestamp": pl.Int64}, strict=False
+    )
+    return (
+        df.select(timestamp_expr("timestamp", fmt, timezone).fill_null(""))
+        .to_series()
+        .to_list()
+    )
@@ -0,0 +1,216 @@
+"""
+単語IDの配列からN-gramを作って数えるモジュール
+
+1回の形態素解析の結果(単語IDの配列)から、複数のNのN-gramをまとめて作る。
+N-gramは単語IDを並べた行(N列の配列)のまま数えるので、N-gramごとに
+文字列を作るのは結果を出力する時だけになる。
+
+数える時は各行を1つのuint64のキーにして、1次元の配列としてまとめる
+（Nが2以下なら単語IDを並べただけのキー、3以上ならハッシュ値にして、同じキーの
+行が本当に同じかを確かめる）。
+"""
+
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vocabulary import TOKEN_ID_DTYPE, Vocabulary, ids_to_numpy
+
+# N-gramの出現回数をまとめて数えるテキスト数の目安
+NGRAM_BATCH_TEXTS = 10000
+# N-gramを文字列にする時の単語の区切り（wakatigaki_ngramと同じく区切らない）
+NGRAM_SEPARATOR = ""
+# 未反映のN-gramの行がこの数と反映済みのN-gramの数の大きい方を超えたら反映する
+NGRAM_MERGE_MIN_PENDING = 1 << 21
+
+# N-gramのハッシュ値に使う定数（64bitの乗算で混ぜる）
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_HASH_MIX = np.uint64(0xBF58476D1CE4E5B9)
+
+
+def check_ngram_sizes(nums: Iterable[int]) -> Tuple[int, ...]:
+    """N-gramのNのリストを確認して、重複を除いて昇順にしたタプルを返す"""
+    nums = tuple(sorted(set(nums)))
+    if any(num <= 0 for num in nums):
+        raise ValueError("N must be a positive integer")
+    return nums
+
+
+def ngram_windows(word_ids: Sequence[int], num: int) -> np.ndarray:
+    """
+    単語IDの配列から、N-gramを1行とする(N-gramの数, N)の配列を返す
+    （単語数がNより少ない場合は0行。配列はword_idsのビューになることがある）
+    """
+    if isinstance(word_ids, array):
+        ids = np.frombuffer(word_ids, dtype=TOKEN_ID_DTYPE)
+    else:
+        ids = np.asarray(word_ids, dtype=TOKEN_ID_DTYPE)
+    if len(ids) < num:
+        return np.empty((0, num), dtype=TOKEN_ID_DTYPE)
+    return np.lib.stride_tricks.sliding_window_view(ids, num)
+
+
+def ngram_ids(word_ids: Sequence[int], nums: Iterable[int]) -> Dict[int, np.ndarray]:
+    """単語IDの配列から、複数のNのN-gramをまとめて作る {N: (N-gramの数, N)の配列}"""
+    return {num: ngram_windows(word_ids, num) for num in check_ngram_sizes(nums)}
+
+
+def ngram_keys(ngrams: np.ndarray) -> np.ndarray:
+    """
+    (N-gramの数, N)の配列の各行を、uint64のキーの配列にする
+    （Nが2以下なら行ごとに異なるキー、3以上ならハッシュ値なので衝突することがある）
+    """
+    ngrams = np.asarray(ngrams, dtype=TOKEN_ID_DTYPE)
+    num = ngrams.shape[1]
+    if num == 1:
+        return ngrams[:, 0].astype(np.uint64)
+    if num == 2:
+        return (ngrams[:, 0].astype(np.uint64) << np.uint64(32)) | ngrams[:, 1]
+    keys = np.zeros(len(ngrams), dtype=np.uint64)
+    for column in range(num):
+        keys = (keys ^ ngrams[:, column]) * _HASH_MULTIPLIER
+        keys ^= keys >> np.uint64(31)
+        keys *= _HASH_MIX
+    return keys
+
+
+def _merge_ngram_counts(
+    ngrams: np.ndarray, counts: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    重複のあるN-gramの配列と出現回数の配列を、重複の無い配列にまとめる
+    （結果はキーの順。ハッシュ値が衝突した場合は行ごとに比べてまとめ直す）
+    """
+    _, first, inverse = np.unique(
+        ngram_keys(ngrams), return_index=True, return_inverse=True
+    )
+    merged = ngrams[first]
+    if ngrams.shape[1] > 2 and not np.array_equal(merged[inverse], ngrams):
+        merged, inverse = np.unique(ngrams, axis=0, return_inverse=True)
+    merged_counts = np.bincount(
+        inverse.reshape(-1), weights=counts, minlength=len(merged)
+    ).astype(np.int64)
+    return merged, merged_counts
+
+
+class NgramCounter:
+    """
+    単語IDの配列を受け取って、複数のNのN-gramの出現回数を数えるクラス
+
+    N-gramはテキストをまたがずに作る。出現回数はNGRAM_BATCH_TEXTS件程度
+    まとめて数える。
+    """
+
+    def __init__(self, nums: Iterable[int], vocabulary: Vocabulary):
+        """
+        数えるN-gramのNのリストと、単語IDの語彙表（結果を文字列にする時に使う）を
+        指定して初期化
+        """
+        self.nums = check_ngram_sizes(nums)
+        self.vocabulary = vocabulary
+        # {N: (N-gramの配列(重複なし), 出現回数の配列)}
+        self._counts: Dict[int, Tuple[np.ndarray, np.ndarray]] = {
+            num: (
+                np.empty((0, num), dtype=TOKEN_ID_DTYPE),
+                np.empty(0, dtype=np.int64),
+            )
+            for num in self.nums
+        }
+        self._pending: List[array] = []
+        # 反映していない {N: [(N-gramの配列, 出現回数の配列), ...]}（重複してよい）
+        self._unmerged: Dict[int, List[Tuple[np.ndarray, np.ndarray]]] = {
+            num: [] for num in self.nums
+        }
+        self._unmerged_rows: Dict[int, int] = {num: 0 for num in self.nums}
+
+    def update(self, word_ids: array) -> None:
+        """1つのテキストの単語IDの配列を追加する"""
+        if len(word_ids) < self.nums[0]:
+            return
+        self._pending.append(word_ids)
+        if len(self._pending) >= NGRAM_BATCH_TEXTS:
+            self.flush()
+
+    def flush(self) -> None:
+        """まだ数えていないテキストのN-gramをまとめて数える"""
+        pending = self._pending
+        self._pending = []
+        if not pending:
+            return
+        # テキストをつなげた配列からまとめてN-gramを作り、テキストをまたぐものを除く
+        flat_ids = ids_to_numpy(pending)
+        text_ends = np.cumsum([len(word_ids) for word_ids in pending])
+        position_ends = np.repeat(text_ends, [len(word_ids) for word_ids in pending])
+        for num in self.nums:
+            windows = ngram_windows(flat_ids, num)
+            starts = np.arange(len(windows))
+            ngrams = windows[starts + num <= position_ends[: len(windows)]]
+            if len(ngrams):
+                self._add(num, ngrams, np.ones(len(ngrams), dtype=np.int64))
+
+    def add_counts(self, num: int, ngrams: np.ndarray, counts: np.ndarray) -> None:
+        """
+        NのN-gramの配列(重複なし)と出現回数の配列を足す（別に数えた結果をまとめるのに使う）
+        """
+        if len(ngrams) == 0:
+            return
+        self._add(
+            num,
+            np.asarray(ngrams, dtype=TOKEN_ID_DTYPE),
+            np.asarray(counts, dtype=np.int64),
+        )
+
+    def _add(self, num: int, ngrams: np.ndarray, counts: np.ndarray) -> None:
+        """
+        N-gramの配列と出現回数の配列を未反映の分に足す（反映済みのN-gramの数に
+        比べて多くなったらまとめて反映するので、足すたびに全体をまとめ直さない）
+        """
+        self._unmerged[num].append((ngrams, counts))
+        self._unmerged_rows[num] += len(ngrams)
+        if self._unmerged_rows[num] > max(
+            NGRAM_MERGE_MIN_PENDING, len(self._counts[num][0])
+        ):
+            self._merge(num)
+
+    def _merge(self, num: int) -> None:
+        """NのN-gramの未反映の分を、反映済みの出現回数にまとめる"""
+        unmerged = self._unmerged[num]
+        if not unmerged:
+            return
+        ngrams, counts = self._counts[num]
+        self._counts[num] = _merge_ngram_counts(
+            np.concatenate([ngrams, *(ngrams for ngrams, _ in unmerged)]),
+            np.concatenate([counts, *(counts for _, counts in unmerged)]),
+        )
+        self._unmerged[num] = []
+        self._unmerged_rows[num] = 0
+
+    def counts(self, num: int) -> Tuple[np.ndarray, np.ndarray]:
+        """NのN-gramの(N-gramの配列(重複なし), 出現回数の配列)を返す"""
+        self.flush()
+        self._merge(num)
+        return self._counts[num]
+
+    def most_common(
+        self, num: int, top_n: Optional[int] = None
+    ) -> List[Tuple[str, int]]:
+        """
+        NのN-gramを出現回数の多い順に(N-gram, 出現回数)のリストで返す
+        （同じ回数なら単語IDの順。top_nを指定すると上位top_n件だけ返す）
+        """
+        ngrams, counts = self.counts(num)
+        # 出現回数の多い順、同じ回数なら単語IDの順（np.lexsortは最後のキーが優先）
+        order = np.lexsort(
+            [ngrams[:, column] for column in reversed(range(num))] + [-counts]
+        )
+        if top_n is not None:
+            order = order[:top_n]
+        words = self.vocabulary.words
+        return [
+            (
+                NGRAM_SEPARATOR.join(words[word_id] for word_id in ngrams[i].tolist()),
+                int(counts[i]),
+            )
+            for i in order
+        ]
@@ -0,0 +1,122 @@
+"""
+対象の単語を含むテキストだけを形態素解析するための、事前の絞り込みのモジュール
+
+テキストを正規化した後で、対象の単語(表層形)のどれかが文字列として含まれるかを
+調べる（対象の単語も同じ設定で正規化しておく）。単語は正規化した後のテキストの一部なので、含まれないテキストを形態素解析
+しても対象の単語は出てこない。含まれるテキストを形態素解析して、単語の区切りとして
+出てきた場合だけを数える（「日本人」の中の「日本」などは数えない）。
+
+複数の単語をまとめて調べるのに、インストールされていればpyahocorasick
+(Aho-Corasick法)を、無ければ単語をつないだ正規表現を使う。
+"""
+
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from .text_normalize import TextNormalizer
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class TargetWordPrefilter:
+    """
+    正規化したテキストに対象の単語のどれかが含まれるかを調べるクラス
+
+    matchesで調べたテキストの数と、含まれていたテキストの数を数える。
+    selectとfilter_textsは正規化した後のテキストを返すので、トークナイザには
+    normalized=Trueで渡して、正規化し直さないようにする。
+    """
+
+    def __init__(
+        self, words: Iterable[str], normalizer: Optional[TextNormalizer] = None
+    ):
+        """
+        対象の単語のリストと、形態素解析の前の正規化の設定（トークナイザと
+        同じもの。省略時はデフォルト設定）を指定して初期化
+        （self.wordsは対象の単語を正規化したもの。正規化して空になる単語は除く）
+        """
+        self.normalizer = normalizer if normalizer is not None else TextNormalizer()
+        self.words = tuple(
+            dict.fromkeys(
+                normalized
+                for normalized in (self.normalizer.normalize(word) for word in words)
+                if normalized
+            )
+        )
+        self.texts = 0
+        self.matched = 0
+
+        self._automaton = None
+        self._pattern: Optional[re.Pattern] = None
+        if not self.words:
+            return
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word in self.words:
+                self._automaton.add_word(word, word)
+            self._automaton.make_automaton()
+        else:
+            # 長い単語から照合する（どれか1つ見つかれば良いので順番は結果に影響しない）
+            self._pattern = re.compile(
+                "|".join(map(re.escape, sorted(self.words, key=len, reverse=True)))
+            )
+
+    @property
+    def backend(self) -> str:
+        """使っている照合の方法の名前"""
+        return "pyahocorasick" if ahocorasick is not None else "re"
+
+    def contains(self, text: str, normalized: bool = False) -> bool:
+        """
+        正規化したテキストに対象の単語のどれかが含まれるかを返す
+        （normalized=Trueなら、textを正規化済みのテキストとして扱う）
+        """
+        if not text or not isinstance(text, str) or not self.words:
+            return False
+        if not normalized:
+            text = self.normalizer.normalize(text)
+        if self._automaton is not None:
+            return next(self._automaton.iter(text), None) is not None
+        return self._pattern.search(text) is not None
+
+    def matches(self, text: str, normalized: bool = False) -> bool:
+        """containsと同じ（調べたテキストの数と、含まれていた数を数える）"""
+        self.texts += 1
+        if self.contains(text, normalized):
+            self.matched += 1
+            return True
+        return False
+
+    def select(self, texts: Iterable[str]) -> Tuple[List[int], List[str]]:
+        """
+        対象の単語のどれかを含むテキストの(位置のリスト, 正規化した後のテキストの
+        リスト)を返す
+        """
+        positions: List[int] = []
+        normalized_texts: List[str] = []
+        for i, text in enumerate(texts):
+            normalized = (
+                self.normalizer.normalize(text)
+                if text and isinstance(text, str)
+                else ""
+            )
+            if self.matches(normalized, normalized=True):
+                positions.append(i)
+                normalized_texts.append(normalized)
+        return positions, normalized_texts
+
+    def filter_texts(self, texts: Iterable[str]) -> List[str]:
+        """対象の単語のどれかを含むテキストだけを、正規化した後のテキストで返す"""
+        return self.select(texts)[1]
+
+    def format_stats(self) -> str:
+        """調べたテキストの数と、形態素解析を省いた割合を表示用の文字列にする"""
+        skipped = self.texts - self.matched
+        ratio = skipped / self.texts * 100 if self.texts else 0.0
+        return (
+            f"対象の単語による絞り込み({self.backend}): {self.texts}件中"
+            f" {skipped}件 ({ratio:.1f}%) の形態素解析を省きました"
+        )
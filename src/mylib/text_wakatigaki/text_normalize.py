@@ -0,0 +1,80 @@
+"""
+形態素解析の前にテキストを正規化するモジュール
+
+URL・アンカー(>>123)・記号の除去は1つにまとめたコンパイル済みの正規表現で
+1回で置き換え、その後に空白をまとめる。どの処理を行うかは
+config.tomlの「normalize_」で始まる設定で切り替えられる。
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Optional
+
+# URL（掲示板でよく使われる「ttp://」「ttps://」も含む）
+URL_PATTERN = r"h?ttps?://\S+|ftp://\S+"
+# アンカー（>>123、>>1-3、>>1,2,3。全角の「＞＞１２３」も含む）
+ANCHOR_PATTERN = r"[>＞]{2}\d+(?:[-,、]\d+)*"
+# 記号（文字・数字・アンダースコア・空白以外）
+SYMBOL_PATTERN = r"[^\w\s]+"
+SPACE_RE = re.compile(r"\s+")
+
+
+@dataclass
+class TextNormalizer:
+    """
+    形態素解析の前にテキストを正規化するクラス
+
+    normalizeは以下の順番で処理する。
+    1. NFKC正規化（全角英数字を半角にするなど。nfkcがTrueの場合）
+    2. 英字を小文字に変換（lowercaseがTrueの場合）
+    3. URL・アンカー・記号を空白に置き換え（remove_urls/remove_anchors/remove_symbols）
+    4. 連続する空白(全角スペースや改行を含む)を1つの半角スペースにまとめる
+    """
+
+    nfkc: bool = False
+    lowercase: bool = True
+    remove_urls: bool = True
+    remove_anchors: bool = True
+    remove_symbols: bool = True
+    _remove_re: Optional[re.Pattern] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        # 有効な除去パターンを1つの正規表現にまとめてコンパイルしておく
+        # （URLとアンカーは記号より先に照合させる）
+        patterns = []
+        if self.remove_urls:
+            patterns.append(URL_PATTERN)
+        if self.remove_anchors:
+            patterns.append(ANCHOR_PATTERN)
+        if self.remove_symbols:
+            patterns.append(SYMBOL_PATTERN)
+        self._remove_re = re.compile("|".join(patterns)) if patterns else None
+
+    @classmethod
+    def from_config(cls, config_doc: dict) -> "TextNormalizer":
+        """config.tomlの設定(normalize_nfkcなど)から作る（無い設定はデフォルト値）"""
+        defaults = cls()
+        return cls(
+            nfkc=config_doc.get("normalize_nfkc", defaults.nfkc),
+            lowercase=config_doc.get("normalize_lowercase", defaults.lowercase),
+            remove_urls=config_doc.get("normalize_remove_urls", defaults.remove_urls),
+            remove_anchors=config_doc.get(
+                "normalize_remove_anchors", defaults.remove_anchors
+            ),
+            remove_symbols=config_doc.get(
+                "normalize_remove_symbols", defaults.remove_symbols
+            ),
+        )
+
+    def normalize(self, text: str) -> str:
+        """テキストを正規化する"""
+        if self.nfkc:
+            text = unicodedata.normalize("NFKC", text)
+        if self.lowercase:
+            text = text.lower()
+        if self._remove_re is not None:
+            text = self._remove_re.sub(" ", text)
+        return SPACE_RE.sub(" ", text).strip()
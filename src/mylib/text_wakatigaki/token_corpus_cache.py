@@ -0,0 +1,355 @@
+"""
+形態素解析の結果(単語IDの配列)をディスクに保存して、次回の実行で使うモジュール
+
+テキストのハッシュ値をキーにして単語IDの配列を保存するので、main_A.py(ログの
+直接分析)とmain_B_2.py(TSVの分析)で同じキャッシュを使える。キャッシュは
+辞書ファイル・正規化の設定・絞り込みの設定ごとにフォルダを分けて保存する。
+
+フォルダの中身:
+- vocabulary.parquet: 単語IDの順の単語のリスト（単語IDは追加されるだけで変わらない）
+- tokens-*.parquet: テキストのハッシュ値と単語IDの配列（実行ごとに新しい分を追加する）
+- cache.lock: 読み込み・保存の間だけ作るロックファイル
+
+main_A.pyとmain_B_2.pyを同時に実行した場合など、複数の実行が同じキャッシュを
+使う場合は、保存する時にロックを取って保存済みの語彙表を読み直し、今回追加した
+単語の単語IDを保存済みの語彙表の単語IDに置き換えてから保存する。
+"""
+
+import dataclasses
+import glob
+import hashlib
+import json
+import os
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import polars as pl
+
+from .use_vibrato import VibratoTokenizer, text_key
+from .vibrato_pool import VibratoProcessPool
+from .vocabulary import TOKEN_ID_DTYPE, TOKEN_ID_TYPECODE, Vocabulary
+
+TOKEN_CORPUS_CACHE_VERSION = 1
+VOCABULARY_FILE_NAME = "vocabulary.parquet"
+SEGMENT_FILE_PATTERN = "tokens-*.parquet"
+LOCK_FILE_NAME = "cache.lock"
+# ロックが取れない場合に待つ時間(秒)と、これより古いロックファイルを消す時間(秒)
+LOCK_RETRY_INTERVAL = 0.05
+LOCK_STALE_SECONDS = 600.0
+# これより多くのファイルに分かれたら、1つのファイルにまとめ直す
+MAX_SEGMENTS = 16
+
+
+def _settings(obj) -> dict:
+    """dataclassの設定(初期化の引数)を、JSONにできる辞書にする"""
+    settings = {}
+    for f in dataclasses.fields(obj):
+        if not f.init:
+            continue
+        value = getattr(obj, f.name)
+        if isinstance(value, (set, frozenset)):
+            value = sorted(value)
+        elif isinstance(value, tuple):
+            value = list(value)
+        settings[f.name] = value
+    return settings
+
+
+def cache_fingerprint(
+    tokenizer: Union[VibratoTokenizer, VibratoProcessPool],
+) -> str:
+    """
+    形態素解析の結果が変わる設定(辞書ファイル・正規化・絞り込み)のハッシュ値を返す
+    """
+    dict_stat = os.stat(tokenizer.vibrato_dict_pass)
+    settings = {
+        "version": TOKEN_CORPUS_CACHE_VERSION,
+        "dict": os.path.basename(tokenizer.vibrato_dict_pass),
+        "dict_size": dict_stat.st_size,
+        "dict_mtime_ns": dict_stat.st_mtime_ns,
+        "normalizer": _settings(tokenizer.normalizer),
+        "token_filter": _settings(tokenizer.token_filter),
+    }
+    text = json.dumps(settings, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _write_parquet(df: pl.DataFrame, path: str) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class _CacheLock:
+    """
+    キャッシュのフォルダのロックファイルによる排他ロック（with文で使う）
+
+    ロックファイルを排他的に作れたらロックを取ったことにする。異常終了で残った
+    ロックファイルは、LOCK_STALE_SECONDS経ったら消す。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.path = os.path.join(cache_dir, LOCK_FILE_NAME)
+
+    def __enter__(self) -> "_CacheLock":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > LOCK_STALE_SECONDS:
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(LOCK_RETRY_INTERVAL)
+                continue
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            os.close(fd)
+            return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _read_vocabulary(path: str) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    return pl.read_parquet(path)["word"].to_list()
+
+
+class TokenizedCorpusCache:
+    """
+    VibratoTokenizer(またはVibratoProcessPool)の形態素解析の結果を、ディスクに
+    保存したキャッシュから返すクラス
+
+    BBSLogAnalyzerやcsv_word_analysis.analyze_textには、トークナイザの代わりに
+    このクラスのインスタンスを渡せる。キャッシュに無いテキストだけをトークナイザで
+    解析し、closeした時に新しく解析した分を保存する（トークナイザもcloseする）。
+    トークナイザの語彙表はキャッシュの語彙表で置き換えるので、作ったばかりの
+    トークナイザを渡すこと。
+    """
+
+    def __init__(
+        self,
+        tokenizer: Union[VibratoTokenizer, VibratoProcessPool],
+        cache_dir: str,
+    ):
+        """
+        トークナイザと、キャッシュを保存するフォルダのパスを指定して初期化
+        （フォルダの中に設定ごとのフォルダを作る）
+        """
+        if len(tokenizer.vocabulary) != 0:
+            raise ValueError("語彙表が空のトークナイザを指定してください")
+        self.tokenizer = tokenizer
+        self.cache_dir = os.path.join(cache_dir, cache_fingerprint(tokenizer))
+        self.hits = 0
+        self.misses = 0
+
+        self._vocabulary_path = os.path.join(self.cache_dir, VOCABULARY_FILE_NAME)
+        self._lock = _CacheLock(self.cache_dir)
+
+        # 保存した語彙表と単語IDの配列を、同時に保存されないようにロックして読み込む
+        with self._lock:
+            words = _read_vocabulary(self._vocabulary_path)
+            segments = sorted(
+                glob.glob(os.path.join(self.cache_dir, SEGMENT_FILE_PATTERN))
+            )
+            df = (
+                pl.concat([pl.read_parquet(path) for path in segments])
+                if segments
+                else None
+            )
+
+        # 保存した語彙表をトークナイザの語彙表にする
+        self.vocabulary = Vocabulary(words)
+        tokenizer.vocabulary = self.vocabulary
+        # この語彙表の単語ID -> 保存した語彙表の単語IDの対応（読み込んだ分は同じ）
+        self._saved_ids = np.arange(len(words), dtype=np.int64)
+
+        # 保存した単語IDの配列を、1つの配列と各テキストの位置にして読み込む
+        self._index: Dict[bytes, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._flat_ids = np.empty(0, dtype=TOKEN_ID_DTYPE)
+        if df is not None:
+            lengths = df["ids"].list.len().to_numpy()
+            self._offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+            self._flat_ids = (
+                df["ids"].explode().drop_nulls().to_numpy().astype(TOKEN_ID_DTYPE)
+            )
+            self._index = {key: i for i, key in enumerate(df["key"].to_list())}
+        # 今回新しく解析したテキスト {テキストのハッシュ値: 単語IDの配列}
+        self._new_entries: Dict[bytes, array] = {}
+        # _new_entriesのうち、まだ保存していないもののキー
+        self._unsaved_keys: List[bytes] = []
+
+    @property
+    def vibrato_dict_pass(self) -> str:
+        return self.tokenizer.vibrato_dict_pass
+
+    @property
+    def normalizer(self):
+        """トークナイザの正規化の設定"""
+        return self.tokenizer.normalizer
+
+    @property
+    def token_filter(self):
+        """トークナイザの絞り込みの設定"""
+        return self.tokenizer.token_filter
+
+    def _lookup(self, key: bytes) -> Optional[array]:
+        position = self._index.get(key)
+        if position is not None:
+            start, end = self._offsets[position], self._offsets[position + 1]
+            ids = array(TOKEN_ID_TYPECODE)
+            ids.frombytes(self._flat_ids[start:end].tobytes())
+            return ids
+        return self._new_entries.get(key)
+
+    def wakatigaki_ids_batch(
+        self, texts: Iterable[str], normalized: bool = False
+    ) -> List[array]:
+        """
+        複数のテキストの単語IDの配列を返す（キャッシュに無いテキストだけを
+        まとめて形態素解析する。normalizedはVibratoTokenizer.wakatigakiと同じ）
+        """
+        texts = list(texts)
+        results: List[Optional[array]] = []
+        missing_keys: Dict[bytes, List[int]] = {}
+        missing_texts: List[str] = []
+        for i, text in enumerate(texts):
+            if not text or not isinstance(text, str):
+                results.append(array(TOKEN_ID_TYPECODE))
+                continue
+            key = text_key(text, normalized)
+            ids = self._lookup(key)
+            results.append(ids)
+            if ids is not None:
+                self.hits += 1
+                continue
+            self.misses += 1
+            if key not in missing_keys:
+                missing_keys[key] = []
+                missing_texts.append(text)
+            missing_keys[key].append(i)
+
+        if missing_texts:
+            all_ids = self.tokenizer.wakatigaki_ids_batch(missing_texts, normalized)
+            for (key, positions), ids in zip(missing_keys.items(), all_ids):
+                self._new_entries[key] = ids
+                self._unsaved_keys.append(key)
+                for i in positions:
+                    results[i] = ids
+        return results
+
+    def wakatigaki_ids(self, text: str, normalized: bool = False) -> array:
+        """テキストの単語IDの配列を返す"""
+        return self.wakatigaki_ids_batch([text], normalized)[0]
+
+    def wakatigaki_batch(
+        self, texts: Iterable[str], normalized: bool = False
+    ) -> List[List[str]]:
+        """複数のテキストの単語リストを返す"""
+        decode = self.vocabulary.decode
+        return [decode(ids) for ids in self.wakatigaki_ids_batch(texts, normalized)]
+
+    def wakatigaki(self, text: str, normalized: bool = False) -> List[str]:
+        """テキストの単語リストを返す"""
+        return self.vocabulary.decode(self.wakatigaki_ids(text, normalized))
+
+    def cache_info(self) -> Dict[str, int]:
+        """キャッシュのヒット数・ミス数・保存済みのテキスト数を返す"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "saved": len(self._index),
+            "new": len(self._new_entries),
+        }
+
+    def _map_saved_ids(self, saved_words: List[str]) -> List[str]:
+        """
+        今回追加した単語を、保存した語彙表(saved_words)の単語IDに対応させる
+
+        保存した語彙表に無い単語は後ろに追加し、追加した後の語彙表を返す
+        （他の実行が保存した単語は、その単語IDのまま使う）。
+        """
+        new_words = self.vocabulary.words[len(self._saved_ids) :]
+        if not new_words:
+            return saved_words
+        saved_ids = {word: i for i, word in enumerate(saved_words)}
+        words = list(saved_words)
+        ids = []
+        for word in new_words:
+            word_id = saved_ids.get(word)
+            if word_id is None:
+                word_id = len(words)
+                saved_ids[word] = word_id
+                words.append(word)
+            ids.append(word_id)
+        self._saved_ids = np.concatenate(
+            [self._saved_ids, np.array(ids, dtype=np.int64)]
+        )
+        return words
+
+    def save(self) -> None:
+        """
+        新しく解析した分を保存する
+
+        ロックを取って保存済みの語彙表を読み直し、単語IDをその語彙表のものに
+        置き換えて保存する。語彙表を先に保存するので、途中で止まっても保存済みの
+        単語IDの配列が語彙表に無い単語IDを指すことは無い。
+        """
+        if not self._unsaved_keys and len(self.vocabulary) == len(self._saved_ids):
+            return
+        with self._lock:
+            saved_words = _read_vocabulary(self._vocabulary_path)
+            words = self._map_saved_ids(saved_words)
+            if len(words) != len(saved_words):
+                _write_parquet(
+                    pl.DataFrame({"word": words}, schema={"word": pl.String}),
+                    self._vocabulary_path,
+                )
+            if not self._unsaved_keys:
+                return
+
+            saved_ids = self._saved_ids
+            segment = pl.DataFrame(
+                {
+                    "key": self._unsaved_keys,
+                    "ids": [
+                        saved_ids[
+                            np.frombuffer(self._new_entries[key], dtype=TOKEN_ID_DTYPE)
+                        ].tolist()
+                        for key in self._unsaved_keys
+                    ],
+                },
+                schema={"key": pl.Binary, "ids": pl.List(pl.UInt32)},
+            )
+            _write_parquet(segment, self._segment_path())
+            self._unsaved_keys = []
+
+            segments = sorted(
+                glob.glob(os.path.join(self.cache_dir, SEGMENT_FILE_PATTERN))
+            )
+            if len(segments) > MAX_SEGMENTS:
+                # 小さいファイルが増えすぎないように、1つのファイルにまとめ直す
+                merged = pl.concat([pl.read_parquet(path) for path in segments])
+                _write_parquet(merged, self._segment_path())
+                for path in segments:
+                    os.remove(path)
+
+    def _segment_path(self) -> str:
+        return os.path.join(
+            self.cache_dir, f"tokens-{time.time_ns()}-{os.getpid()}.parquet"
+        )
+
+    def close(self) -> None:
+        """新しく解析した分を保存して、トークナイザをcloseする"""
+        self.save()
+        self.tokenizer.close()
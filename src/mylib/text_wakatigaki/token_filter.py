@@ -0,0 +1,95 @@
+"""
+形態素解析の結果から、品詞やストップワードで単語を絞り込むモジュール
+
+品詞はVibratoのトークンの素性(「名詞,固有名詞,地域,国,...」)の先頭で判断する。
+どの品詞を残すか(除くか)とストップワードは、config.tomlの「token_」で始まる
+設定で指定できる。
+"""
+
+from dataclasses import dataclass, field
+from typing import FrozenSet, Iterable, List, Optional, Tuple
+
+
+def _pos_prefixes(pos_list: Iterable[str]) -> Tuple[str, ...]:
+    """
+    品詞(「名詞」や「名詞,固有名詞」)を、素性の先頭と比べる文字列にする
+    （「接頭詞,名詞接続」が「接頭詞,名詞」に当てはまらないように末尾に「,」を付ける）
+    """
+    return tuple(pos.rstrip(",") + "," for pos in pos_list if pos)
+
+
+def load_stopwords(path: str) -> List[str]:
+    """ストップワードのファイル(1行に1単語、「#」から始まる行は無視)を読み込む"""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+@dataclass
+class TokenFilter:
+    """
+    形態素解析の結果を品詞とストップワードで絞り込むクラス
+
+    include_posを指定するとその品詞の単語だけを残し、exclude_posを指定すると
+    その品詞の単語を除く（品詞は「名詞」のような大分類か、「名詞,固有名詞」の
+    ように細分類まで「,」でつないで書く）。stopwordsの単語も除く
+    （正規化した後のテキストを解析するので、正規化した後の形で書く）。
+    """
+
+    include_pos: Tuple[str, ...] = ()
+    exclude_pos: Tuple[str, ...] = ()
+    stopwords: FrozenSet[str] = frozenset()
+    _include: Tuple[str, ...] = field(default=(), init=False, repr=False, compare=False)
+    _exclude: Tuple[str, ...] = field(default=(), init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.include_pos = tuple(self.include_pos)
+        self.exclude_pos = tuple(self.exclude_pos)
+        self.stopwords = frozenset(self.stopwords)
+        self._include = _pos_prefixes(self.include_pos)
+        self._exclude = _pos_prefixes(self.exclude_pos)
+
+    @classmethod
+    def from_config(cls, config_doc: dict) -> "TokenFilter":
+        """
+        config.tomlの設定(token_pos_include・token_pos_exclude・token_stopwords・
+        token_stopwords_file)から作る（無い設定は絞り込まない）
+        """
+        stopwords = list(config_doc.get("token_stopwords", []))
+        stopwords_file: Optional[str] = config_doc.get("token_stopwords_file")
+        if stopwords_file:
+            stopwords.extend(load_stopwords(stopwords_file))
+        return cls(
+            include_pos=config_doc.get("token_pos_include", []),
+            exclude_pos=config_doc.get("token_pos_exclude", []),
+            stopwords=stopwords,
+        )
+
+    @property
+    def uses_pos(self) -> bool:
+        """品詞で絞り込むかどうか（絞り込む場合はトークンの素性が必要）"""
+        return bool(self._include or self._exclude)
+
+    def filter_tokens(self, tokens) -> List[str]:
+        """Vibratoのトークンのリストを品詞とストップワードで絞り込み、表層形のリストを返す"""
+        include = self._include
+        exclude = self._exclude
+        stopwords = self.stopwords
+        words = []
+        for token in tokens:
+            feature: str = token.feature()
+            if include and not feature.startswith(include):
+                continue
+            if exclude and feature.startswith(exclude):
+                continue
+            surface: str = token.surface()
+            if surface not in stopwords:
+                words.append(surface)
+        return words
+
+    def filter_surfaces(self, words: List[str]) -> List[str]:
+        """表層形のリストからストップワードを除く"""
+        if not self.stopwords:
+            return words
+        stopwords = self.stopwords
+        return [word for word in words if word not in stopwords]
@@ -1,38 +1,257 @@
-import zstandard
+import hashlib
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 import vibrato
-import re
+import zstandard
+
+from .ngram import NGRAM_SEPARATOR, check_ngram_sizes, ngram_ids
+from .text_normalize import TextNormalizer
+from .token_filter import TokenFilter
+from .vocabulary import Vocabulary
+
+# 解凍した辞書のキャッシュ（辞書のパスにこの拡張子を付けた名前で保存する）
+DICT_CACHE_SUFFIX = ".cache"
+DICT_CACHE_META_SUFFIX = ".cache.json"
+DICT_CACHE_VERSION = 1
+
+# トークンキャッシュのキーにするテキストのハッシュ値のバイト数
+TOKEN_CACHE_DIGEST_SIZE = 16
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _write_json(path: str, data: dict) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def ensure_dict_cache(vibrato_dict_pass: str) -> str:
+    """
+    辞書(zst)を解凍したキャッシュのファイルを用意して、そのパスを返す
+
+    キャッシュは元の辞書ファイルのサイズ・更新日時・ハッシュ値と一緒に記録する。
+    サイズと更新日時が同じならそのまま使い、更新日時だけが違う場合は
+    ハッシュ値が同じなら使う。どちらでもない場合は解凍し直す。
+    """
+    cache_path = vibrato_dict_pass + DICT_CACHE_SUFFIX
+    meta_path = vibrato_dict_pass + DICT_CACHE_META_SUFFIX
+    source_stat = os.stat(vibrato_dict_pass)
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        cache_size = os.path.getsize(cache_path)
+    except (OSError, ValueError):
+        meta = None
+    if (
+        meta is not None
+        and meta.get("version") == DICT_CACHE_VERSION
+        and meta.get("cache_size") == cache_size
+        and meta.get("source_size") == source_stat.st_size
+    ):
+        if meta.get("source_mtime_ns") == source_stat.st_mtime_ns:
+            return cache_path
+        source_hash = _file_sha256(vibrato_dict_pass)
+        if meta.get("source_sha256") == source_hash:
+            meta["source_mtime_ns"] = source_stat.st_mtime_ns
+            _write_json(meta_path, meta)
+            return cache_path
+    else:
+        source_hash = _file_sha256(vibrato_dict_pass)
+
+    # 解凍しながら一時ファイルに書き込んでから置き換える（メモリに全体を置かない）
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(vibrato_dict_pass, "rb") as src, open(tmp_path, "wb") as dst:
+        zstandard.ZstdDecompressor().copy_stream(src, dst)
+    os.replace(tmp_path, cache_path)
+    _write_json(
+        meta_path,
+        {
+            "version": DICT_CACHE_VERSION,
+            "source_size": source_stat.st_size,
+            "source_mtime_ns": source_stat.st_mtime_ns,
+            "source_sha256": source_hash,
+            "cache_size": os.path.getsize(cache_path),
+        },
+    )
+    return cache_path
+
+
+def text_key(text: str, normalized: bool = False) -> bytes:
+    """
+    トークンキャッシュのキー（長いテキストをそのまま保持しないようにハッシュ値にする）
+
+    正規化した後のテキスト(normalized=True)は、同じ文字列の正規化する前の
+    テキストとは別のキーにする。
+    """
+    return hashlib.blake2b(
+        text.encode("utf-8", "surrogatepass"),
+        digest_size=TOKEN_CACHE_DIGEST_SIZE,
+        person=b"normalized" if normalized else b"",
+    ).digest()
+
+
+def load_dict_data(vibrato_dict_pass: str, use_cache: bool = False) -> bytes:
+    """
+    辞書(zst)を解凍したバイト列を返す
+
+    use_cacheをTrueにすると、解凍した辞書を辞書と同じフォルダに保存しておき、
+    次回からはそれを読み込む（解凍を省く）。Vibratoのバインディングは
+    辞書をbytesでしか受け取れないので、メモリマップは使わずに読み込む。
+    """
+    if use_cache:
+        with open(ensure_dict_cache(vibrato_dict_pass), "rb") as f:
+            return f.read()
+
+    zstreader = zstandard.ZstdDecompressor()
+    with open(vibrato_dict_pass, "rb") as fp:
+        with zstreader.stream_reader(fp) as dict_reader:
+            return dict_reader.read()
 
 
 class VibratoTokenizer:
-    def __init__(self, vibrato_dict_pass: str):
-        """使用する辞書(zst)のパスを指定して初期化"""
-        zstreader = zstandard.ZstdDecompressor()
+    def __init__(
+        self,
+        vibrato_dict_pass: str,
+        dict_cache: bool = False,
+        normalizer: Optional[TextNormalizer] = None,
+        cache_size: int = 0,
+        token_filter: Optional[TokenFilter] = None,
+    ):
+        """
+        使用する辞書(zst)のパスを指定して初期化
+
+        dict_cacheをTrueにすると、解凍した辞書のキャッシュを使う（load_dict_data）。
+        normalizerは形態素解析の前にテキストを正規化する設定（省略時はデフォルト設定）
+        cache_sizeを1以上にすると、解析したテキストの単語リストを最大その件数まで
+        覚えておき、同じテキストは解析し直さずに返す（古く使われていないものから消す）
+        token_filterは解析した単語を品詞やストップワードで絞り込む設定（省略時は絞り込まない）
+        """
+        self.vibrato_dict_pass = vibrato_dict_pass
+        self.dict_cache = dict_cache
+        self.tokenizer = vibrato.Vibrato(load_dict_data(vibrato_dict_pass, dict_cache))
+        self.normalizer = normalizer if normalizer is not None else TextNormalizer()
+        self.token_filter = token_filter if token_filter is not None else TokenFilter()
+        # wakatigaki_ids/wakatigaki_ids_batchで使う単語IDの語彙表
+        self.vocabulary = Vocabulary()
 
-        with open(vibrato_dict_pass, "rb") as fp:
-            with zstreader.stream_reader(fp) as dict_reader:
-                self.tokenizer = vibrato.Vibrato(dict_reader.read())
+        # テキストのハッシュ値 -> 単語リストのキャッシュ（LRU）
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, Tuple[str, ...]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
-    def wakatigaki(self, text: str) -> list[str]:
-        """テキストを形態素解析して単語リストを返す"""
+    def wakatigaki(self, text: str, normalized: bool = False) -> list[str]:
+        """
+        テキストを形態素解析して単語リストを返す
+        （normalized=Trueなら、self.normalizerで正規化済みのテキストとして扱い、
+        正規化し直さない）
+        """
         if not text or not isinstance(text, str):
             return []
+        if self.cache_size <= 0:
+            return self._tokenize(text, normalized)
+
+        # 同じテキスト(スレッドタイトルやコピペなど)は、キャッシュした単語リストを返す
+        key = text_key(text, normalized)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return list(cached)
+            self.cache_misses += 1
 
-        # 特殊文字と半角・全角スペースを除去
-        cleaned_text: str = re.sub(r"[^\w\s]", "", text)
-        cleaned_text = re.sub(r"[\s　]+", " ", cleaned_text).strip()
-        # 英語を全部小文字に変換する
-        cleaned_text = text.lower()
+        words = self._tokenize(text, normalized)
+        with self._cache_lock:
+            self._cache[key] = tuple(words)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return words
+
+    def _tokenize(self, text: str, normalized: bool = False) -> list[str]:
+        # URL・アンカー・記号の除去や小文字への変換など（空白は1つにまとめられる）
+        cleaned_text: str = text if normalized else self.normalizer.normalize(text)
 
         if not cleaned_text:
             return []
 
-        # Vibratoで形態素解析
-        tokens: vibrato.TokenList = self.tokenizer.tokenize(cleaned_text)
-        # 表層形を取得してリストに変換
-        words: list[str] = [token.surface() for token in tokens]
+        if self.token_filter.uses_pos:
+            # 品詞で絞り込む場合は、トークンの素性を見ながら表層形を取り出す
+            words: list[str] = self.token_filter.filter_tokens(
+                self.tokenizer.tokenize(cleaned_text)
+            )
+        else:
+            # Vibratoで形態素解析して、表層形のリストを取得
+            # （Tokenのオブジェクトを作らないので、tokenizeで1つずつ取り出すより速い）
+            words = self.token_filter.filter_surfaces(
+                self.tokenizer.tokenize_to_surfaces(cleaned_text)
+            )
+        # 単語の区切りの空白は単語に含めない
+        if " " in cleaned_text:
+            words = [word for word in words if word != " "]
 
         return words
 
+    def wakatigaki_batch(
+        self, texts: Iterable[str], normalized: bool = False
+    ) -> list[list[str]]:
+        """
+        複数のテキストをまとめて形態素解析して、テキストごとの単語リストを返す
+        （normalizedはwakatigakiと同じ）
+
+        このプロセスで順番に解析する。Vibratoのバインディング(0.2系)は解析中に
+        GILを解放しないので、複数のCPUで解析する場合はVibratoProcessPool
+        (create_tokenizerのprocessesを2以上)を使う。
+        """
+        return [self.wakatigaki(text, normalized) for text in texts]
+
+    def wakatigaki_ids(self, text: str, normalized: bool = False) -> array:
+        """テキストを形態素解析して単語IDの配列を返す（単語IDはself.vocabularyのもの）"""
+        return self.vocabulary.encode(self.wakatigaki(text, normalized))
+
+    def wakatigaki_ids_batch(
+        self, texts: Iterable[str], normalized: bool = False
+    ) -> List[array]:
+        """wakatigaki_batchの結果を、テキストごとの単語IDの配列にして返す"""
+        encode = self.vocabulary.encode
+        return [encode(words) for words in self.wakatigaki_batch(texts, normalized)]
+
+    def cache_info(self) -> Dict[str, int]:
+        """トークンキャッシュのヒット数・ミス数・最大件数・今の件数を返す"""
+        with self._cache_lock:
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "maxsize": self.cache_size,
+                "currsize": len(self._cache),
+            }
+
+    def cache_clear(self) -> None:
+        """トークンキャッシュとヒット数・ミス数を消す"""
+        with self._cache_lock:
+            self._cache.clear()
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+    def close(self) -> None:
+        """
+        何もしない（VibratoProcessPoolやTokenizedCorpusCacheと同じように
+        使い終わったらcloseできるようにしている）
+        """
+
     def wakatigaki_ngram(self, text, num) -> list[str]:
         """
         単語リストからN-gramのリストを生成する関数
@@ -44,19 +263,34 @@ class VibratoTokenizer:
         戻り値:
             list[str]: N-gramのリスト（各N-gramは空白で結合された1つの文字列）
         """
+        return self.wakatigaki_ngrams(text, [num])[num]
 
-        if num <= 0:
-            raise ValueError("N must be a positive integer")
-
-        bigram: list[str] = self.wakatigaki(text)
-
-        if len(bigram) < num:
-            return bigram
+    def wakatigaki_ngrams(self, text: str, nums: Iterable[int]) -> Dict[int, list[str]]:
+        """
+        テキストを1回だけ形態素解析して、複数のNのN-gramのリストを返す {N: N-gramのリスト}
 
-        ngrams: list[str] = []
-        for i in range(len(bigram) - num + 1):
+        単語数がNより少ない場合は、wakatigaki_ngramと同じく単語のリストを返す。
+        N-gramを数える場合は、文字列を作らないwakatigaki_ngram_idsやNgramCounterを使う。
+        """
+        nums = check_ngram_sizes(nums)
+        words: list[str] = self.wakatigaki(text)
+        ngrams: Dict[int, list[str]] = {}
+        for num in nums:
+            if len(words) < num:
+                ngrams[num] = words
+                continue
             # n個の単語を取得して結合
-            one_word = "".join(bigram[i : i + num])
-            ngrams.append(one_word)
-
+            ngrams[num] = [
+                NGRAM_SEPARATOR.join(words[i : i + num])
+                for i in range(len(words) - num + 1)
+            ]
         return ngrams
+
+    def wakatigaki_ngram_ids(
+        self, text: str, nums: Iterable[int]
+    ) -> Dict[int, np.ndarray]:
+        """
+        テキストを1回だけ形態素解析して、複数のNのN-gramを単語IDの配列で返す
+        {N: (N-gramの数, N)の配列}（単語IDはself.vocabularyのもの）
+        """
+        return ngram_ids(self.wakatigaki_ids(text), nums)
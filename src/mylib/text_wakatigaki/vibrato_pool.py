@@ -0,0 +1,213 @@
+"""
+複数のプロセスでVibratoの形態素解析を行うモジュール
+
+各ワーカープロセスは起動時に1回だけ辞書を読み込み、その後は渡された
+テキストのまとまりを解析して単語リストを返す。forkでプロセスを作る環境
+(Linuxなど)では、親プロセスで読み込んだ辞書をコピーオンライトで共有するので、
+ワーカーごとに辞書を解凍し直さない。
+"""
+
+import math
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, List, Optional, Union
+
+from .text_normalize import TextNormalizer
+from .token_filter import TokenFilter
+from .use_vibrato import VibratoTokenizer, ensure_dict_cache
+from .vocabulary import Vocabulary
+
+# ワーカープロセスで使うトークナイザ（forkの場合は親プロセスで読み込んだもの）
+_worker_tokenizer: Optional[VibratoTokenizer] = None
+_worker_dict_pass: Optional[str] = None
+
+# この件数より少ないテキストは、プロセスに渡さずに解析する
+POOL_MIN_TEXTS = 32
+# ワーカーに1回で渡すテキストの最大数
+POOL_MAX_CHUNK_TEXTS = 1024
+
+
+def load_worker_tokenizer(
+    vibrato_dict_pass: str,
+    dict_cache: bool = False,
+    normalizer: Optional[TextNormalizer] = None,
+    cache_size: int = 0,
+    token_filter: Optional[TokenFilter] = None,
+) -> VibratoTokenizer:
+    """このプロセスのトークナイザを返す（まだ読み込んでいない辞書なら読み込む）"""
+    global _worker_tokenizer, _worker_dict_pass
+    if _worker_tokenizer is None or _worker_dict_pass != vibrato_dict_pass:
+        _worker_tokenizer = VibratoTokenizer(
+            vibrato_dict_pass,
+            dict_cache=dict_cache,
+            normalizer=normalizer,
+            cache_size=cache_size,
+            token_filter=token_filter,
+        )
+        _worker_dict_pass = vibrato_dict_pass
+        return _worker_tokenizer
+
+    changed = False
+    if normalizer is not None and normalizer != _worker_tokenizer.normalizer:
+        _worker_tokenizer.normalizer = normalizer
+        changed = True
+    if token_filter is not None and token_filter != _worker_tokenizer.token_filter:
+        _worker_tokenizer.token_filter = token_filter
+        changed = True
+    if changed:
+        # 正規化や絞り込みの設定が変わると単語リストも変わるので、キャッシュは使えない
+        _worker_tokenizer.cache_clear()
+    _worker_tokenizer.cache_size = cache_size
+    return _worker_tokenizer
+
+
+def _wakatigaki_chunk(texts: List[str], normalized: bool = False) -> List[List[str]]:
+    """ワーカープロセスでテキストのまとまりを解析する"""
+    return [_worker_tokenizer.wakatigaki(text, normalized) for text in texts]
+
+
+class VibratoProcessPool:
+    """
+    VibratoTokenizerと同じwakatigaki/wakatigaki_batchを、プロセスプールで
+    実行するクラス
+
+    BBSLogAnalyzerやcsv_word_analysis.analyze_textには、VibratoTokenizerの
+    代わりにこのクラスのインスタンスを渡せる。使い終わったらcloseする
+    （with文でも使える）。Windowsなどのspawnでプロセスを作る環境では、
+    スクリプトを「if __name__ == "__main__":」の中で実行する必要がある。
+    """
+
+    def __init__(
+        self,
+        vibrato_dict_pass: str,
+        processes: Optional[int] = None,
+        dict_cache: bool = False,
+        normalizer: Optional[TextNormalizer] = None,
+        cache_size: int = 0,
+        token_filter: Optional[TokenFilter] = None,
+    ):
+        """
+        使用する辞書(zst)のパスと、ワーカープロセスの数(省略するとCPUのコア数)を
+        指定して初期化（dict_cache・normalizer・cache_size・token_filterは
+        VibratoTokenizerと同じ。
+        トークンキャッシュはワーカープロセスごとに持つ）
+        """
+        self.vibrato_dict_pass = vibrato_dict_pass
+        self.dict_cache = dict_cache
+        self.cache_size = cache_size
+        self.processes = processes or os.cpu_count() or 1
+        # 各ワーカーで使う設定（TokenizedCorpusCacheがキャッシュを分けるのにも使う）
+        self.normalizer = normalizer if normalizer is not None else TextNormalizer()
+        self.token_filter = token_filter if token_filter is not None else TokenFilter()
+        # 単語IDの語彙表（ワーカーからは単語のリストを受け取り、親プロセスでIDにする）
+        self.vocabulary = Vocabulary()
+
+        # forkの場合は先に親プロセスで辞書を読み込み、ワーカーはそれを共有する
+        # （親プロセスでも、少ないテキストをプロセスに渡さずに解析するのに使う）
+        self._local_tokenizer: Optional[VibratoTokenizer] = None
+        if multiprocessing.get_start_method() == "fork":
+            self._local_tokenizer = load_worker_tokenizer(
+                vibrato_dict_pass, dict_cache, normalizer, cache_size, token_filter
+            )
+        elif dict_cache:
+            # 各ワーカーが同時にキャッシュを作らないように、先に用意しておく
+            ensure_dict_cache(vibrato_dict_pass)
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=load_worker_tokenizer,
+            initargs=(
+                vibrato_dict_pass,
+                dict_cache,
+                normalizer,
+                cache_size,
+                token_filter,
+            ),
+        )
+
+    def wakatigaki(self, text: str, normalized: bool = False) -> List[str]:
+        """
+        テキストを形態素解析して単語リストを返す
+        （normalizedはVibratoTokenizer.wakatigakiと同じ）
+        """
+        return self.wakatigaki_batch([text], normalized)[0]
+
+    def wakatigaki_batch(
+        self, texts: Iterable[str], normalized: bool = False
+    ) -> List[List[str]]:
+        """
+        複数のテキストを各ワーカーに分けて形態素解析して、テキストごとの
+        単語リストを入力と同じ順番で返す
+        """
+        texts = list(texts)
+        if len(texts) < POOL_MIN_TEXTS:
+            if self._local_tokenizer is not None:
+                return self._local_tokenizer.wakatigaki_batch(texts, normalized)
+            return self._executor.submit(_wakatigaki_chunk, texts, normalized).result()
+
+        # 全てのワーカーに行き渡るように分ける
+        chunk_size = min(
+            POOL_MAX_CHUNK_TEXTS,
+            max(POOL_MIN_TEXTS, math.ceil(len(texts) / self.processes)),
+        )
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        results = []
+        for chunk_result in self._executor.map(
+            _wakatigaki_chunk, chunks, repeat(normalized)
+        ):
+            results.extend(chunk_result)
+        return results
+
+    def wakatigaki_ids(self, text: str, normalized: bool = False) -> array:
+        """テキストを形態素解析して単語IDの配列を返す（単語IDはself.vocabularyのもの）"""
+        return self.vocabulary.encode(self.wakatigaki(text, normalized))
+
+    def wakatigaki_ids_batch(
+        self, texts: Iterable[str], normalized: bool = False
+    ) -> List[array]:
+        """wakatigaki_batchの結果を、テキストごとの単語IDの配列にして返す"""
+        encode = self.vocabulary.encode
+        return [encode(words) for words in self.wakatigaki_batch(texts, normalized)]
+
+    def close(self) -> None:
+        """ワーカープロセスを終了する"""
+        self._executor.shutdown()
+
+    def __enter__(self) -> "VibratoProcessPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def create_tokenizer(
+    vibrato_dict_pass: str,
+    processes: int = 1,
+    dict_cache: bool = False,
+    normalizer: Optional[TextNormalizer] = None,
+    cache_size: int = 0,
+    token_filter: Optional[TokenFilter] = None,
+) -> Union[VibratoTokenizer, VibratoProcessPool]:
+    """
+    processesが2以上ならVibratoProcessPoolを、1ならVibratoTokenizerを作る
+    （どちらも使い終わったらcloseする）
+    """
+    if processes > 1:
+        return VibratoProcessPool(
+            vibrato_dict_pass,
+            processes,
+            dict_cache,
+            normalizer,
+            cache_size,
+            token_filter,
+        )
+    return VibratoTokenizer(
+        vibrato_dict_pass,
+        dict_cache=dict_cache,
+        normalizer=normalizer,
+        cache_size=cache_size,
+        token_filter=token_filter,
+    )
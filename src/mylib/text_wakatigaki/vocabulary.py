@@ -0,0 +1,89 @@
+"""
+単語(表層形)に整数のIDを割り当てる語彙表のモジュール
+
+形態素解析の結果を単語IDの配列(array.array)にして数えることで、同じ単語の
+文字列を何度も保持せずに済み、出現回数はNumPyのbincountでまとめて数えられる。
+"""
+
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# 単語IDの型（array.arrayの型コードと、対応するNumPyの型）
+TOKEN_ID_TYPECODE = "I"
+TOKEN_ID_DTYPE = np.uint32
+
+
+class Vocabulary:
+    """
+    単語 <-> 単語IDの対応表
+
+    単語IDは0から順に、初めて出てきた単語に割り当てる。
+    """
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._ids: Dict[str, int] = {}
+        self._words: List[str] = []
+        for word in words:
+            self.add(word)
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._ids
+
+    def add(self, word: str) -> int:
+        """単語を追加して、その単語IDを返す（追加済みなら今の単語IDを返す）"""
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = len(self._words)
+            self._ids[word] = word_id
+            self._words.append(word)
+        return word_id
+
+    def get_id(self, word: str) -> Optional[int]:
+        """単語IDを返す（語彙表に無い単語はNone）"""
+        return self._ids.get(word)
+
+    def get_word(self, word_id: int) -> str:
+        """単語IDから単語を返す"""
+        return self._words[word_id]
+
+    @property
+    def words(self) -> List[str]:
+        """単語IDの順の単語のリスト（変更しないこと）"""
+        return self._words
+
+    def encode(self, words: Iterable[str]) -> array:
+        """単語のリストを単語IDの配列にする（語彙表に無い単語は追加する）"""
+        ids = self._ids
+        add = self.add
+        return array(
+            TOKEN_ID_TYPECODE,
+            [ids[word] if word in ids else add(word) for word in words],
+        )
+
+    def decode(self, word_ids: Iterable[int]) -> List[str]:
+        """単語IDの配列を単語のリストにする"""
+        words = self._words
+        return [words[word_id] for word_id in word_ids]
+
+
+def ids_to_numpy(word_ids: Sequence[array]) -> np.ndarray:
+    """単語IDの配列のリストを、つなげて1つのNumPyの配列にする"""
+    if not word_ids:
+        return np.empty(0, dtype=TOKEN_ID_DTYPE)
+    joined = array(TOKEN_ID_TYPECODE)
+    for ids in word_ids:
+        joined.extend(ids)
+    return np.frombuffer(joined, dtype=TOKEN_ID_DTYPE)
+
+
+def count_ids(word_ids: Sequence[array], size: int) -> np.ndarray:
+    """
+    単語IDの配列のリストに含まれる、単語IDごとの出現回数を返す
+    （sizeは語彙表の単語数。戻り値の長さはsizeになる）
+    """
+    return np.bincount(ids_to_numpy(word_ids), minlength=size)
@@ -0,0 +1,147 @@
+"""
+ログの解析の途中経過(チェックポイント)を保存して、止まった所から再開するモジュール
+
+掲示板の解析が終わるたびに、前回の保存から一定の時間が経っていれば、それまでの
+出現回数(BoardPartialと同じ形式)と解析の終わった掲示板の一覧を1つのnpzファイルに
+保存する。再開する場合はその出現回数を読み込み、解析の終わった掲示板を飛ばす。
+"""
+
+import json
+import os
+import time
+from typing import Dict
+
+import numpy as np
+
+from ..siki_log.log_scan import BoardIndex, LogIndex, SiteIndex
+from .analysis_mapreduce import (
+    BoardPartial,
+    analysis_settings_fingerprint,
+    board_fingerprint,
+    write_npz,
+)
+
+CHECKPOINT_VERSION = 1
+# チェックポイントを保存する間隔(秒)のデフォルト値
+DEFAULT_CHECKPOINT_INTERVAL = 600.0
+
+
+class AnalysisCheckpoint:
+    """
+    BBSLogAnalyzerの解析の途中経過を保存・読み込みするクラス
+
+    途中経過は掲示板の区切りで保存するので、掲示板の途中で止まった場合は、
+    その掲示板は再開した時に最初から解析する。
+    """
+
+    def __init__(
+        self, analyzer, path: str, interval: float = DEFAULT_CHECKPOINT_INTERVAL
+    ):
+        """
+        解析に使うBBSLogAnalyzerと、保存先のファイルのパス、保存する間隔(秒)を
+        指定して初期化
+        """
+        self.analyzer = analyzer
+        self.path = path
+        self.interval = interval
+        self.settings_fingerprint = analysis_settings_fingerprint(analyzer)
+        # 解析の終わった掲示板 {掲示板フォルダのパス: board_fingerprintの値}
+        self.completed: Dict[str, str] = {}
+        self._last_saved = time.monotonic()
+
+    def load(self, log_index: LogIndex) -> bool:
+        """
+        保存した途中経過をanalyzerに読み込む（読み込んだ場合はTrue）
+
+        ログフォルダや解析の設定が違う場合や、解析の終わった掲示板のファイルが
+        その後で変わった場合は、途中経過を使えないので読み込まない。
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if (
+                    int(data["checkpoint_version"]) != CHECKPOINT_VERSION
+                    or str(data["log_dir"]) != self.analyzer.log_dir
+                    or str(data["settings"]) != self.settings_fingerprint
+                ):
+                    print("チェックポイントの設定が違うため、最初から解析します")
+                    return False
+                completed = dict(
+                    zip(
+                        data["completed_boards"].tolist(),
+                        data["completed_fingerprints"].tolist(),
+                    )
+                )
+                orphan_thread_files = json.loads(str(data["orphan_thread_files_json"]))
+                partial = BoardPartial.from_arrays(data)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"チェックポイントを読み込めないため、最初から解析します: {e}")
+            return False
+        if partial is None:
+            return False
+
+        boards = {board.path: board for board in log_index.iter_boards()}
+        for board_path, fingerprint in completed.items():
+            board = boards.get(board_path)
+            if board is None or board_fingerprint(board) != fingerprint:
+                print(
+                    f"解析済みの掲示板 {board_path} が変わったため、最初から解析します"
+                )
+                return False
+
+        self.analyzer.merge_partial(partial)
+        self.analyzer.orphan_thread_files.update(orphan_thread_files)
+        self.completed = completed
+        return True
+
+    def remaining(self, log_index: LogIndex) -> LogIndex:
+        """log_indexから、解析の終わった掲示板を除いたものを返す"""
+        return LogIndex(
+            log_index.path,
+            [
+                SiteIndex(
+                    site.path,
+                    [
+                        board
+                        for board in site.boards
+                        if board.path not in self.completed
+                    ],
+                )
+                for site in log_index.sites
+            ],
+        )
+
+    def board_done(self, board: BoardIndex) -> None:
+        """掲示板の解析が終わったことを記録し、前回の保存から時間が経っていれば保存する"""
+        self.completed[board.path] = board_fingerprint(board)
+        if time.monotonic() - self._last_saved >= self.interval:
+            self.save()
+
+    def save(self) -> None:
+        """ここまでの出現回数と、解析の終わった掲示板の一覧を保存する"""
+        analyzer = self.analyzer
+        arrays = analyzer.to_partial(
+            analyzer.log_dir, self.settings_fingerprint
+        ).to_arrays()
+        arrays.update(
+            {
+                "checkpoint_version": np.array(CHECKPOINT_VERSION),
+                "log_dir": np.array(analyzer.log_dir),
+                "settings": np.array(self.settings_fingerprint),
+                "completed_boards": np.array(list(self.completed), dtype=str),
+                "completed_fingerprints": np.array(
+                    list(self.completed.values()), dtype=str
+                ),
+                "orphan_thread_files_json": np.array(
+                    json.dumps(analyzer.orphan_thread_files, ensure_ascii=False)
+                ),
+            }
+        )
+        write_npz(self.path, arrays)
+        self._last_saved = time.monotonic()
+
+    def remove(self) -> None:
+        """保存した途中経過を消す（解析が最後まで終わった時に使う）"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
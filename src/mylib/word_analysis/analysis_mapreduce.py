@@ -0,0 +1,313 @@
+"""
+ログの解析を掲示板ごとに複数のプロセスで行い、結果をまとめるモジュール
+
+各ワーカープロセスは掲示板1つを解析して、その掲示板だけの語彙表と出現回数
+(BoardPartial)を返す。親プロセスは掲示板の順番にBoardPartialの単語を自分の語彙表の
+単語IDに置き換えて足すので、単語IDの割り当て順を含めて逐次処理と同じ結果になる。
+
+BoardPartialはファイルに保存でき、掲示板のファイルと解析の設定が変わっていなければ
+次回の実行ではワーカーで解析し直さずに保存したものを使う。
+"""
+
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from ..siki_log.log_scan import BoardIndex, LogIndex
+from ..text_wakatigaki.token_corpus_cache import TokenizedCorpusCache, cache_fingerprint
+from ..text_wakatigaki.vibrato_pool import load_worker_tokenizer
+from ..text_wakatigaki.vocabulary import Vocabulary
+
+BOARD_PARTIAL_VERSION = 1
+
+# ワーカープロセスで使う設定（_init_workerで設定する）
+_worker_analyzer_class = None
+_worker_tokenizer_args: tuple = ()
+_worker_analyzer_kwargs: dict = {}
+
+
+def write_npz(path: str, arrays: Dict[str, np.ndarray]) -> None:
+    """
+    配列をnpz形式のファイルに保存する（書き込み途中のファイルを読まないように、
+    別名で書いてから置き換える）
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+@dataclass
+class BoardPartial:
+    """
+    掲示板1つ分の解析結果（単語IDはwordsのインデックス）
+
+    merge_partialで別の語彙表の解析結果に足せる。
+    """
+
+    board_path: str
+    # 解析した時の掲示板のファイルの状態（board_fingerprintの値）
+    board_fingerprint: str
+    words: List[str]
+    # 単語IDごとの出現回数
+    word_counts: np.ndarray
+    # 月別カウント（(単語ID, 年月の列, 出現回数)の組と、年月の列のリスト）
+    months: List[str]
+    monthly_word_ids: np.ndarray
+    monthly_columns: np.ndarray
+    monthly_counts: np.ndarray
+    # N-gramの出現回数 {N: (N-gramの配列, 出現回数の配列)}
+    ngram_counts: Dict[int, Tuple[np.ndarray, np.ndarray]] = field(default_factory=dict)
+    orphan_thread_files: List[str] = field(default_factory=list)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """npz形式で保存するための、名前と配列の辞書にする"""
+        arrays = {
+            "version": np.array(BOARD_PARTIAL_VERSION),
+            "board_path": np.array(self.board_path),
+            "board_fingerprint": np.array(self.board_fingerprint),
+            "words": np.array(self.words, dtype=str),
+            "word_counts": self.word_counts,
+            "months": np.array(self.months, dtype=str),
+            "monthly_word_ids": self.monthly_word_ids,
+            "monthly_columns": self.monthly_columns,
+            "monthly_counts": self.monthly_counts,
+            "ngram_sizes": np.array(sorted(self.ngram_counts), dtype=np.int64),
+            "orphan_thread_files": np.array(self.orphan_thread_files, dtype=str),
+        }
+        for num, (ngrams, counts) in self.ngram_counts.items():
+            arrays[f"ngrams_{num}"] = ngrams
+            arrays[f"ngram_counts_{num}"] = counts
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data) -> Optional["BoardPartial"]:
+        """to_arraysの辞書(np.loadの結果)から作る（形式の違うものはNone）"""
+        if int(data["version"]) != BOARD_PARTIAL_VERSION:
+            return None
+        ngram_counts = {
+            num: (data[f"ngrams_{num}"], data[f"ngram_counts_{num}"])
+            for num in data["ngram_sizes"].tolist()
+        }
+        return cls(
+            board_path=str(data["board_path"]),
+            board_fingerprint=str(data["board_fingerprint"]),
+            words=data["words"].tolist(),
+            word_counts=data["word_counts"],
+            months=data["months"].tolist(),
+            monthly_word_ids=data["monthly_word_ids"],
+            monthly_columns=data["monthly_columns"],
+            monthly_counts=data["monthly_counts"],
+            ngram_counts=ngram_counts,
+            orphan_thread_files=data["orphan_thread_files"].tolist(),
+        )
+
+    def save(self, path: str) -> None:
+        """npz形式のファイルに保存する"""
+        write_npz(path, self.to_arrays())
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BoardPartial"]:
+        """saveしたファイルを読み込む（無いファイルや形式の違うファイルはNone）"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return cls.from_arrays(data)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def load_fingerprint(path: str) -> Optional[str]:
+        """saveしたファイルのboard_fingerprintだけを読み込む（読めない場合はNone）"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != BOARD_PARTIAL_VERSION:
+                    return None
+                return str(data["board_fingerprint"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def _hash_json(value) -> str:
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def board_fingerprint(board: BoardIndex) -> str:
+    """掲示板のsubject.jsonとスレッドファイルのサイズ・更新日時のハッシュ値を返す"""
+    return _hash_json(
+        {
+            "path": board.path,
+            "subject": list(board.subject_stat),
+            "threads": sorted(
+                [name, info.size, info.mtime_ns]
+                for name, info in board.thread_files.items()
+            ),
+        }
+    )
+
+
+def partial_settings_fingerprint(
+    tokenizer,
+    timezone: str,
+    ngram_sizes: Iterable[int],
+    target_words: Optional[Iterable[str]] = None,
+) -> str:
+    """
+    BoardPartialの内容が変わる設定(形態素解析・タイムゾーン・N-gram・対象の単語)の
+    ハッシュ値を返す
+    """
+    return _hash_json(
+        {
+            "version": BOARD_PARTIAL_VERSION,
+            "tokenizer": cache_fingerprint(tokenizer),
+            "timezone": timezone,
+            "ngram_sizes": sorted(ngram_sizes),
+            "target_words": list(target_words) if target_words is not None else None,
+        }
+    )
+
+
+def _base_tokenizer(tokenizer):
+    """TokenizedCorpusCacheの場合は、中のトークナイザを返す"""
+    if isinstance(tokenizer, TokenizedCorpusCache):
+        return tokenizer.tokenizer
+    return tokenizer
+
+
+def _analyzer_ngram_sizes(analyzer) -> Tuple[int, ...]:
+    return analyzer.ngram_counter.nums if analyzer.ngram_counter else ()
+
+
+def analysis_settings_fingerprint(analyzer) -> str:
+    """BBSLogAnalyzerの解析結果が変わる設定のハッシュ値を返す"""
+    return partial_settings_fingerprint(
+        _base_tokenizer(analyzer.vibrato_tokenizer),
+        analyzer.timezone,
+        _analyzer_ngram_sizes(analyzer),
+        analyzer.target_words,
+    )
+
+
+def _init_worker(analyzer_class, tokenizer_args: tuple, analyzer_kwargs: dict):
+    """ワーカープロセスの初期化（辞書を読み込んでおく）"""
+    global _worker_analyzer_class, _worker_tokenizer_args, _worker_analyzer_kwargs
+    _worker_analyzer_class = analyzer_class
+    _worker_tokenizer_args = tokenizer_args
+    _worker_analyzer_kwargs = analyzer_kwargs
+    load_worker_tokenizer(*tokenizer_args)
+
+
+def _analyze_board(site_path: str, board: BoardIndex) -> BoardPartial:
+    """ワーカープロセスで掲示板1つを解析する"""
+    tokenizer = load_worker_tokenizer(*_worker_tokenizer_args)
+    # 掲示板ごとに空の語彙表から単語IDを割り当てる
+    tokenizer.vocabulary = Vocabulary()
+    analyzer = _worker_analyzer_class(board.path, tokenizer, **_worker_analyzer_kwargs)
+    analyzer.analyze_board_folder(site_path, board.name, board)
+    return analyzer.to_partial(board.path, board_fingerprint(board))
+
+
+def _tokenizer_args(tokenizer) -> tuple:
+    """ワーカーでトークナイザを作るための、load_worker_tokenizerの引数を返す"""
+    return (
+        tokenizer.vibrato_dict_pass,
+        tokenizer.dict_cache,
+        tokenizer.normalizer,
+        tokenizer.cache_size,
+        tokenizer.token_filter,
+    )
+
+
+def run_analysis_mapreduce(
+    analyzer,
+    log_index: LogIndex,
+    processes: int,
+    partial_dir: Optional[str] = None,
+    on_board_done: Optional[Callable[[BoardIndex], None]] = None,
+) -> Dict[str, int]:
+    """
+    BBSLogAnalyzerでログフォルダ全体を掲示板ごとに複数のプロセスで解析し、
+    結果をanalyzerに足す
+
+    partial_dirを指定すると、掲示板ごとの解析結果をその中に保存し、次回からは
+    掲示板のファイルが変わっていなければ保存したものを使う。
+    on_board_done(掲示板)は、掲示板の結果をanalyzerに足すたびに呼ぶ。
+    ワーカーに渡しておく掲示板の数はprocessesの2倍までに抑えて、足す順番を待つ
+    解析結果が溜まりすぎないようにする。
+    (ワーカーで解析した掲示板の数, 保存したものを使った掲示板の数)を辞書で返す。
+    """
+    analyzer_kwargs = {
+        "timezone": analyzer.timezone,
+        "ngram_sizes": _analyzer_ngram_sizes(analyzer),
+        "target_words": analyzer.target_words,
+    }
+    # 保存した形態素解析の結果はワーカーでは使わず、設定だけを使う
+    tokenizer_args = _tokenizer_args(_base_tokenizer(analyzer.vibrato_tokenizer))
+    partial_root = None
+    if partial_dir:
+        partial_root = os.path.join(
+            partial_dir, analysis_settings_fingerprint(analyzer)
+        )
+
+    boards = [(site.path, board) for site in log_index.sites for board in site.boards]
+
+    def partial_path(board: BoardIndex) -> Optional[str]:
+        if partial_root is None:
+            return None
+        name = hashlib.sha256(board.path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(partial_root, f"{name}.npz")
+
+    def is_saved(board: BoardIndex) -> bool:
+        path = partial_path(board)
+        if path is None or not os.path.exists(path):
+            return False
+        return BoardPartial.load_fingerprint(path) == board_fingerprint(board)
+
+    # 保存した結果が使えない掲示板だけをワーカーで解析する
+    saved = {i for i, (_, board) in enumerate(boards) if is_saved(board)}
+    stats = {"analyzed": len(boards) - len(saved), "reused": len(saved)}
+
+    # forkの場合は先に親プロセスで辞書を読み込み、ワーカーはそれを共有する
+    if stats["analyzed"] and multiprocessing.get_start_method() == "fork":
+        load_worker_tokenizer(*tokenizer_args)
+    executor = ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(type(analyzer), tokenizer_args, analyzer_kwargs),
+    )
+    try:
+        futures: Dict[int, Future] = {}
+        unsubmitted = iter(i for i in range(len(boards)) if i not in saved)
+
+        def submit_next(count: int) -> None:
+            for i in itertools.islice(unsubmitted, count):
+                futures[i] = executor.submit(_analyze_board, *boards[i])
+
+        submit_next(processes * 2)
+        # 単語IDの割り当て順を逐次処理と同じにするため、掲示板の順番に足す
+        for i, (_, board) in enumerate(tqdm(boards, desc="解析中")):
+            if i in futures:
+                partial = futures.pop(i).result()
+                submit_next(1)
+                path = partial_path(board)
+                if path is not None:
+                    partial.save(path)
+            else:
+                partial = BoardPartial.load(partial_path(board))
+                if partial is None:
+                    # 確認した後でファイルが消えた場合などは、ここで解析する
+                    partial = executor.submit(_analyze_board, *boards[i]).result()
+            analyzer.merge_partial(partial)
+            if on_board_done is not None:
+                on_board_done(board)
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return stats
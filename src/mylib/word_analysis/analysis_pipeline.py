@@ -0,0 +1,307 @@
+"""
+ログの解析を、読み込み → JSONの解析 → 形態素解析 → 集計の段階に分けて、
+段階ごとのスレッドで並行して行うモジュール
+
+各段階は大きさに上限のあるキューでつながっていて、後ろの段階が遅い場合は
+前の段階がキューの空きを待つ（読み込んだファイルがメモリに溜まり続けない）。
+段階ごとに処理した件数・処理していた時間・前後の段階を待っていた時間を数えて、
+どの段階が全体の速さを決めているか(ボトルネック)を表示できる。
+
+形態素解析の段階はスレッド1つで順番に処理するので、単語IDの割り当て順は
+逐次処理と同じになる（複数のCPUで解析する場合は、トークナイザに
+VibratoProcessPoolを使う）。
+"""
+
+import os
+import queue
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
+
+from tqdm import tqdm
+
+from ..siki_log.log_scan import BoardIndex, LogIndex
+from ..siki_log.siki_json import (
+    SikiPost,
+    SikiSubject,
+    SikiSubjectItem,
+    SikiThread,
+    decode_thread,
+    load_subject,
+)
+
+# 段階の間のキューに溜められる件数（掲示板またはスレッドファイルの数）
+PIPELINE_QUEUE_SIZE = 64
+# キューが空き(または届く)のを待つ間に、止める指示を確認する間隔(秒)
+_POLL_SECONDS = 0.1
+
+
+@dataclass
+class StageStats:
+    """パイプラインの1つの段階の処理件数と時間"""
+
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0
+    # 前の段階からの入力を待っていた時間と、次の段階のキューの空きを待っていた時間
+    input_wait_seconds: float = 0.0
+    output_wait_seconds: float = 0.0
+
+    @property
+    def items_per_sec(self) -> Optional[float]:
+        """処理していた時間あたりの件数（この段階だけなら出せる速さ）"""
+        return self.items / self.busy_seconds if self.busy_seconds else None
+
+    def format(self) -> str:
+        speed = self.items_per_sec
+        speed_text = f"{speed:,.1f}件/秒" if speed is not None else "-"
+        return (
+            f"{self.name}: {self.items}件 {speed_text} "
+            f"(処理 {self.busy_seconds:.2f}秒 / 入力待ち {self.input_wait_seconds:.2f}秒"
+            f" / 出力待ち {self.output_wait_seconds:.2f}秒)"
+        )
+
+
+def format_pipeline_stats(stats: List[StageStats]) -> List[str]:
+    """段階ごとの結果と、処理していた時間が最も長い段階(ボトルネック)を表示用の行にする"""
+    lines = [stage.format() for stage in stats]
+    if stats:
+        bottleneck = max(stats, key=lambda stage: stage.busy_seconds)
+        lines.append(f"ボトルネック: {bottleneck.name}")
+    return lines
+
+
+@dataclass
+class _BoardItem:
+    """掲示板1つ分(subject.json)"""
+
+    board: BoardIndex
+    subject: Optional[SikiSubject] = None
+    error: Optional[Exception] = None
+    board_title_ids: Optional[array] = None
+    thread_items: List[SikiSubjectItem] = field(default_factory=list)
+    title_ids: List[array] = field(default_factory=list)
+
+
+@dataclass
+class _ThreadItem:
+    """スレッドファイル1つ分"""
+
+    path: str
+    data: Optional[bytes] = None
+    thread: Optional[SikiThread] = None
+    error: Optional[Exception] = None
+    title_ids: Optional[array] = None
+    posts: List[SikiPost] = field(default_factory=list)
+    post_ids: List[array] = field(default_factory=list)
+
+
+@dataclass
+class _StageFailure:
+    """段階のスレッドで起きた例外（後ろの段階に渡して、集計する側で投げ直す）"""
+
+    error: BaseException
+
+
+# 段階の終わりを表す印
+_END = object()
+
+
+def _put(output_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """キューに空きができるまで待って入れる（止める指示があればFalseを返す）"""
+    while not stop.is_set():
+        try:
+            output_queue.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_queue(input_queue: queue.Queue, stop: threading.Event) -> Iterator:
+    """キューから終わりの印が届くまで取り出す（止める指示があれば終わる）"""
+    while not stop.is_set():
+        try:
+            item = input_queue.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        yield item
+
+
+def _run_stage(
+    stats: StageStats,
+    items: Iterator,
+    func: Optional[Callable],
+    output_queue: queue.Queue,
+    stop: threading.Event,
+) -> None:
+    """
+    itemsの各要素をfuncで処理して次の段階のキューに入れる（スレッドで実行する）
+
+    funcがNoneの場合はitems自体が処理を行う（読み込みの段階）ので、
+    要素を取り出す時間を処理の時間として数える。
+    """
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            received = time.perf_counter()
+            if func is None:
+                stats.busy_seconds += received - start
+            else:
+                stats.input_wait_seconds += received - start
+                if not isinstance(item, _StageFailure):
+                    item = func(item)
+                stats.busy_seconds += time.perf_counter() - received
+            sent = time.perf_counter()
+            if not _put(output_queue, item, stop):
+                return
+            stats.output_wait_seconds += time.perf_counter() - sent
+            if isinstance(item, _StageFailure):
+                return
+            stats.items += 1
+    except BaseException as e:
+        _put(output_queue, _StageFailure(e), stop)
+        return
+    _put(output_queue, _END, stop)
+
+
+def _read_items(log_index: LogIndex) -> Iterator:
+    """
+    掲示板ごとにsubject.jsonを読み込み、記載されている順にスレッドファイルを読み込む
+    （逐次処理のanalyze_board_folderと同じスレッドファイルを同じ順番で読む）
+    """
+    for board in log_index.iter_boards():
+        try:
+            subject = load_subject(board.subject_path)
+        except Exception as e:
+            yield _BoardItem(board, error=e)
+            continue
+        yield _BoardItem(board, subject)
+        for item in subject.items:
+            if not item.threadkey:
+                continue
+            file_name = f"{item.threadkey}.json"
+            if file_name not in board.thread_files:
+                continue
+            path = os.path.join(board.path, file_name)
+            try:
+                with open(path, "rb") as f:
+                    yield _ThreadItem(path, f.read())
+            except Exception as e:
+                yield _ThreadItem(path, error=e)
+
+
+def _parse_item(item):
+    """スレッドファイルのJSONを解析する"""
+    if isinstance(item, _ThreadItem) and item.error is None:
+        try:
+            item.thread = decode_thread(item.data)
+        except Exception as e:
+            item.error = e
+        item.data = None
+    return item
+
+
+def run_analysis_pipeline(
+    analyzer,
+    log_index: LogIndex,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    on_board_done: Optional[Callable[[BoardIndex], None]] = None,
+) -> List[StageStats]:
+    """
+    BBSLogAnalyzerでログフォルダ全体を段階に分けて解析し、段階ごとの結果を返す
+
+    単語の出現回数などの結果は、analyze_board_folderで逐次処理した場合と同じになる。
+    on_board_done(掲示板)は、掲示板のスレッドファイルをすべて集計するたびに呼ぶ。
+    """
+
+    def tokenize_item(item):
+        if item.error is not None:
+            return item
+        try:
+            if isinstance(item, _BoardItem):
+                item.board_title_ids, item.thread_items, item.title_ids = (
+                    analyzer.tokenize_subject(item.subject)
+                )
+            else:
+                item.title_ids, item.posts, item.post_ids = analyzer.tokenize_thread(
+                    item.thread
+                )
+        except Exception as e:
+            item.error = e
+        return item
+
+    stop = threading.Event()
+    stats = [StageStats(name) for name in ("read", "parse", "tokenize", "aggregate")]
+    read_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    parse_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    tokenize_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    stage_args = [
+        (stats[0], _read_items(log_index), None, read_queue),
+        (stats[1], _iter_queue(read_queue, stop), _parse_item, parse_queue),
+        (stats[2], _iter_queue(parse_queue, stop), tokenize_item, tokenize_queue),
+    ]
+    threads = [
+        threading.Thread(target=_run_stage, args=(*args, stop), daemon=True)
+        for args in stage_args
+    ]
+    for thread in threads:
+        thread.start()
+
+    # 集計はこのスレッドで、届いた順に行う
+    aggregate = stats[3]
+    progress = tqdm(
+        total=sum(len(site.boards) for site in log_index.sites), desc="解析中"
+    )
+    # 集計中の掲示板（次の掲示板が届いたら、その掲示板の集計は終わっている）
+    current_board: Optional[BoardIndex] = None
+    try:
+        items = _iter_queue(tokenize_queue, stop)
+        while True:
+            start = time.perf_counter()
+            item = next(items, _END)
+            received = time.perf_counter()
+            aggregate.input_wait_seconds += received - start
+            if isinstance(item, _StageFailure):
+                raise item.error
+            if item is _END or isinstance(item, _BoardItem):
+                if current_board is not None and on_board_done is not None:
+                    on_board_done(current_board)
+            if item is _END:
+                break
+
+            if isinstance(item, _BoardItem):
+                current_board = item.board
+                progress.update(1)
+                if item.error is not None:
+                    print(f"Error analyzing board {item.board.name}: {str(item.error)}")
+                else:
+                    orphans = item.board.orphan_thread_files(item.subject)
+                    if orphans:
+                        analyzer.orphan_thread_files[item.board.path] = orphans
+                    if item.board_title_ids is not None:
+                        analyzer.add_words(item.board_title_ids)
+                    for title_ids in item.title_ids:
+                        analyzer.add_words(title_ids)
+            elif item.error is not None:
+                print(f"Error analyzing thread file {item.path}: {str(item.error)}")
+            else:
+                analyzer.add_thread_words(
+                    item.thread, item.title_ids, item.posts, item.post_ids, item.path
+                )
+            aggregate.busy_seconds += time.perf_counter() - received
+            aggregate.items += 1
+    finally:
+        stop.set()
+        progress.close()
+        for thread in threads:
+            thread.join()
+    return stats
@@ -1,16 +1,98 @@
 import argparse
+import os
 from collections import Counter
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 import japanize_matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import polars as pl
 
+from ..logdata_convert.tsv_compression import find_tsv_file, read_tsv
+from ..text_wakatigaki.target_prefilter import TargetWordPrefilter
 from ..text_wakatigaki.use_vibrato import VibratoTokenizer
+from ..text_wakatigaki.vocabulary import count_ids
 
 japanize_matplotlib.japanize()
 
+# Parquetのパーティション(サイト・掲示板・年月)の列の型
+# （掲示板フォルダ名が数字だけの場合も、整数にせずに文字列として読み込む）
+PARTITION_SCHEMA = {"site": pl.String, "board": pl.String, "month": pl.String}
+
+
+def is_parquet_path(path: str) -> bool:
+    """Parquet(ファイルかパーティション分割したフォルダ)のパスかどうか"""
+    return os.path.isdir(path) or path.endswith(".parquet")
+
+
+def partition_filter(
+    sites: Optional[List[str]] = None,
+    boards: Optional[List[str]] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+) -> Optional[pl.Expr]:
+    """
+    Parquetのpostsフォルダを、パーティション(site・board・month)で絞り込む式を返す
+    （month_from・month_toは"YYYY-MM"で、その月を含む。何も指定しない場合はNone）
+    """
+    conditions = []
+    if sites:
+        conditions.append(pl.col("site").is_in(sites))
+    if boards:
+        conditions.append(pl.col("board").is_in(boards))
+    if month_from:
+        conditions.append(pl.col("month") >= month_from)
+    if month_to:
+        conditions.append(pl.col("month") <= month_to)
+    if not conditions:
+        return None
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition = condition & other
+    return condition
+
+
+def read_table(
+    path: str, columns: List[str], filters: Optional[pl.Expr] = None
+) -> pl.DataFrame:
+    """
+    TSVファイル(zstdで圧縮した.tsv.zstも可)、またはParquet(ファイルか
+    パーティション分割したフォルダ)から指定した列だけを読み込む
+    （.tsvのパスを指定して、そのファイルが無く.tsv.zstがある場合はそちらを読み込む）
+
+    filtersにpartition_filterの式を指定すると、Parquetのフォルダのうち条件に合う
+    パーティションのファイルだけを読み込む（TSVには指定できない）。
+    """
+    if is_parquet_path(path):
+        source = os.path.join(path, "**", "*.parquet") if os.path.isdir(path) else path
+        lf = pl.scan_parquet(
+            source, hive_partitioning=True, hive_schema=PARTITION_SCHEMA
+        )
+        if filters is not None:
+            # 無いパーティション(サイトごとの出力のsiteなど)で絞り込もうとした場合
+            missing = set(filters.meta.root_names()) - set(lf.collect_schema().names())
+            if missing:
+                raise ValueError(
+                    f"{path}には{', '.join(sorted(missing))}のパーティションがありません"
+                )
+            lf = lf.filter(filters)
+        return lf.select(columns).collect()
+
+    if filters is not None:
+        raise ValueError(
+            "サイト・掲示板・年月での絞り込みは、Parquetで出力したファイルにだけ使えます"
+        )
+    return read_tsv(
+        find_tsv_file(path),
+        columns=columns,
+        schema_overrides={
+            "post_anc": pl.String,
+            "post_anchor_an": pl.String,
+            "post_ancfrom": pl.String,
+        },
+    )
+
 
 def tokenize_text(text: str, vibrato_instance) -> list[str]:
     """Vibratoを使用して日本語テキストを形態素解析し、単語に分割する"""
@@ -18,15 +100,43 @@ def tokenize_text(text: str, vibrato_instance) -> list[str]:
     return words
 
 
-def count_words(texts: List[str], vibrato_instance) -> Counter:
-    """テキストのリストから単語の出現頻度を計算する"""
-    all_words = []
-    for text in texts:
-        if isinstance(text, str):
-            words = tokenize_text(text, vibrato_instance)
-            all_words.extend(words)
+def count_word_ids(
+    texts: List[str],
+    vibrato_instance,
+    prefilter: Optional[TargetWordPrefilter] = None,
+) -> np.ndarray:
+    """
+    テキストのリストから単語IDごとの出現回数を計算する（まとめて形態素解析する）
 
-    return Counter(all_words)
+    戻り値のインデックスはvibrato_instance.vocabularyの単語IDで、長さは
+    解析した時点の語彙表の単語数。prefilterを指定した場合は、対象の単語を
+    含むテキストだけを形態素解析する（対象の単語の出現回数は変わらない）。
+    """
+    str_texts = [text for text in texts if isinstance(text, str)]
+    if prefilter is not None:
+        # 絞り込みで正規化したテキストを、正規化し直さずに形態素解析する
+        word_ids = vibrato_instance.wakatigaki_ids_batch(
+            prefilter.filter_texts(str_texts), normalized=True
+        )
+    else:
+        word_ids = vibrato_instance.wakatigaki_ids_batch(str_texts)
+    return count_ids(word_ids, len(vibrato_instance.vocabulary))
+
+
+def counts_to_counter(word_counts: np.ndarray, vibrato_instance) -> Counter:
+    """単語IDごとの出現回数を、単語ごとの出現回数のCounterにする（出現した単語のみ）"""
+    words = vibrato_instance.vocabulary.words
+    return Counter(
+        {
+            words[word_id]: int(word_counts[word_id])
+            for word_id in np.flatnonzero(word_counts)
+        }
+    )
+
+
+def count_words(texts: List[str], vibrato_instance) -> Counter:
+    """テキストのリストから単語の出現頻度を計算する（まとめて形態素解析する）"""
+    return counts_to_counter(count_word_ids(texts, vibrato_instance), vibrato_instance)
 
 
 def count_words_by_month(
@@ -35,10 +145,15 @@ def count_words_by_month(
     text_column: str,
     target_words: List[str],
     vibrato_instance,
+    prefilter: Optional[TargetWordPrefilter] = None,
 ) -> Dict[str, Dict[str, int]]:
-    """月ごとに特定の単語の出現回数を計算する"""
-    # 日付列をdatetime型に変換
-    df = df.with_columns(pl.col(date_column).str.to_datetime())
+    """
+    月ごとに特定の単語の出現回数を計算する
+    （prefilterを指定した場合は、対象の単語を含むテキストだけを形態素解析する）
+    """
+    # 日付列をdatetime型に変換（Parquetから読み込んだ場合は変換済み）
+    if df.schema[date_column] == pl.String:
+        df = df.with_columns(pl.col(date_column).str.to_datetime())
 
     # 日付がNullのレコードを除外
     df = df.filter(pl.col(date_column).is_not_null())
@@ -56,13 +171,20 @@ def count_words_by_month(
             continue
 
         month_df = df.filter(pl.col("month").is_not_null() & (pl.col("month") == month))
-        texts = month_df[text_column].to_list()
-        all_text = " ".join([str(text) for text in texts if isinstance(text, str)])
-        words = tokenize_text(all_text, vibrato_instance)
+        texts = [
+            text for text in month_df[text_column].to_list() if isinstance(text, str)
+        ]
+        # 月内のテキストをまとめて形態素解析して、単語IDごとの出現回数を数える
+        word_counts = count_word_ids(texts, vibrato_instance, prefilter)
 
-        # 対象単語の出現回数を計算
+        # 対象単語の出現回数を計算（単語は形態素解析の前と同じ設定で正規化して調べる）
+        vocabulary = vibrato_instance.vocabulary
+        normalize = vibrato_instance.normalizer.normalize
         for word in target_words:
-            monthly_counts[word][month] = words.count(word)
+            word_id = vocabulary.get_id(normalize(word))
+            monthly_counts[word][month] = (
+                int(word_counts[word_id]) if word_id is not None else 0
+            )
 
     return monthly_counts
 
@@ -141,27 +263,48 @@ def calculate_word_frequencies(
     vibrato_instance,
     thread_title_col: str,
     post_content_col: str,
+    prefilter: Optional[TargetWordPrefilter] = None,
 ) -> Tuple[pl.DataFrame, Counter]:
-    """全ての書き込みとスレッドタイトルに含まれる単語の出現頻度を計算する"""
+    """
+    全ての書き込みとスレッドタイトルに含まれる単語の出現頻度を計算する
+    （prefilterを指定した場合は、その対象の単語の出現頻度だけを計算する）
+    """
     # スレッドタイトルの処理
     thread_titles = threads_df[thread_title_col].to_list()
-    thread_title_word_counts = count_words(thread_titles, vibrato_instance)
+    thread_title_word_counts = count_word_ids(
+        thread_titles, vibrato_instance, prefilter
+    )
 
-    # 書き込み内容の処理
+    # 書き込み内容の処理（語彙表は増えるだけなので、後に数えた方が長い）
     post_contents = posts_df[post_content_col].to_list()
-    post_content_word_counts = count_words(post_contents, vibrato_instance)
+    all_word_counts = count_word_ids(post_contents, vibrato_instance, prefilter)
 
     # 両方の結果を結合
-    all_word_counts = thread_title_word_counts + post_content_word_counts
-
-    # 結果をDataFrameに格納
-    word_counts_data = [
-        {"単語": word, "出現回数": count}
-        for word, count in all_word_counts.most_common()
-    ]
-    word_counts_df = pl.DataFrame(word_counts_data)
+    all_word_counts[: len(thread_title_word_counts)] += thread_title_word_counts
+
+    if prefilter is not None:
+        # 対象の単語以外の出現回数は、絞り込んだテキストの分だけなので使わない
+        # （prefilter.wordsは正規化した対象の単語）
+        vocabulary = vibrato_instance.vocabulary
+        target_ids = [vocabulary.get_id(word) for word in prefilter.words]
+        target_counts = np.zeros_like(all_word_counts)
+        for word_id in target_ids:
+            if word_id is not None:
+                target_counts[word_id] = all_word_counts[word_id]
+        all_word_counts = target_counts
+
+    # 出現回数の降順（同じ回数なら先に出てきた単語から）に並べて、DataFrameに格納
+    order = np.argsort(-all_word_counts, kind="stable")
+    order = order[all_word_counts[order] > 0]
+    words = vibrato_instance.vocabulary.words
+    word_counts_df = pl.DataFrame(
+        {
+            "単語": [words[word_id] for word_id in order],
+            "出現回数": all_word_counts[order],
+        }
+    )
 
-    return word_counts_df, all_word_counts
+    return word_counts_df, counts_to_counter(all_word_counts, vibrato_instance)
 
 
 def calculate_monthly_word_counts(
@@ -173,18 +316,29 @@ def calculate_monthly_word_counts(
     thread_date_col: str,
     post_content_col: str,
     post_date_col: str,
+    prefilter: Optional[TargetWordPrefilter] = None,
 ) -> Dict[str, pl.DataFrame]:
     """月別単語出現回数を計算する"""
     monthly_word_counts = {}
 
     # スレッドタイトルでの単語出現回数（月別）
     thread_monthly_counts = count_words_by_month(
-        threads_df, thread_date_col, thread_title_col, target_words, vibrato_instance
+        threads_df,
+        thread_date_col,
+        thread_title_col,
+        target_words,
+        vibrato_instance,
+        prefilter,
     )
 
     # 書き込み内容での単語出現回数（月別）
     post_monthly_counts = count_words_by_month(
-        posts_df, post_date_col, post_content_col, target_words, vibrato_instance
+        posts_df,
+        post_date_col,
+        post_content_col,
+        target_words,
+        vibrato_instance,
+        prefilter,
     )
 
     # 結果を辞書に格納
@@ -221,6 +375,11 @@ def analyze_text(
     target_words: Optional[List[str]] = None,
     output_dir: str = "./output",
     generate_graphs: bool = True,
+    target_only: bool = False,
+    sites: Optional[List[str]] = None,
+    boards: Optional[List[str]] = None,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     テキストを分析し、単語出現頻度と月別単語出現回数を計算する
@@ -228,17 +387,31 @@ def analyze_text(
     Parameters:
     -----------
     threads_path : str
-        スレッド情報のCSVファイルパス
+        スレッド情報のCSVファイルパス（threads.tsv.zstやthreads.parquetも指定可能）
     posts_path : str
-        書き込み情報のCSVファイルパス
-    vibrato_instance : VibratoTokenizer
+        書き込み情報のCSVファイルパス（posts.tsv.zstやParquetのpostsフォルダも指定可能）
+    vibrato_instance : VibratoTokenizer or VibratoProcessPool
         形態素解析に使用するVibratoTokenizerのインスタンス
+        （VibratoProcessPoolを渡すと複数のプロセスで解析し、TokenizedCorpusCacheを
+        渡すと保存した解析結果を使う）
     target_words : list, optional
         月別で集計する対象単語のリスト
     output_dir : str, optional
         出力ディレクトリ (デフォルト: './output')
     generate_graphs : bool, optional
         グラフを生成するかどうか (デフォルト: True)
+    target_only : bool, optional
+        Trueの場合、target_wordsの単語だけを数える。正規化したテキストにどれかの
+        単語が含まれる場合だけ形態素解析する (デフォルト: False)
+    sites : list, optional
+        分析するサイトフォルダ名のリスト（Parquetの全サイト集計の出力のみ）
+    boards : list, optional
+        分析する掲示板フォルダ名のリスト（Parquetの出力のみ）
+    month_from, month_to : str, optional
+        分析する最初と最後の年月 "YYYY-MM"（Parquetの出力のみ）。スレッドタイトルは
+        スレッドが立った年月で絞り込む
+        （sites・boards・月の指定があるとpostsフォルダの該当するパーティションだけを
+        読み込み、スレッドもその掲示板のものだけにする）
 
     Returns:
     --------
@@ -249,41 +422,64 @@ def analyze_text(
     output_dir = Path(output_dir)
     output_dir.mkdir(exist_ok=True, parents=True)
 
-    # CSVファイルの読み込み
-    threads_df = pl.read_csv(
-        threads_path,
-        separator="\t",
-        schema_overrides={
-            "post_anc": pl.String,
-            "post_anchor_an": pl.String,
-            "post_ancfrom": pl.String,
-        },
-    )
-    posts_df = pl.read_csv(
-        posts_path,
-        separator="\t",
-        schema_overrides={
-            "post_anc": pl.String,
-            "post_anchor_an": pl.String,
-            "post_ancfrom": pl.String,
-        },
-    )
-
     # 必要なカラムの定義
     thread_title_col = "title"
-    # thread_id_col = "location"
+    thread_id_col = "location"
     thread_date_col = "thread_established"
 
-    # post_thread_id_col = "thread_location"
+    post_thread_id_col = "thread_location"
     post_date_col = "post_timestamp"
     post_content_col = "post_body"
 
+    # TSVファイル(またはParquet)から必要な列だけを読み込む
+    # （絞り込む場合は、Parquetの該当するパーティションのファイルだけを読み込む）
+    threads_df = read_table(
+        threads_path, [thread_title_col, thread_date_col, thread_id_col]
+    )
+    posts_df = read_table(
+        posts_path,
+        [post_content_col, post_date_col],
+        partition_filter(sites, boards, month_from, month_to),
+    )
+
+    # スレッドは、絞り込んだ掲示板に投稿のあるものと、立った年月で絞り込む
+    board_filter = partition_filter(sites, boards)
+    if board_filter is not None:
+        thread_ids = read_table(posts_path, [post_thread_id_col], board_filter)
+        threads_df = threads_df.join(
+            thread_ids.unique(),
+            left_on=thread_id_col,
+            right_on=post_thread_id_col,
+            how="semi",
+            maintain_order="left",
+        )
+    if month_from or month_to:
+        if threads_df.schema[thread_date_col] == pl.String:
+            raise ValueError(
+                "年月での絞り込みは、Parquetで出力したファイルにだけ使えます"
+            )
+        thread_month = pl.col(thread_date_col).dt.strftime("%Y-%m")
+        if month_from:
+            threads_df = threads_df.filter(thread_month >= month_from)
+        if month_to:
+            threads_df = threads_df.filter(thread_month <= month_to)
+
     # 結果を保存する辞書を初期化
     results = {"word_frequencies": None, "monthly_word_counts": {}}
 
+    # 対象の単語だけを数える場合は、対象の単語を含むテキストだけを形態素解析する
+    prefilter = None
+    if target_only:
+        prefilter = TargetWordPrefilter(target_words or [], vibrato_instance.normalizer)
+
     # 1. 単語の出現頻度の計算
     word_counts_df, all_word_counts = calculate_word_frequencies(
-        threads_df, posts_df, vibrato_instance, thread_title_col, post_content_col
+        threads_df,
+        posts_df,
+        vibrato_instance,
+        thread_title_col,
+        post_content_col,
+        prefilter,
     )
 
     # 結果を辞書に保存（Pandasと互換性を保つためにPandasに変換）
@@ -312,6 +508,7 @@ def analyze_text(
             thread_date_col,
             post_content_col,
             post_date_col,
+            prefilter,
         )
 
         # 結果を保存してグラフ作成
@@ -331,6 +528,9 @@ def analyze_text(
                 )
                 results["monthly_word_counts"][f"{word}_graph"] = graph_file
 
+    if prefilter is not None:
+        print(prefilter.format_stats())
+
     return results
 
 
@@ -352,6 +552,23 @@ def main():
     )
     parser.add_argument("--output-dir", default="./output", help="出力ディレクトリ")
     parser.add_argument("--no-graphs", action="store_true", help="グラフを生成しない")
+    parser.add_argument(
+        "--target-only",
+        action="store_true",
+        help="対象単語だけを数える（対象単語を含むテキストだけを形態素解析する）",
+    )
+    parser.add_argument(
+        "--sites", nargs="+", help="分析するサイトフォルダ名（Parquetの出力のみ）"
+    )
+    parser.add_argument(
+        "--boards", nargs="+", help="分析する掲示板フォルダ名（Parquetの出力のみ）"
+    )
+    parser.add_argument(
+        "--month-from", help="分析する最初の年月 YYYY-MM（Parquetの出力のみ）"
+    )
+    parser.add_argument(
+        "--month-to", help="分析する最後の年月 YYYY-MM（Parquetの出力のみ）"
+    )
 
     args = parser.parse_args()
 
@@ -366,6 +583,11 @@ def main():
         target_words=args.target_words,
         output_dir=args.output_dir,
         generate_graphs=not args.no_graphs,
+        target_only=args.target_only,
+        sites=args.sites,
+        boards=args.boards,
+        month_from=args.month_from,
+        month_to=args.month_to,
     )
 
     print("処理が完了しました。")
@@ -0,0 +1,433 @@
+"""
+単語から月別出現回数と、単語が出てきたスレッド・書き込みを引ける転置インデックスの
+モジュール
+
+BBSLogAnalyzerでログを解析する時に、スレッドファイルの形態素解析の結果を
+SQLiteのファイルに保存する。後からどの単語でも、形態素解析し直さずに
+月別出現回数・多く出てきたスレッド・掲示板ごとの出現回数を調べられる。
+
+テーブル:
+- words: 単語
+- boards / threads: 掲示板フォルダとスレッドファイル
+- postings: (単語, スレッド, 年月)ごとの出現回数と、出てきた書き込みの番号
+  （スレッドタイトルは0番。日時の無いものは年月が空文字列）
+- word_months / word_boards: postingsを単語ごとにまとめたもの（closeの時に作り直す）
+
+掲示板を解析し直した場合は、その掲示板の前回の分を消してから追加するので、
+同じ掲示板を2回数えることは無い。subject.jsonに同じスレッドが複数回記載されている
+場合は、BBSLogAnalyzerの出現回数と同じように記載された回数だけ数える。
+"""
+
+import os
+import sqlite3
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..siki_log.siki_json import SikiPost, SikiThread
+from ..siki_log.siki_time import YEARMONTH_FORMAT, format_timestamps
+from ..text_wakatigaki.vocabulary import TOKEN_ID_DTYPE, Vocabulary
+
+INVERTED_INDEX_VERSION = 1
+# この数のスレッドを追加するたびにコミットする
+INDEX_COMMIT_THREADS = 1000
+# 書き込みの番号の配列の型（BLOBに保存する）
+POST_NUM_TYPECODE = "I"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS words (id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS boards (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    site TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY,
+    board_id INTEGER NOT NULL,
+    threadkey TEXT NOT NULL,
+    title TEXT,
+    established INTEGER,
+    UNIQUE (board_id, threadkey)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    word_id INTEGER NOT NULL,
+    thread_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    post_nums BLOB NOT NULL,
+    PRIMARY KEY (word_id, thread_id, month)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_thread ON postings (thread_id);
+CREATE TABLE IF NOT EXISTS word_months (
+    word_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (word_id, month)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS word_boards (
+    word_id INTEGER NOT NULL,
+    board_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (word_id, board_id)
+) WITHOUT ROWID;
+"""
+_TABLES = (
+    "meta",
+    "words",
+    "boards",
+    "threads",
+    "postings",
+    "word_months",
+    "word_boards",
+)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+
+class InvertedIndexWriter:
+    """
+    スレッドファイルの形態素解析の結果を、転置インデックスのファイルに追加するクラス
+
+    使い終わったらcloseする（まとめのテーブルはcloseの時に作り直す）。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        timezone: str,
+        settings_fingerprint: str = "",
+        reset: bool = True,
+    ):
+        """
+        保存先のファイルのパス、年月を決めるタイムゾーン、解析の設定のハッシュ値を
+        指定して初期化
+
+        resetがTrueの場合や、設定が前回と違う場合は前回の内容を消す（途中経過から
+        再開する場合はFalseにして、解析の終わった掲示板の分を残す）。
+        """
+        self.path = path
+        self.timezone = timezone
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = _connect(path)
+        self._connection.executescript(_SCHEMA)
+        settings = {
+            "version": str(INVERTED_INDEX_VERSION),
+            "timezone": timezone,
+            "settings": settings_fingerprint,
+        }
+        saved = dict(self._connection.execute("SELECT key, value FROM meta"))
+        if saved and saved != settings:
+            print("転置インデックスの設定が違うため、作り直します")
+            reset = True
+        if reset:
+            for table in _TABLES:
+                self._connection.execute(f"DELETE FROM {table}")
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", settings.items()
+        )
+        self._connection.commit()
+
+        # 解析の語彙表の単語ID -> インデックスの単語IDの対応（語彙表が増えたら追加する）
+        self._word_ids = np.zeros(0, dtype=np.int64)
+        self._vocabulary: Optional[Vocabulary] = None
+        # 今回追加し始めた掲示板 {掲示板フォルダのパス: boardsのid}
+        self._boards: Dict[str, int] = {}
+        self._uncommitted_threads = 0
+        self.threads = 0
+
+    def _map_word_ids(self, vocabulary: Vocabulary) -> np.ndarray:
+        """語彙表の単語IDからインデックスの単語IDへの対応の配列を返す"""
+        if vocabulary is not self._vocabulary:
+            self._vocabulary = vocabulary
+            self._word_ids = np.zeros(0, dtype=np.int64)
+        # pipelineで解析中は語彙表が増え続けるので、今の単語の分だけを使う
+        new_words = vocabulary.words[len(self._word_ids) :]
+        if new_words:
+            connection = self._connection
+            ids = []
+            for word in new_words:
+                row = connection.execute(
+                    "SELECT id FROM words WHERE word = ?", (word,)
+                ).fetchone()
+                if row is None:
+                    row = (
+                        connection.execute(
+                            "INSERT INTO words (word) VALUES (?)", (word,)
+                        ).lastrowid,
+                    )
+                ids.append(row[0])
+            self._word_ids = np.concatenate(
+                [self._word_ids, np.array(ids, dtype=np.int64)]
+            )
+        return self._word_ids
+
+    def _board_id(self, board_path: str) -> int:
+        """掲示板のidを返す（今回初めて追加する掲示板は、前回の分を消しておく）"""
+        board_id = self._boards.get(board_path)
+        if board_id is not None:
+            return board_id
+        connection = self._connection
+        row = connection.execute(
+            "SELECT id FROM boards WHERE path = ?", (board_path,)
+        ).fetchone()
+        if row is None:
+            board_id = connection.execute(
+                "INSERT INTO boards (path, site, name) VALUES (?, ?, ?)",
+                (
+                    board_path,
+                    os.path.basename(os.path.dirname(board_path)),
+                    os.path.basename(board_path),
+                ),
+            ).lastrowid
+        else:
+            board_id = row[0]
+            connection.execute(
+                "DELETE FROM postings WHERE thread_id IN "
+                "(SELECT id FROM threads WHERE board_id = ?)",
+                (board_id,),
+            )
+            connection.execute("DELETE FROM threads WHERE board_id = ?", (board_id,))
+        self._boards[board_path] = board_id
+        return board_id
+
+    def add_thread(
+        self,
+        thread_file: str,
+        thread_data: SikiThread,
+        title_ids: Optional[array],
+        posts: List[SikiPost],
+        all_post_ids: List[array],
+        vocabulary: Vocabulary,
+    ) -> None:
+        """
+        スレッドファイル1つ分の形態素解析の結果(BBSLogAnalyzer.tokenize_threadの結果)を
+        追加する（単語IDはvocabularyのもの）
+
+        今回既に追加したスレッドをもう一度追加した場合(subject.jsonに同じスレッドが
+        複数回記載されている場合)は、そのスレッドの出現回数に足す。
+        """
+        connection = self._connection
+        board_id = self._board_id(os.path.dirname(thread_file))
+        threadkey = os.path.splitext(os.path.basename(thread_file))[0]
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO threads (board_id, threadkey, title, established) "
+            "VALUES (?, ?, ?, ?)",
+            (board_id, threadkey, thread_data.title, thread_data.established),
+        )
+        if cursor.rowcount:
+            thread_id = cursor.lastrowid
+        else:
+            thread_id = connection.execute(
+                "SELECT id FROM threads WHERE board_id = ? AND threadkey = ?",
+                (board_id, threadkey),
+            ).fetchone()[0]
+
+        # テキストごとの(書き込みの番号, タイムスタンプ, 単語IDの配列)
+        texts: List[Tuple[int, Optional[int], Sequence[int]]] = []
+        if title_ids is not None:
+            texts.append((0, thread_data.established, title_ids))
+        texts.extend(
+            (post.num or 0, post.timestamp, post_ids)
+            for post, post_ids in zip(posts, all_post_ids)
+        )
+        texts = [text for text in texts if len(text[2])]
+        if texts:
+            self._add_postings(thread_id, texts, vocabulary)
+
+        self.threads += 1
+        self._uncommitted_threads += 1
+        if self._uncommitted_threads >= INDEX_COMMIT_THREADS:
+            self.commit()
+
+    def _add_postings(
+        self,
+        thread_id: int,
+        texts: List[Tuple[int, Optional[int], Sequence[int]]],
+        vocabulary: Vocabulary,
+    ) -> None:
+        """スレッドのテキストの単語を、(単語, 年月)ごとにまとめてpostingsに追加する"""
+        dated = [timestamp for _, timestamp, _ in texts if timestamp]
+        year_months = iter(
+            format_timestamps(dated, YEARMONTH_FORMAT, self.timezone) if dated else []
+        )
+        month_labels: List[str] = []
+        text_months = []
+        for _, timestamp, _ in texts:
+            label = next(year_months) if timestamp else ""
+            if label not in month_labels:
+                month_labels.append(label)
+            text_months.append(month_labels.index(label))
+
+        # 単語ごと(単語, 年月, 書き込み)に並べて、(単語, 年月)ごとにまとめる
+        lengths = [len(ids) for _, _, ids in texts]
+        word_map = self._map_word_ids(vocabulary)
+        words = word_map[
+            np.concatenate(
+                [np.asarray(ids, dtype=TOKEN_ID_DTYPE) for _, _, ids in texts]
+            ).astype(np.int64)
+        ]
+        months = np.repeat(np.array(text_months, dtype=np.int64), lengths)
+        post_nums = np.repeat(np.array([num for num, _, _ in texts]), lengths)
+        order = np.lexsort((post_nums, months, words))
+        words, months, post_nums = words[order], months[order], post_nums[order]
+
+        group_start = np.flatnonzero(
+            np.concatenate(
+                [[True], (words[1:] != words[:-1]) | (months[1:] != months[:-1])]
+            )
+        )
+        group_end = np.append(group_start[1:], len(words))
+        new_post = np.concatenate([[True], post_nums[1:] != post_nums[:-1]])
+        new_post[group_start] = True
+        rows = []
+        for start, end in zip(group_start.tolist(), group_end.tolist()):
+            nums = post_nums[start:end][new_post[start:end]]
+            rows.append(
+                (
+                    int(words[start]),
+                    thread_id,
+                    month_labels[months[start]],
+                    end - start,
+                    array(POST_NUM_TYPECODE, nums.tolist()).tobytes(),
+                )
+            )
+        self._connection.executemany(
+            "INSERT INTO postings (word_id, thread_id, month, count, post_nums) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (word_id, thread_id, month) "
+            "DO UPDATE SET count = count + excluded.count",
+            rows,
+        )
+
+    def commit(self) -> None:
+        """追加した分をファイルに書き込む"""
+        self._connection.commit()
+        self._uncommitted_threads = 0
+
+    def close(self, rebuild: bool = True) -> None:
+        """
+        追加した分を書き込み、rebuildがTrueならまとめのテーブル(word_months・
+        word_boards)を作り直して閉じる
+        """
+        connection = self._connection
+        if rebuild:
+            connection.execute("DELETE FROM word_months")
+            connection.execute(
+                "INSERT INTO word_months (word_id, month, count) "
+                "SELECT word_id, month, SUM(count) FROM postings "
+                "WHERE month != '' GROUP BY word_id, month"
+            )
+            connection.execute("DELETE FROM word_boards")
+            connection.execute(
+                "INSERT INTO word_boards (word_id, board_id, count) "
+                "SELECT postings.word_id, threads.board_id, SUM(postings.count) "
+                "FROM postings JOIN threads ON threads.id = postings.thread_id "
+                "GROUP BY postings.word_id, threads.board_id"
+            )
+        connection.commit()
+        connection.close()
+
+
+class InvertedIndex:
+    """
+    転置インデックスのファイルから、単語の月別出現回数などを調べるクラス
+    （使い終わったらcloseする。with文でも使える）
+    """
+
+    def __init__(self, path: str):
+        """転置インデックスのファイルのパスを指定して開く（読み込み専用）"""
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"転置インデックスがありません: {path}")
+        self.path = path
+        self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def _word_id(self, word: str) -> Optional[int]:
+        row = self._connection.execute(
+            "SELECT id FROM words WHERE word = ?", (word,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def monthly_counts(self, word: str) -> List[Tuple[str, int]]:
+        """単語の月別出現回数を、年月の順に(年月, 出現回数)のリストで返す"""
+        word_id = self._word_id(word)
+        if word_id is None:
+            return []
+        return self._connection.execute(
+            "SELECT month, count FROM word_months WHERE word_id = ? ORDER BY month",
+            (word_id,),
+        ).fetchall()
+
+    def total_count(self, word: str) -> int:
+        """スレッドファイル全体での単語の出現回数を返す"""
+        return sum(count for _, _, count in self.board_counts(word))
+
+    def board_counts(self, word: str) -> List[Tuple[str, str, int]]:
+        """掲示板ごとの単語の出現回数を、多い順に(サイト, 掲示板, 出現回数)のリストで返す"""
+        word_id = self._word_id(word)
+        if word_id is None:
+            return []
+        return self._connection.execute(
+            "SELECT boards.site, boards.name, word_boards.count FROM word_boards "
+            "JOIN boards ON boards.id = word_boards.board_id "
+            "WHERE word_boards.word_id = ? ORDER BY word_boards.count DESC, boards.path",
+            (word_id,),
+        ).fetchall()
+
+    def top_threads(
+        self, word: str, limit: Optional[int] = 10
+    ) -> List[Tuple[str, str, str, str, int]]:
+        """
+        単語が多く出てきたスレッドを、多い順に(サイト, 掲示板, threadkey, スレッドタイトル,
+        出現回数)のリストで返す（limitがNoneなら全スレッド）
+        """
+        word_id = self._word_id(word)
+        if word_id is None:
+            return []
+        return self._connection.execute(
+            "SELECT boards.site, boards.name, threads.threadkey, threads.title, "
+            "SUM(postings.count) AS total FROM postings "
+            "JOIN threads ON threads.id = postings.thread_id "
+            "JOIN boards ON boards.id = threads.board_id "
+            "WHERE postings.word_id = ? GROUP BY postings.thread_id "
+            "ORDER BY total DESC, boards.path, threads.threadkey LIMIT ?",
+            (word_id, -1 if limit is None else limit),
+        ).fetchall()
+
+    def postings(self, word: str) -> List[Tuple[str, str, str, List[int]]]:
+        """
+        単語が出てきた書き込みを、(掲示板フォルダのパス, threadkey, 年月,
+        書き込みの番号のリスト)のリストで返す（書き込みの番号の0はスレッドタイトル）
+        """
+        word_id = self._word_id(word)
+        if word_id is None:
+            return []
+        results = []
+        for board_path, threadkey, month, blob in self._connection.execute(
+            "SELECT boards.path, threads.threadkey, postings.month, postings.post_nums "
+            "FROM postings JOIN threads ON threads.id = postings.thread_id "
+            "JOIN boards ON boards.id = threads.board_id "
+            "WHERE postings.word_id = ? ORDER BY boards.path, threads.threadkey, "
+            "postings.month",
+            (word_id,),
+        ):
+            nums = array(POST_NUM_TYPECODE)
+            nums.frombytes(blob)
+            results.append((board_path, threadkey, month, nums.tolist()))
+        return results
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> "InvertedIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
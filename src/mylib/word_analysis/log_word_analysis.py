@@ -1,21 +1,83 @@
 import argparse
-import json
 import os
+from array import array
 from collections import Counter
-from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import japanize_matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import polars as pl
 from tqdm import tqdm
 
+from ..siki_log.log_scan import BoardIndex, scan_log_folder
+from ..siki_log.siki_json import (
+    SikiPost,
+    SikiSubject,
+    SikiSubjectItem,
+    SikiThread,
+    load_subject,
+    load_thread,
+)
+from ..siki_log.siki_time import (
+    DEFAULT_TIMEZONE,
+    YEARMONTH_FORMAT,
+    check_timezone,
+    format_timestamps,
+)
+from ..text_wakatigaki.ngram import NgramCounter
+from ..text_wakatigaki.target_prefilter import TargetWordPrefilter
+from ..text_wakatigaki.token_corpus_cache import TokenizedCorpusCache
 from ..text_wakatigaki.use_vibrato import VibratoTokenizer
+from ..text_wakatigaki.vibrato_pool import VibratoProcessPool
+from ..text_wakatigaki.vocabulary import (
+    TOKEN_ID_DTYPE,
+    TOKEN_ID_TYPECODE,
+    count_ids,
+    ids_to_numpy,
+)
+from .analysis_checkpoint import DEFAULT_CHECKPOINT_INTERVAL, AnalysisCheckpoint
+from .analysis_mapreduce import (
+    BoardPartial,
+    analysis_settings_fingerprint,
+    run_analysis_mapreduce,
+)
+from .analysis_pipeline import (
+    PIPELINE_QUEUE_SIZE,
+    StageStats,
+    format_pipeline_stats,
+    run_analysis_pipeline,
+)
+from .inverted_index import InvertedIndexWriter
+from .monthly_word_counts import MonthlyWordCounts
 
 japanize_matplotlib.japanize()
 
 
+# 単語の出現回数をまとめて数える(月別カウントの年月をまとめて変換する)テキスト数の目安
+COUNT_BATCH_TEXTS = 10000
+
+
 class BBSLogAnalyzer:
-    def __init__(self, log_dir: str, vibrato_tokenizer_instance: VibratoTokenizer):
+    def __init__(
+        self,
+        log_dir: str,
+        vibrato_tokenizer_instance: Union[
+            VibratoTokenizer, VibratoProcessPool, TokenizedCorpusCache
+        ],
+        timezone: str = DEFAULT_TIMEZONE,
+        scan_cache_path: Optional[str] = None,
+        ngram_sizes: Iterable[int] = (),
+        pipeline: bool = False,
+        pipeline_queue_size: int = PIPELINE_QUEUE_SIZE,
+        processes: int = 1,
+        partial_dir: Optional[str] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL,
+        resume: bool = False,
+        target_words: Optional[Iterable[str]] = None,
+        index_path: Optional[str] = None,
+    ):
         """
         電子掲示板ログ解析クラス
 
@@ -23,97 +85,352 @@ class BBSLogAnalyzer:
         -----------
         log_dir : str
             ログディレクトリのパス
+        vibrato_tokenizer_instance : VibratoTokenizer or VibratoProcessPool or TokenizedCorpusCache
+            形態素解析に使うトークナイザ（VibratoProcessPoolなら複数のプロセスで解析し、
+            TokenizedCorpusCacheなら保存した解析結果を使う）
+        timezone : str
+            月別カウントの年月を決めるタイムゾーン（例: "Asia/Tokyo"）
+        scan_cache_path : str or None
+            ログフォルダの一覧を保存するファイルのパス（Noneの場合は保存しない）
+        ngram_sizes : list of int
+            出現回数を数えるN-gramのNのリスト（例: [2, 3]。空の場合は数えない）
+        pipeline : bool
+            Trueの場合、analyze_all_logsで読み込み・JSONの解析・形態素解析・集計を
+            段階ごとのスレッドで並行して行う（結果は逐次処理と同じ）
+        pipeline_queue_size : int
+            pipelineがTrueの場合に、段階の間に溜められる掲示板・スレッドファイルの数
+        processes : int
+            2以上の場合、analyze_all_logsで掲示板ごとにこの数のプロセスで解析して
+            結果をまとめる（結果は逐次処理と同じ。pipelineより優先する）
+        partial_dir : str or None
+            processesが2以上の場合に、掲示板ごとの解析結果を保存するフォルダのパス
+            （次回は変わっていない掲示板の結果を使う。Noneの場合は保存しない）
+        checkpoint_path : str or None
+            analyze_all_logsの途中経過を保存するファイル(npz)のパス
+            （Noneの場合は保存しない。最後まで解析が終わったら消す）
+        checkpoint_interval : float
+            途中経過を保存する間隔(秒)。掲示板の解析が終わった時に確認する
+        resume : bool
+            Trueの場合、checkpoint_pathに保存した途中経過から解析を再開する
+        target_words : list of str or None
+            指定した場合、これらの単語だけを数える（正規化したテキストにどれかの
+            単語が含まれる場合だけ形態素解析する。ngram_sizesとは同時に指定できない）
+        index_path : str or None
+            analyze_all_logsで、単語から月別出現回数と出てきたスレッド・書き込みを
+            引ける転置インデックス(SQLite)を作るファイルのパス（Noneの場合は作らない。
+            processesが2以上の場合とは同時に指定できない）
         """
         self.log_dir = log_dir
+        self.timezone = check_timezone(timezone)
+        self.scan_cache_path = scan_cache_path
 
         # Vibratoのトークナイザを初期化
-        self.vibrato_tokenizer: VibratoTokenizer = vibrato_tokenizer_instance
-
-        self.words_counter = Counter()
-        self.monthly_word_counts = {}
+        self.vibrato_tokenizer = vibrato_tokenizer_instance
+
+        # 単語IDの語彙表（トークナイザと共有する）
+        self.vocabulary = self.vibrato_tokenizer.vocabulary
+        # 単語IDごとの出現回数（語彙表が増えた時に作り直さないように、大きめに確保する）
+        self._word_counts = np.zeros(0, dtype=np.int64)
+        # 月別カウント（単語ID × 年月の疎行列）
+        self.monthly_word_counts = MonthlyWordCounts()
+        # まだ数えていない単語 [(UNIXタイムスタンプ(無い場合はNone), 単語IDの配列), ...]
+        self._pending_words: List[Tuple[Optional[int], array]] = []
+        # N-gramの出現回数（形態素解析の結果の単語IDの配列から数える）
+        ngram_sizes = list(ngram_sizes)
+        if target_words is not None and ngram_sizes:
+            raise ValueError("target_wordsとngram_sizesは同時に指定できません")
+        if index_path and processes > 1:
+            raise ValueError("index_pathとprocessesの2以上は同時に指定できません")
+        self.ngram_counter: Optional[NgramCounter] = (
+            NgramCounter(ngram_sizes, self.vocabulary) if ngram_sizes else None
+        )
+        # subject.jsonに記載されていないスレッドファイル {掲示板フォルダのパス: [...]}
+        self.orphan_thread_files: Dict[str, List[str]] = {}
+        self.pipeline = pipeline
+        self.pipeline_queue_size = pipeline_queue_size
+        # pipelineで解析した場合の段階ごとの処理件数と時間
+        self.pipeline_stats: List[StageStats] = []
+        self.processes = processes
+        self.partial_dir = partial_dir
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.resume = resume
+        # 対象の単語だけを数える場合の、形態素解析するテキストの絞り込み
+        self.target_words = tuple(target_words) if target_words is not None else None
+        self.target_prefilter: Optional[TargetWordPrefilter] = (
+            TargetWordPrefilter(self.target_words, self.vibrato_tokenizer.normalizer)
+            if self.target_words is not None
+            else None
+        )
+        self.index_path = index_path
+        # analyze_all_logsの間だけ、スレッドファイルの解析結果を転置インデックスに追加する
+        self.index_writer: Optional[InvertedIndexWriter] = None
 
     def timestamp_to_yearmonth(self, timestamp):
         """UNIXタイムスタンプを'YYYY-MM'形式に変換"""
-        dt = datetime.fromtimestamp(timestamp / 1000)  # ミリ秒を秒に変換
-        return dt.strftime("%Y-%m")
+        return format_timestamps([timestamp], YEARMONTH_FORMAT, self.timezone)[0]
+
+    def add_words(self, word_ids: array, timestamp: Optional[int] = None):
+        """
+        単語IDの配列を単語の出現回数に追加する（timestampがあれば月別カウントにも追加）
+
+        出現回数はCOUNT_BATCH_TEXTS件程度まとめて数える。
+        """
+        self._pending_words.append((timestamp, word_ids))
+        if self.ngram_counter is not None:
+            self.ngram_counter.update(word_ids)
+        if len(self._pending_words) >= COUNT_BATCH_TEXTS:
+            self.flush_word_counts()
+
+    def flush_word_counts(self):
+        """
+        まだ数えていない単語の出現回数をまとめて数え、タイムスタンプをまとめて
+        年月に変換して月別カウントに反映する
+        """
+        pending = self._pending_words
+        self._pending_words = []
+        if not pending:
+            return
+
+        # 全体の出現回数
+        vocabulary_size = len(self.vocabulary)
+        self._reserve_word_counts(vocabulary_size)
+        self._word_counts[:vocabulary_size] += count_ids(
+            [word_ids for _, word_ids in pending], vocabulary_size
+        )
+
+        # 月別の出現回数
+        dated = [(timestamp, word_ids) for timestamp, word_ids in pending if timestamp]
+        year_months = format_timestamps(
+            (timestamp for timestamp, _ in dated), YEARMONTH_FORMAT, self.timezone
+        )
+        if dated:
+            # テキストごとの年月の番号を、そのテキストの単語の数だけ並べる
+            lengths = [len(word_ids) for _, word_ids in dated]
+            self.monthly_word_counts.add(
+                ids_to_numpy([word_ids for _, word_ids in dated]),
+                np.repeat(self.monthly_word_counts.month_indices(year_months), lengths),
+            )
+
+    def _reserve_word_counts(self, vocabulary_size: int):
+        """単語IDごとの出現回数の配列を、語彙表の単語数以上の長さにする"""
+        if len(self._word_counts) < vocabulary_size:
+            word_counts = np.zeros(
+                max(vocabulary_size, 2 * len(self._word_counts)), dtype=np.int64
+            )
+            word_counts[: len(self._word_counts)] = self._word_counts
+            self._word_counts = word_counts
+
+    def to_partial(self, board_path: str, board_fingerprint: str) -> BoardPartial:
+        """ここまでの解析結果を、別の解析結果に足せるBoardPartialにする"""
+        self.flush_word_counts()
+        # pipelineで解析中は語彙表が増え続けるので、今の単語の分だけを使う
+        words = list(self.vocabulary.words)
+        self._reserve_word_counts(len(words))
+        word_ids, columns, counts = self.monthly_word_counts.to_coo()
+        ngram_counts = {}
+        if self.ngram_counter is not None:
+            ngram_counts = {
+                num: self.ngram_counter.counts(num) for num in self.ngram_counter.nums
+            }
+        return BoardPartial(
+            board_path=board_path,
+            board_fingerprint=board_fingerprint,
+            words=words,
+            word_counts=self._word_counts[: len(words)].copy(),
+            months=self.monthly_word_counts.months,
+            monthly_word_ids=word_ids,
+            monthly_columns=columns,
+            monthly_counts=counts,
+            ngram_counts=ngram_counts,
+            orphan_thread_files=self.orphan_thread_files.get(board_path, []),
+        )
+
+    def merge_partial(self, partial: BoardPartial):
+        """
+        BoardPartialの出現回数を足す（単語はこの語彙表の単語IDに置き換える。
+        語彙表に無い単語はBoardPartialの単語IDの順に追加する）
+        """
+        self.flush_word_counts()
+        word_id_map = np.frombuffer(
+            self.vocabulary.encode(partial.words), dtype=TOKEN_ID_DTYPE
+        ).astype(np.int64)
+        self._reserve_word_counts(len(self.vocabulary))
+        self._word_counts[word_id_map] += partial.word_counts
+        if len(partial.monthly_counts):
+            month_indices = self.monthly_word_counts.month_indices(partial.months)
+            self.monthly_word_counts.add_counts(
+                word_id_map[partial.monthly_word_ids],
+                month_indices[partial.monthly_columns],
+                partial.monthly_counts,
+            )
+        if self.ngram_counter is not None:
+            for num, (ngrams, counts) in partial.ngram_counts.items():
+                self.ngram_counter.add_counts(num, word_id_map[ngrams], counts)
+        if partial.orphan_thread_files:
+            self.orphan_thread_files[partial.board_path] = partial.orphan_thread_files
+
+    @property
+    def word_counts(self) -> np.ndarray:
+        """単語IDごとの出現回数の配列（インデックスが単語ID）"""
+        self.flush_word_counts()
+        return self._word_counts[: len(self.vocabulary)]
+
+    @property
+    def words_counter(self) -> Counter:
+        """単語ごとの出現回数のCounter（出現した単語のみ）"""
+        counts = self.word_counts
+        words = self.vocabulary.words
+        return Counter(
+            {words[word_id]: int(counts[word_id]) for word_id in np.flatnonzero(counts)}
+        )
+
+    def analyze_board_folder(
+        self, board_site_path, board_folder, board: Optional[BoardIndex] = None
+    ):
+        """
+        個別の掲示板フォルダを解析
 
-    def analyze_board_folder(self, board_site_path, board_folder):
-        """個別の掲示板フォルダを解析"""
+        boardに走査済みの掲示板フォルダの一覧を渡すと、その一覧でスレッドファイルの
+        存在を確認し、subject.jsonに記載されていないスレッドファイルも記録する。
+        """
         board_path = os.path.join(board_site_path, board_folder)
         subject_path = os.path.join(board_path, "subject.json")
+        thread_files = board.thread_files if board is not None else None
 
-        if not os.path.exists(subject_path):
+        if board is None and not os.path.exists(subject_path):
             print(f"Warning: subject.json not found in {board_path}")
             return
 
         try:
-            with open(subject_path, "r", encoding="utf-8") as f:
-                subject_data = json.load(f)
+            subject_data = load_subject(subject_path)
 
-            # 掲示板タイトルの解析
-            if "title" in subject_data and subject_data["title"]:
-                board_title = subject_data["title"]
-                words: list[str] = self.vibrato_tokenizer.wakatigaki(board_title)
-                self.words_counter.update(words)
+            if board is not None:
+                orphans = board.orphan_thread_files(subject_data)
+                if orphans:
+                    self.orphan_thread_files[board_path] = orphans
+
+            # 掲示板タイトルとスレッドタイトルの解析
+            board_title_ids, thread_items, all_title_ids = self.tokenize_subject(
+                subject_data
+            )
+            if board_title_ids is not None:
+                self.add_words(board_title_ids)
 
             # 各スレッドの解析
-            if "items" in subject_data and isinstance(subject_data["items"], list):
-                for thread_info in subject_data["items"]:
-                    thread_key = thread_info.get("threadkey")
-                    if not thread_key:
-                        continue
-
-                    # スレッドタイトルの解析
-                    thread_title = thread_info.get("title", "")
-                    title_words: list[str] = self.vibrato_tokenizer.wakatigaki(
-                        thread_title
-                    )
-                    self.words_counter.update(title_words)
-
-                    # スレッドファイルの解析
-                    thread_file = os.path.join(board_path, f"{thread_key}.json")
-                    if os.path.exists(thread_file):
-                        self.analyze_thread_file(thread_file)
+            for thread_info, title_ids in zip(thread_items, all_title_ids):
+                thread_key = thread_info.threadkey
+
+                # スレッドタイトルの解析
+                self.add_words(title_ids)
+
+                # スレッドファイルの解析
+                file_name = f"{thread_key}.json"
+                if thread_files is None:
+                    exists = os.path.exists(os.path.join(board_path, file_name))
+                else:
+                    exists = file_name in thread_files
+                if exists:
+                    self.analyze_thread_file(os.path.join(board_path, file_name))
 
         except Exception as e:
             print(f"Error analyzing board {board_folder}: {str(e)}")
 
+    def tokenize_texts(self, texts: List[str]) -> List[array]:
+        """
+        テキストをまとめて形態素解析して、テキストごとの単語IDの配列を返す
+
+        target_wordsを指定した場合は、対象の単語を含むテキストだけを形態素解析し、
+        対象の単語の単語IDだけを残す（他のテキストは空の配列）。
+        """
+        prefilter = self.target_prefilter
+        if prefilter is None:
+            return self.vibrato_tokenizer.wakatigaki_ids_batch(texts)
+
+        # 絞り込みで正規化したテキストを、正規化し直さずに形態素解析する
+        positions, normalized_texts = prefilter.select(texts)
+        results = [array(TOKEN_ID_TYPECODE) for _ in texts]
+        if not positions:
+            return results
+        all_ids = self.vibrato_tokenizer.wakatigaki_ids_batch(
+            normalized_texts, normalized=True
+        )
+        # 形態素解析した後の語彙表で、対象の単語(正規化したもの)の単語IDを調べる
+        target_ids = {self.vocabulary.get_id(word) for word in prefilter.words}
+        target_ids.discard(None)
+        for i, ids in zip(positions, all_ids):
+            results[i] = array(
+                TOKEN_ID_TYPECODE, [word_id for word_id in ids if word_id in target_ids]
+            )
+        return results
+
+    def tokenize_subject(
+        self, subject_data: SikiSubject
+    ) -> Tuple[Optional[array], List[SikiSubjectItem], List[array]]:
+        """
+        掲示板タイトルと、各スレッド(threadkeyのあるもの)のタイトルを形態素解析して
+        (掲示板タイトルの単語ID(タイトルが無ければNone), スレッドのリスト,
+        スレッドタイトルの単語IDのリスト)を返す（スレッドタイトルはまとめて解析する）
+        """
+        board_title_ids = None
+        if subject_data.title:
+            board_title_ids = self.tokenize_texts([subject_data.title])[0]
+        thread_items = [item for item in subject_data.items if item.threadkey]
+        all_title_ids = self.tokenize_texts([item.title for item in thread_items])
+        return board_title_ids, thread_items, all_title_ids
+
+    def tokenize_thread(
+        self, thread_data: SikiThread
+    ) -> Tuple[Optional[array], List[SikiPost], List[array]]:
+        """
+        スレッドのタイトルと書き込みの本文を形態素解析して(タイトルの単語ID
+        (タイトルが無ければNone), 本文のある書き込みのリスト, 本文の単語IDのリスト)を
+        返す（スレッド内の本文はまとめて解析する）
+        """
+        title_ids = None
+        if thread_data.title:
+            title_ids = self.tokenize_texts([thread_data.title])[0]
+        posts = [post for post in thread_data.thread_array if post.body]
+        all_post_ids = self.tokenize_texts([post.body for post in posts])
+        return title_ids, posts, all_post_ids
+
+    def add_thread_words(
+        self,
+        thread_data: SikiThread,
+        title_ids: Optional[array],
+        posts: List[SikiPost],
+        all_post_ids: List[array],
+        thread_file: Optional[str] = None,
+    ):
+        """
+        tokenize_threadの結果を単語の出現回数と月別カウントに追加する
+        （転置インデックスを作っている場合は、thread_fileのスレッドとして追加する）
+        """
+        # スレッドタイトル（スレッドの作成日時があれば月別カウントにも追加）
+        if title_ids is not None:
+            self.add_words(title_ids, thread_data.established)
+
+        # 書き込み本文の単語カウント（投稿日時があれば月別カウントにも追加）
+        for post, post_ids in zip(posts, all_post_ids):
+            self.add_words(post_ids, post.timestamp)
+
+        if self.index_writer is not None and thread_file is not None:
+            self.index_writer.add_thread(
+                thread_file,
+                thread_data,
+                title_ids,
+                posts,
+                all_post_ids,
+                self.vocabulary,
+            )
+
     def analyze_thread_file(self, thread_file):
         """個別のスレッドファイルを解析"""
         try:
-            with open(thread_file, "r", encoding="utf-8") as f:
-                thread_data = json.load(f)
-
-            # スレッドタイトルの解析
-            if "title" in thread_data and thread_data["title"]:
-                title_words = self.vibrato_tokenizer.wakatigaki(thread_data["title"])
-                self.words_counter.update(title_words)
-
-                # 月別カウントにも追加
-                if "established" in thread_data and thread_data["established"]:
-                    year_month = self.timestamp_to_yearmonth(thread_data["established"])
-                    for word in title_words:
-                        if word not in self.monthly_word_counts:
-                            self.monthly_word_counts[word] = Counter()
-                        self.monthly_word_counts[word][year_month] += 1
-
-            # 各書き込みの解析
-            if "thread_array" in thread_data and isinstance(
-                thread_data["thread_array"], list
-            ):
-                for post in thread_data["thread_array"]:
-                    if "body" in post and post["body"]:
-                        # 書き込み本文の単語カウント
-                        post_words = self.vibrato_tokenizer.wakatigaki(post["body"])
-                        self.words_counter.update(post_words)
-
-                        # 月別カウントにも追加
-                        if "timestamp" in post and post["timestamp"]:
-                            year_month = self.timestamp_to_yearmonth(post["timestamp"])
-                            for word in post_words:
-                                if word not in self.monthly_word_counts:
-                                    self.monthly_word_counts[word] = Counter()
-                                self.monthly_word_counts[word][year_month] += 1
+            thread_data = load_thread(thread_file)
+            self.add_thread_words(
+                thread_data, *self.tokenize_thread(thread_data), thread_file
+            )
 
         except Exception as e:
             print(f"Error analyzing thread file {thread_file}: {str(e)}")
@@ -122,22 +439,97 @@ class BBSLogAnalyzer:
         """すべてのログを解析"""
         print("ログ解析を開始します...")
 
-        # logディレクトリ内の各掲示板サイトフォルダを処理
-        for board_site in os.listdir(self.log_dir):
-            board_site_path = os.path.join(self.log_dir, board_site)
-            if not os.path.isdir(board_site_path):
-                continue
+        # logディレクトリを走査して、掲示板サイト・掲示板・スレッドファイルを列挙
+        log_index = scan_log_folder(self.log_dir, self.scan_cache_path)
 
-            # 掲示板サイト内の各掲示板フォルダを処理
-            for board_folder in tqdm(
-                os.listdir(board_site_path), desc=f"解析中: {board_site}"
-            ):
-                board_folder_path = os.path.join(board_site_path, board_folder)
-                if os.path.isdir(board_folder_path):
-                    self.analyze_board_folder(board_site_path, board_folder)
+        # 途中経過を保存する場合は、保存した途中経過から再開できる
+        checkpoint = None
+        on_board_done = None
+        resumed = False
+        if self.checkpoint_path:
+            checkpoint = AnalysisCheckpoint(
+                self, self.checkpoint_path, self.checkpoint_interval
+            )
+            resumed = self.resume and checkpoint.load(log_index)
+            if resumed:
+                print(
+                    "チェックポイントから再開します"
+                    f" (解析済みの掲示板: {len(checkpoint.completed)}件)"
+                )
+            log_index = checkpoint.remaining(log_index)
+            on_board_done = checkpoint.board_done
+
+        if self.index_path:
+            # 再開した場合は、解析の終わった掲示板の分を残して追加する
+            self.index_writer = InvertedIndexWriter(
+                self.index_path,
+                self.timezone,
+                analysis_settings_fingerprint(self),
+                reset=not resumed,
+            )
+            if checkpoint is not None:
+                # 途中経過と転置インデックスの内容を揃えるため、掲示板ごとに書き込む
+                on_board_done = self._commit_index_then(checkpoint.board_done)
+
+        completed = False
+        try:
+            self._analyze_log_index(log_index, on_board_done)
+            completed = True
+        finally:
+            if self.index_writer is not None:
+                # 途中で止まった場合は、まとめのテーブルを作り直さずに閉じる
+                self.index_writer.close(rebuild=completed)
+                self.index_writer = None
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        if self.target_prefilter is not None and self.target_prefilter.texts:
+            print(self.target_prefilter.format_stats())
+
+        orphan_count = sum(len(names) for names in self.orphan_thread_files.values())
+        if orphan_count:
+            print(f"subject.jsonに記載されていないスレッドファイル: {orphan_count}件")
 
         print("ログ解析が完了しました")
 
+    def _commit_index_then(self, on_board_done):
+        """転置インデックスに書き込んでから、on_board_done(掲示板)を呼ぶ関数を返す"""
+
+        def commit_index_then(board):
+            self.index_writer.commit()
+            on_board_done(board)
+
+        return commit_index_then
+
+    def _analyze_log_index(self, log_index, on_board_done):
+        """analyze_all_logsの、掲示板を解析して出現回数を数える部分"""
+        if self.processes > 1:
+            # 掲示板ごとに複数のプロセスで解析して、結果をまとめる
+            stats = run_analysis_mapreduce(
+                self, log_index, self.processes, self.partial_dir, on_board_done
+            )
+            print(
+                f"掲示板の解析: {stats['analyzed']}件"
+                f" (保存した結果を使った掲示板: {stats['reused']}件)"
+            )
+        elif self.pipeline:
+            # 読み込み・JSONの解析・形態素解析・集計を段階ごとのスレッドで並行して処理
+            self.pipeline_stats = run_analysis_pipeline(
+                self, log_index, self.pipeline_queue_size, on_board_done
+            )
+            for line in format_pipeline_stats(self.pipeline_stats):
+                print(line)
+        else:
+            # 掲示板サイト内の各掲示板フォルダを処理
+            for site in log_index.sites:
+                for board in tqdm(site.boards, desc=f"解析中: {site.name}"):
+                    self.analyze_board_folder(site.path, board.name, board)
+                    if on_board_done is not None:
+                        on_board_done(board)
+        self.flush_word_counts()
+        if self.ngram_counter is not None:
+            self.ngram_counter.flush()
+
     def get_word_frequency(self, top_n=None):
         """
         単語の出現頻度を返す
@@ -152,20 +544,73 @@ class BBSLogAnalyzer:
         list of tuple
             (単語, 出現回数) のリスト
         """
-        if top_n is None:
-            # 全単語を取得（降順ソート）
-            return sorted(self.words_counter.items(), key=lambda x: x[1], reverse=True)
-        else:
+        counts = self.word_counts
+        # 出現回数の降順（同じ回数なら先に出てきた単語から）に並べる
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        if top_n is not None:
             # 上位N個の単語を取得
-            return self.words_counter.most_common(top_n)
+            order = order[:top_n]
+        words = self.vocabulary.words
+        return [(words[word_id], int(counts[word_id])) for word_id in order]
+
+    def get_ngram_frequency(self, num, top_n=None):
+        """
+        N-gramの出現頻度を返す
+
+        Parameters:
+        -----------
+        num : int
+            N-gramのN（ngram_sizesに指定したもの）
+        top_n : int or None
+            取得する上位N-gram数。Noneの場合は全N-gramを返す
+
+        Returns:
+        --------
+        list of tuple
+            (N-gram, 出現回数) のリスト
+        """
+        if self.ngram_counter is None or num not in self.ngram_counter.nums:
+            raise ValueError(
+                f"{num}-gramは数えていません（ngram_sizesを指定してください）"
+            )
+        return self.ngram_counter.most_common(num, top_n)
 
     def get_monthly_word_count(self, word):
         """指定した単語の月別出現回数を返す"""
-        if word in self.monthly_word_counts:
-            # 日付順にソート
-            sorted_counts = sorted(self.monthly_word_counts[word].items())
-            return sorted_counts
-        return []
+        self.flush_word_counts()
+        word_id = self.vocabulary.get_id(word)
+        if word_id is None:
+            return []
+        # 日付順に、その単語が出現した月の出現回数を取得
+        return self.monthly_word_counts.get_word(word_id)
+
+    def get_monthly_word_matrix(self, words=None):
+        """
+        単語ごとの月別出現回数を、(単語数, 年月の数)の行列でまとめて返す
+
+        Parameters:
+        -----------
+        words : list of str or None
+            行にする単語のリスト。Noneの場合は語彙表の全単語（単語IDの順）
+
+        Returns:
+        --------
+        tuple
+            (年月のリスト, 出現回数の行列)。語彙表に無い単語の行はすべて0
+        """
+        self.flush_word_counts()
+        months = self.monthly_word_counts.months
+        vocabulary_size = len(self.vocabulary)
+        if words is None:
+            return months, self.monthly_word_counts.to_dense(vocabulary_size)
+        word_ids = [self.vocabulary.get_id(word) for word in words]
+        known = [i for i, word_id in enumerate(word_ids) if word_id is not None]
+        matrix = np.zeros((len(words), len(months)), dtype=np.int64)
+        matrix[known] = self.monthly_word_counts.to_dense(
+            vocabulary_size, [word_ids[i] for i in known]
+        )
+        return months, matrix
 
     def export_word_frequency(self, output_file, top_n=None):
         """
@@ -203,6 +648,34 @@ class BBSLogAnalyzer:
                 f"単語頻度上位 {min(top_n, word_count)} 語を {output_file} に出力しました"
             )
 
+    def export_ngram_frequency(self, num, output_file, top_n=None):
+        """
+        N-gramの出現頻度をCSVファイルに出力
+
+        Parameters:
+        -----------
+        num : int
+            N-gramのN（ngram_sizesに指定したもの）
+        output_file : str
+            出力先ファイルパス
+        top_n : int or None
+            出力する上位N-gram数。Noneの場合は全N-gramを出力
+        """
+        most_common = self.get_ngram_frequency(num, top_n)
+
+        # Polarsデータフレームを作成してCSVファイルに出力
+        df = pl.DataFrame(
+            {
+                f"{num}-gram": [ngram for ngram, _ in most_common],
+                "出現回数": [count for _, count in most_common],
+            },
+            schema={f"{num}-gram": pl.String, "出現回数": pl.Int64},
+        )
+        df.write_csv(output_file)
+        print(
+            f"{num}-gram ({len(most_common)}件) の頻度リストを {output_file} に出力しました"
+        )
+
     def export_monthly_word_count(self, word, output_file):
         """指定した単語の月別出現回数をCSVファイルに出力"""
         monthly_counts = self.get_monthly_word_count(word)
@@ -223,6 +696,25 @@ class BBSLogAnalyzer:
         print(f"'{word}' の月別出現回数を {output_file} に出力しました")
         return True
 
+    def export_all_monthly_word_counts(self, output_file):
+        """
+        全単語の月別出現回数を、(単語, 年月, 出現回数)の行のCSVファイルに出力
+        （出現した月の行のみ。単語IDの順、同じ単語なら年月の順）
+        """
+        self.flush_word_counts()
+        word_ids, columns, counts = self.monthly_word_counts.to_coo()
+        words = pl.Series(self.vocabulary.words, dtype=pl.String)
+        months = pl.Series(self.monthly_word_counts.months, dtype=pl.String)
+        df = pl.DataFrame(
+            {
+                "単語": words.gather(word_ids),
+                "年月": months.gather(columns),
+                "出現回数": counts,
+            }
+        )
+        df.write_csv(output_file)
+        print(f"全単語の月別出現回数 ({len(df)}行) を {output_file} に出力しました")
+
     def plot_monthly_word_count(self, word, output_file=None):
         """指定した単語の月別出現回数をグラフ化"""
         monthly_counts = self.get_monthly_word_count(word)
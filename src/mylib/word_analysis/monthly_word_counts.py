@@ -0,0 +1,192 @@
+"""
+単語ID × 年月の出現回数を、疎行列(COO形式)で保持するモジュール
+
+出現した(単語ID, 年月)の組だけを、単語IDと年月の番号をまとめた整数のキー
+(昇順)と出現回数の2つの配列で持つ。キーは単語IDが上位なので、1つの単語の
+月別出現回数は二分探索で取り出せ、全単語の月別出現回数もまとめて取り出せる。
+
+足した組は未反映のバッファに溜めておき、バッファが大きくなった時か出現回数を
+読み出す時に、まとめてキーの配列に反映する（足すたびに配列全体を作り直さない）。
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# キーの下位ビット(年月の番号)の幅
+_MONTH_BITS = 32
+_MONTH_MASK = (1 << _MONTH_BITS) - 1
+# 未反映の組がこの数と反映済みの組の数の大きい方を超えたら反映する
+MERGE_MIN_PENDING = 1 << 20
+
+
+class MonthlyWordCounts:
+    """
+    単語ID × 年月の出現回数の疎行列
+
+    年月は'YYYY-MM'形式の文字列で、出てきた順に番号を付ける（結果は年月の順で返す）。
+    """
+
+    def __init__(self):
+        # 年月の番号順の年月のリストと、{年月: 番号}
+        self._month_labels: List[str] = []
+        self._month_ids: Dict[str, int] = {}
+        # (単語ID << _MONTH_BITS | 年月の番号)の配列(昇順・重複なし)と出現回数の配列
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        # まだ反映していないキーの配列と出現回数の配列のリスト（キーは重複してよい）
+        self._pending_keys: List[np.ndarray] = []
+        self._pending_counts: List[np.ndarray] = []
+        self._pending_size = 0
+
+    def __len__(self) -> int:
+        """出現回数が0でない(単語ID, 年月)の組の数"""
+        self._merge_pending()
+        return len(self._keys)
+
+    @property
+    def months(self) -> List[str]:
+        """出現した年月のリスト（年月の順）"""
+        return sorted(self._month_labels)
+
+    @property
+    def nbytes(self) -> int:
+        """出現回数を保持している配列のバイト数"""
+        return (
+            self._keys.nbytes
+            + self._counts.nbytes
+            + sum(keys.nbytes for keys in self._pending_keys)
+            + sum(counts.nbytes for counts in self._pending_counts)
+        )
+
+    def month_indices(self, year_months: List[str]) -> np.ndarray:
+        """年月のリストを年月の番号の配列にする（初めて出てきた年月は追加する）"""
+        month_ids = self._month_ids
+        labels = self._month_labels
+        indices = np.empty(len(year_months), dtype=np.int64)
+        for i, year_month in enumerate(year_months):
+            month_id = month_ids.get(year_month)
+            if month_id is None:
+                month_id = len(labels)
+                month_ids[year_month] = month_id
+                labels.append(year_month)
+            indices[i] = month_id
+        return indices
+
+    def add(self, word_ids: np.ndarray, month_indices: np.ndarray) -> None:
+        """
+        (単語ID, 年月の番号)の組の出現回数を足す
+
+        word_idsとmonth_indicesは同じ長さの配列で、i番目の組が1回出現したことを表す。
+        """
+        if len(word_ids) == 0:
+            return
+        new_keys, new_counts = np.unique(
+            self._make_keys(word_ids, month_indices), return_counts=True
+        )
+        self._add_keys(new_keys, new_counts.astype(np.int64))
+
+    def add_counts(
+        self, word_ids: np.ndarray, month_indices: np.ndarray, counts: np.ndarray
+    ) -> None:
+        """
+        (単語ID, 年月の番号)の組ごとの出現回数を足す（組は重複しないこと）
+
+        別に数えた月別カウント(to_cooの結果など)をまとめるのに使う。
+        """
+        if len(word_ids) == 0:
+            return
+        self._add_keys(
+            self._make_keys(word_ids, month_indices),
+            np.asarray(counts, dtype=np.int64),
+        )
+
+    @staticmethod
+    def _make_keys(word_ids: np.ndarray, month_indices: np.ndarray) -> np.ndarray:
+        return (np.asarray(word_ids, dtype=np.int64) << _MONTH_BITS) | np.asarray(
+            month_indices, dtype=np.int64
+        )
+
+    def _add_keys(self, new_keys: np.ndarray, new_counts: np.ndarray) -> None:
+        """キーの配列と出現回数の配列を、未反映のバッファに足す"""
+        self._pending_keys.append(new_keys)
+        self._pending_counts.append(new_counts)
+        self._pending_size += len(new_keys)
+        if self._pending_size > max(MERGE_MIN_PENDING, len(self._keys)):
+            self._merge_pending()
+
+    def _merge_pending(self) -> None:
+        """未反映のバッファを、反映済みのキーの配列と出現回数の配列にまとめる"""
+        if not self._pending_keys:
+            return
+        keys, inverse = np.unique(
+            np.concatenate([self._keys, *self._pending_keys]), return_inverse=True
+        )
+        counts = np.bincount(
+            inverse,
+            weights=np.concatenate([self._counts, *self._pending_counts]),
+            minlength=len(keys),
+        )
+        self._keys = keys
+        self._counts = counts.astype(np.int64)
+        self._pending_keys = []
+        self._pending_counts = []
+        self._pending_size = 0
+
+    def _month_ranks(self) -> np.ndarray:
+        """年月の番号 -> monthsでの位置(年月の順の位置)の配列を返す"""
+        order = np.argsort(np.array(self._month_labels, dtype=str), kind="stable")
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        return ranks
+
+    def get_word(self, word_id: int) -> List[Tuple[str, int]]:
+        """1つの単語の月別出現回数を、年月の順に(年月, 出現回数)のリストで返す"""
+        self._merge_pending()
+        start, end = np.searchsorted(
+            self._keys, [word_id << _MONTH_BITS, (word_id + 1) << _MONTH_BITS]
+        )
+        labels = self._month_labels
+        monthly_counts = [
+            (labels[month_id], int(count))
+            for month_id, count in zip(
+                (self._keys[start:end] & _MONTH_MASK).tolist(),
+                self._counts[start:end].tolist(),
+            )
+        ]
+        monthly_counts.sort()
+        return monthly_counts
+
+    def to_coo(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (単語IDの配列, 年月の列の配列, 出現回数の配列)を返す
+        （年月の列はmonthsのインデックス。単語IDの順、同じ単語なら年月の順）
+        """
+        self._merge_pending()
+        word_ids = self._keys >> _MONTH_BITS
+        columns = self._month_ranks()[self._keys & _MONTH_MASK]
+        order = np.lexsort((columns, word_ids))
+        return word_ids[order], columns[order], self._counts[order]
+
+    def to_dense(
+        self, num_words: int, word_ids: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        (単語数, 年月の数)の出現回数の行列を返す（列はmonthsの順）
+
+        word_idsを指定した場合は、その単語の行だけを指定した順に並べた行列を返す
+        （num_wordsは語彙表の単語数。全単語の場合はメモリに注意）。
+        """
+        rows, columns, counts = self.to_coo()
+        if word_ids is not None:
+            # 指定した単語の行の位置に置き換え、指定していない単語の組は除く
+            word_ids = np.asarray(word_ids, dtype=np.int64)
+            row_map = np.full(num_words, -1, dtype=np.int64)
+            row_map[word_ids] = np.arange(len(word_ids))
+            rows = row_map[rows]
+            selected = rows >= 0
+            rows, columns, counts = rows[selected], columns[selected], counts[selected]
+            num_words = len(word_ids)
+        matrix = np.zeros((num_words, len(self._month_labels)), dtype=np.int64)
+        matrix[rows, columns] = counts
+        return matrix